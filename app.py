@@ -1,19 +1,34 @@
-from flask import Flask, render_template, request, jsonify, send_from_directory, send_file
-from downloader import start_download, get_progress, get_download_dir
+import startup  # 最先匯入，用來量測載入其他模組的耗時
+from flask import Flask, render_template, request, jsonify, send_file, Response, redirect
+from downloader import start_download, get_progress, get_download_dir, cancel_download, stream_progress
 import os
 import subprocess
 import uuid
 from pathlib import Path
+from urllib.parse import quote
 from werkzeug.utils import secure_filename
+from audio_stream import FFmpegStream, PIPE_OUTPUT_FORMATS
+from ffmpeg_jobs import submit_job, get_job, cancel_job, stream_job
+from audio_batch import parse_targets, stream_batch_zip
+from audio_trim import trim, fast_trim_cmd, parse_time_range, parse_cuts, TrimError, TRIM_MODES, TRIM_OUTPUTS
+from pdf_merge import page_counts, create_merge_progress, write_pages, merge_plan
+from pdf_optimize import parse_optimize_options
+from pdf_edit import parse_page_range, parse_operations, merge_sources, compile_plan
+from pdf_sessions import create_session, session_info, session_path, delete_session, is_session_id, SessionSource, SessionNotFound, PDF_SESSION_TTL
+from qr_codes import parse_qr_options, get_qr, QR_CACHE_MAX_AGE
+from storage import get_temp_dir, scratch_dir, send_and_delete
+from delivery import send_download, zip_response, folder_entries, file_entries, DeliveryNotFound
+from bg_removal import remove_image_background, parse_model, RembgUnavailable, RembgBusy
+from text_mask import get_mask_pattern, mask_text, mask_stream, STREAM_CHUNK_SIZE
+from short_urls import shorten, resolve, url_stats, ShortUrlNotFound
+from qr_batch import batch_request_items, parse_batch_output, parse_sheet_columns, stream_qr_zip, stream_qr_sheet
+from pdf_thumbnails import normalize_width, get_thumbnail, stream_thumbnails, ThumbnailUnavailable
+import metrics
 
 app = Flask(__name__)
 app.config['MAX_CONTENT_LENGTH'] = 500 * 1024 * 1024  # 500MB max upload
-
-def get_temp_dir():
-    """取得暫存目錄"""
-    temp_dir = Path(__file__).parent / "temp"
-    temp_dir.mkdir(exist_ok=True)
-    return temp_dir
+metrics.init_app(app)
+startup.init_app(app)
 
 @app.route('/')
 def index():
@@ -31,12 +46,25 @@ def download():
     data = request.get_json()
     url = data.get('url', '')
     is_playlist = data.get('is_playlist', False)
+    priority = data.get('priority', 0)
     
     if not url:
         return jsonify({'error': '請輸入影片網址'}), 400
     
-    task_id = start_download(url, is_playlist)
-    return jsonify({'task_id': task_id, 'message': '開始下載...'})
+    try:
+        priority = int(priority)
+    except (TypeError, ValueError):
+        return jsonify({'error': '優先順序必須是整數'}), 400
+    
+    task_id = start_download(url, is_playlist, priority)
+    return jsonify({'task_id': task_id, 'message': '已加入下載佇列'})
+
+@app.route('/api/download/<task_id>/cancel', methods=['POST'])
+def cancel(task_id):
+    """取消下載任務"""
+    if not cancel_download(task_id):
+        return jsonify({'error': '找不到可取消的任務'}), 404
+    return jsonify({'success': True, 'task_id': task_id})
 
 @app.route('/api/progress/<task_id>')
 def progress(task_id):
@@ -44,26 +72,96 @@ def progress(task_id):
     status = get_progress(task_id)
     return jsonify(status)
 
+@app.route('/api/progress/<task_id>/stream')
+def progress_stream(task_id):
+    """以 Server-Sent Events 推送下載進度"""
+    return Response(
+        stream_progress(task_id),
+        mimetype='text/event-stream',
+        headers={
+            'Cache-Control': 'no-cache',
+            'X-Accel-Buffering': 'no',  # 避免反向代理緩衝事件
+        }
+    )
+
 @app.route('/downloads/<path:filename>')
 def download_file(filename):
-    """提供下載檔案"""
-    download_dir = get_download_dir()
-    return send_from_directory(download_dir, filename, as_attachment=True)
+    """提供下載檔案（支援 Range 續傳與 ETag）"""
+    try:
+        return send_download(filename)
+    except DeliveryNotFound:
+        return jsonify({'error': '檔案不存在或已過期'}), 404
+
+@app.route('/api/downloads/zip')
+def download_zip():
+    """把播放清單打包成 ZIP 下載（不重新壓縮、邊讀邊送，支援 Range 續傳）
+    
+    參數：task_id（下載任務的所有檔案）或 folder（下載目錄中的資料夾）。
+    """
+    task_id = request.args.get('task_id')
+    folder = request.args.get('folder')
+    try:
+        if task_id:
+            progress = get_progress(task_id)
+            if progress['status'] != 'completed':
+                return jsonify({'error': '下載尚未完成'}), 409
+            entries = file_entries(progress.get('files') or [])
+            name = progress.get('title') or 'playlist'
+        elif folder:
+            entries = folder_entries(folder)
+            name = Path(folder).name
+        else:
+            return jsonify({'error': '請指定 task_id 或 folder'}), 400
+        name = name.replace('/', '_').replace('\\', '_').strip() or 'playlist'
+        return zip_response(entries, attachment_headers(f"{name}.zip"))
+    except DeliveryNotFound:
+        return jsonify({'error': '檔案不存在或已過期'}), 404
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+def build_convert_cmd(input_path, output_path, bitrate):
+    """產生轉換為 MP3 的 FFmpeg 指令"""
+    return [
+        'ffmpeg', '-y',
+        '-i', str(input_path),
+        '-vn',  # 忽略視訊
+        '-acodec', 'libmp3lame',
+        '-ab', f'{bitrate}k',
+        '-ar', '44100',  # 取樣率
+        '-ac', '2',  # 雙聲道
+        str(output_path)
+    ]
 
 @app.route('/api/trim', methods=['POST'])
 def trim_audio():
-    """切割音訊檔案"""
+    """切割音訊檔案
+
+    可用 cuts（如 '0-10.5,1:00-1:30'）一次切割多段，多段時依 output
+    打包為 zip 或串接為單一檔案；mode 為 fast（複製串流）或 exact。
+    """
     if 'audio' not in request.files:
         return jsonify({'error': '請上傳音訊檔案'}), 400
     
     audio_file = request.files['audio']
-    start_time = request.form.get('start_time', 0, type=int)
-    end_time = request.form.get('end_time', 0, type=int)
+    mode = request.form.get('mode', 'fast')
+    output_mode = request.form.get('output', 'zip')
     
     if not audio_file.filename:
         return jsonify({'error': '請選擇檔案'}), 400
     
-    temp_dir = get_temp_dir()
+    if mode not in TRIM_MODES or output_mode not in TRIM_OUTPUTS:
+        return jsonify({'error': '切割模式錯誤'}), 400
+    
+    try:
+        if request.form.get('cuts'):
+            cuts = parse_cuts(request.form['cuts'])
+        else:
+            cuts = [parse_time_range(request.form.get('start_time', '0'), request.form.get('end_time', '0'))]
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    # 小檔案可使用記憶體暫存目錄（SCRATCH_DIR）
+    temp_dir = scratch_dir(request.content_length)
     filename = secure_filename(audio_file.filename)
     input_path = temp_dir / f"input_{uuid.uuid4()}_{filename}"
     output_path = temp_dir / f"trimmed_{uuid.uuid4()}_{filename}"
@@ -72,32 +170,28 @@ def trim_audio():
         audio_file.save(str(input_path))
         
         # 使用 FFmpeg 切割
-        duration = end_time - start_time
-        cmd = [
-            'ffmpeg', '-y',
-            '-i', str(input_path),
-            '-ss', str(start_time),
-            '-t', str(duration),
-            '-c', 'copy',
-            str(output_path)
-        ]
-        
-        result = subprocess.run(cmd, capture_output=True, text=True)
-        
-        if result.returncode != 0:
-            return jsonify({'error': f'FFmpeg 錯誤: {result.stderr}'}), 500
-        
-        return send_file(
-            str(output_path),
+        try:
+            result_path = trim(
+                input_path, cuts, mode, output_mode, output_path,
+                f"trimmed_{os.path.splitext(filename)[0]}", temp_dir
+            )
+        except TrimError as e:
+            # trim 已刪除寫到一半的輸出
+            return jsonify({'error': f'FFmpeg 錯誤: {e}'}), 500
+        
+        return send_and_delete(
+            result_path,
             as_attachment=True,
-            download_name=f"trimmed_{filename}"
+            download_name=f"trimmed_{os.path.splitext(filename)[0]}{result_path.suffix}"
         )
         
     finally:
-        # 清理暫存檔案
+        # 清理暫存檔案（輸出檔在送出時刪除）
         if input_path.exists():
             input_path.unlink()
-        # output_path 會在送出後自動清理
+
+# 支援的音訊格式
+CONVERT_EXTENSIONS = {'.wav', '.flac', '.ogg', '.m4a', '.aac', '.wma', '.opus', '.webm', '.mp4', '.avi', '.mkv', '.mov'}
 
 @app.route('/api/convert-to-mp3', methods=['POST'])
 def convert_to_mp3():
@@ -111,14 +205,12 @@ def convert_to_mp3():
     if not audio_file.filename:
         return jsonify({'error': '請選擇檔案'}), 400
     
-    # 支援的音訊格式
-    allowed_extensions = {'.wav', '.flac', '.ogg', '.m4a', '.aac', '.wma', '.opus', '.webm', '.mp4', '.avi', '.mkv', '.mov'}
     file_ext = os.path.splitext(audio_file.filename)[1].lower()
     
-    if file_ext not in allowed_extensions and file_ext != '.mp3':
-        return jsonify({'error': f'不支援的檔案格式: {file_ext}。支援格式: {", ".join(allowed_extensions)}'}), 400
+    if file_ext not in CONVERT_EXTENSIONS and file_ext != '.mp3':
+        return jsonify({'error': f'不支援的檔案格式: {file_ext}。支援格式: {", ".join(CONVERT_EXTENSIONS)}'}), 400
     
-    temp_dir = get_temp_dir()
+    temp_dir = scratch_dir(request.content_length)
     filename = secure_filename(audio_file.filename)
     input_path = temp_dir / f"input_{uuid.uuid4()}_{filename}"
     
@@ -130,27 +222,22 @@ def convert_to_mp3():
         audio_file.save(str(input_path))
         
         # 使用 FFmpeg 轉換
-        cmd = [
-            'ffmpeg', '-y',
-            '-i', str(input_path),
-            '-vn',  # 忽略視訊
-            '-acodec', 'libmp3lame',
-            '-ab', f'{bitrate}k',
-            '-ar', '44100',  # 取樣率
-            '-ac', '2',  # 雙聲道
-            str(output_path)
-        ]
+        cmd = build_convert_cmd(input_path, output_path, bitrate)
         
-        result = subprocess.run(cmd, capture_output=True, text=True)
+        with metrics.stage('ffmpeg.convert') as stage:
+            result = subprocess.run(cmd, capture_output=True, text=True)
+            stage.failed = result.returncode != 0
         
         if result.returncode != 0:
+            if output_path.exists():
+                output_path.unlink()
             return jsonify({'error': f'轉換失敗: {result.stderr}'}), 500
         
         if not output_path.exists():
             return jsonify({'error': '轉換失敗：輸出檔案不存在'}), 500
         
-        return send_file(
-            str(output_path),
+        return send_and_delete(
+            output_path,
             as_attachment=True,
             download_name=output_filename
         )
@@ -158,173 +245,465 @@ def convert_to_mp3():
     except Exception as e:
         return jsonify({'error': str(e)}), 500
     finally:
-        # 清理暫存檔案
+        # 清理暫存檔案（輸出檔在送出時刪除）
         if input_path.exists():
             input_path.unlink()
 
-# ============ PDF APIs ============
-
-@app.route('/api/pdf/merge', methods=['POST'])
-def merge_pdfs():
-    """合併多個 PDF"""
-    if 'pdfs' not in request.files:
-        return jsonify({'error': '請上傳 PDF 檔案'}), 400
+@app.route('/api/convert/batch', methods=['POST'])
+def convert_batch():
+    """批次轉換多個音訊檔案，可同時輸出多種格式，結果以 ZIP 串流回傳"""
+    files = [f for f in request.files.getlist('audio') if f.filename]
+    if not files:
+        return jsonify({'error': '請上傳音訊檔案'}), 400
     
-    files = request.files.getlist('pdfs')
-    if len(files) < 2:
-        return jsonify({'error': '請至少上傳 2 個 PDF 檔案'}), 400
+    try:
+        targets = parse_targets(request.form.get('targets', ''))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    for f in files:
+        file_ext = os.path.splitext(f.filename)[1].lower()
+        if file_ext not in CONVERT_EXTENSIONS and file_ext != '.mp3':
+            return jsonify({'error': f'不支援的檔案格式: {file_ext}。支援格式: {", ".join(CONVERT_EXTENSIONS)}'}), 400
     
     temp_dir = get_temp_dir()
-    input_paths = []
-    output_path = temp_dir / f"merged_{uuid.uuid4()}.pdf"
+    inputs = []
+    for f in files:
+        filename = secure_filename(f.filename)
+        input_path = temp_dir / f"input_{uuid.uuid4()}_{filename}"
+        f.save(str(input_path))
+        inputs.append((input_path, os.path.splitext(filename)[0] or 'audio'))
+    
+    return Response(
+        stream_batch_zip(inputs, targets, temp_dir),
+        mimetype='application/zip',
+        headers=attachment_headers('converted.zip')
+    )
+
+# ============ 非同步 FFmpeg 工作 ============
+# 上傳後立即回傳 job_id，由背景執行 FFmpeg，可查詢進度、取消與下載結果。
+
+@app.route('/api/jobs/trim', methods=['POST'])
+def submit_trim_job():
+    """送出切割音訊工作"""
+    if 'audio' not in request.files:
+        return jsonify({'error': '請上傳音訊檔案'}), 400
+    
+    audio_file = request.files['audio']
+    
+    if not audio_file.filename:
+        return jsonify({'error': '請選擇檔案'}), 400
     
     try:
-        # 儲存上傳的檔案
-        for f in files:
-            path = temp_dir / f"input_{uuid.uuid4()}_{secure_filename(f.filename)}"
-            f.save(str(path))
-            input_paths.append(str(path))
-        
-        # 使用 PyPDF2 合併
-        from PyPDF2 import PdfMerger
-        merger = PdfMerger()
-        for path in input_paths:
-            merger.append(path)
-        merger.write(str(output_path))
-        merger.close()
-        
-        return send_file(str(output_path), as_attachment=True, download_name="merged.pdf")
-        
-    finally:
-        for path in input_paths:
-            if Path(path).exists():
-                Path(path).unlink()
+        start_time, end_time = parse_time_range(request.form.get('start_time', '0'), request.form.get('end_time', '0'))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    temp_dir = get_temp_dir()
+    filename = secure_filename(audio_file.filename)
+    input_path = temp_dir / f"input_{uuid.uuid4()}_{filename}"
+    output_path = temp_dir / f"trimmed_{uuid.uuid4()}_{filename}"
+    audio_file.save(str(input_path))
+    
+    job_id = submit_job(
+        'trim',
+        fast_trim_cmd(input_path, output_path, start_time, end_time),
+        [input_path],
+        output_path,
+        f"trimmed_{filename}",
+        audio_file.mimetype or 'application/octet-stream',
+        duration=end_time - start_time
+    )
+    return jsonify({'job_id': job_id})
 
-@app.route('/api/pdf/split', methods=['POST'])
-def split_pdf():
-    """分割 PDF"""
-    if 'pdf' not in request.files:
-        return jsonify({'error': '請上傳 PDF 檔案'}), 400
+@app.route('/api/jobs/convert-to-mp3', methods=['POST'])
+def submit_convert_job():
+    """送出轉換為 MP3 工作"""
+    if 'audio' not in request.files:
+        return jsonify({'error': '請上傳音訊檔案'}), 400
     
-    pdf_file = request.files['pdf']
-    split_pages = request.form.get('pages', '')  # e.g., "1-3,5,7-9"
+    audio_file = request.files['audio']
+    bitrate = request.form.get('bitrate', '192')
+    
+    if not audio_file.filename:
+        return jsonify({'error': '請選擇檔案'}), 400
+    
+    if not bitrate.isdigit():
+        return jsonify({'error': '位元率格式錯誤'}), 400
+    
+    file_ext = os.path.splitext(audio_file.filename)[1].lower()
+    if file_ext not in CONVERT_EXTENSIONS and file_ext != '.mp3':
+        return jsonify({'error': f'不支援的檔案格式: {file_ext}。支援格式: {", ".join(CONVERT_EXTENSIONS)}'}), 400
     
     temp_dir = get_temp_dir()
-    input_path = temp_dir / f"input_{uuid.uuid4()}.pdf"
-    output_path = temp_dir / f"split_{uuid.uuid4()}.pdf"
+    filename = secure_filename(audio_file.filename)
+    input_path = temp_dir / f"input_{uuid.uuid4()}_{filename}"
+    output_filename = os.path.splitext(filename)[0] + '.mp3'
+    output_path = temp_dir / f"converted_{uuid.uuid4()}_{output_filename}"
+    audio_file.save(str(input_path))
+    
+    job_id = submit_job(
+        'convert',
+        build_convert_cmd(input_path, output_path, bitrate),
+        [input_path],
+        output_path,
+        output_filename,
+        'audio/mpeg'
+    )
+    return jsonify({'job_id': job_id})
+
+@app.route('/api/jobs/<job_id>')
+def job_status(job_id):
+    """查詢 FFmpeg 工作狀態"""
+    return jsonify(get_job(job_id))
+
+@app.route('/api/jobs/<job_id>/stream')
+def job_stream(job_id):
+    """以 Server-Sent Events 推送 FFmpeg 工作進度"""
+    return Response(
+        stream_job(job_id),
+        mimetype='text/event-stream',
+        headers={
+            'Cache-Control': 'no-cache',
+            'X-Accel-Buffering': 'no',
+        }
+    )
+
+@app.route('/api/jobs/<job_id>/cancel', methods=['POST'])
+def job_cancel(job_id):
+    """取消 FFmpeg 工作"""
+    if not cancel_job(job_id):
+        return jsonify({'error': '找不到可取消的工作'}), 404
+    return jsonify({'success': True, 'job_id': job_id})
+
+@app.route('/api/jobs/<job_id>/result')
+def job_result(job_id):
+    """下載 FFmpeg 工作結果"""
+    job = get_job(job_id, public=False)
+    if job['status'] == 'not_found':
+        return jsonify({'error': '找不到工作'}), 404
+    if job['status'] != 'completed':
+        return jsonify({'error': '工作尚未完成', 'status': job['status']}), 409
+    if not Path(job['output']).exists():
+        return jsonify({'error': '結果檔案已過期'}), 410
+    return send_file(
+        job['output'],
+        mimetype=job['mimetype'],
+        as_attachment=True,
+        download_name=job['download_name']
+    )
+
+# ============ 串流音訊處理 ============
+# 請求內容即為原始檔案（非 multipart 表單），參數放在查詢字串，
+# 上傳的同時就送入 FFmpeg，輸出也以 chunked 方式邊轉邊回傳。
+
+def attachment_headers(download_name):
+    """產生下載檔名標頭（支援非 ASCII 檔名）"""
+    return {'Content-Disposition': f"attachment; filename*=UTF-8''{quote(download_name)}"}
+
+def stream_ffmpeg_response(ffmpeg_stream, mimetype, download_name, error_prefix):
+    """等到 FFmpeg 開始輸出後回傳串流回應，失敗則回傳 JSON 錯誤"""
+    error = ffmpeg_stream.start()
+    if error:
+        return jsonify({'error': f'{error_prefix}: {error}'}), 500
+    return Response(
+        ffmpeg_stream.iter_output(),
+        mimetype=mimetype,
+        headers=attachment_headers(download_name)
+    )
+
+@app.route('/api/trim/stream', methods=['POST'])
+def trim_audio_stream():
+    """切割音訊檔案（上傳內容直接寫入磁碟，輸出串流下載）"""
+    filename = request.args.get('filename', '')
+    
+    if not filename:
+        return jsonify({'error': '請選擇檔案'}), 400
     
     try:
-        pdf_file.save(str(input_path))
-        
-        from PyPDF2 import PdfReader, PdfWriter
-        reader = PdfReader(str(input_path))
-        writer = PdfWriter()
-        
-        # 解析頁碼
-        pages_to_extract = parse_page_range(split_pages, len(reader.pages))
-        
-        for page_num in pages_to_extract:
-            writer.add_page(reader.pages[page_num - 1])
-        
-        with open(str(output_path), 'wb') as f:
-            writer.write(f)
-        
-        return send_file(str(output_path), as_attachment=True, download_name="split.pdf")
-        
-    finally:
-        if input_path.exists():
-            input_path.unlink()
+        start_time, end_time = parse_time_range(request.args.get('start_time', '0'), request.args.get('end_time', '0'))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    file_ext = os.path.splitext(filename)[1].lower()
+    if file_ext not in PIPE_OUTPUT_FORMATS:
+        return jsonify({'error': f'不支援串流切割的檔案格式: {file_ext}'}), 400
+    
+    ffmpeg_stream = FFmpegStream(
+        request.stream,
+        file_ext,
+        ['-ss', f'{start_time:.6f}'],
+        ['-t', f'{end_time - start_time:.6f}', '-c', 'copy', *PIPE_OUTPUT_FORMATS[file_ext]],
+        get_temp_dir()
+    )
+    return stream_ffmpeg_response(
+        ffmpeg_stream,
+        request.mimetype if request.mimetype.startswith('audio/') else 'application/octet-stream',
+        f"trimmed_{filename}",
+        'FFmpeg 錯誤'
+    )
 
-@app.route('/api/pdf/rotate', methods=['POST'])
-def rotate_pdf():
-    """旋轉 PDF 頁面"""
+@app.route('/api/convert-to-mp3/stream', methods=['POST'])
+def convert_to_mp3_stream():
+    """將其他音訊格式轉換為 MP3（上傳內容直接寫入磁碟，輸出串流下載）"""
+    filename = request.args.get('filename', '')
+    bitrate = request.args.get('bitrate', '192')
+    
+    if not filename:
+        return jsonify({'error': '請選擇檔案'}), 400
+    
+    if not bitrate.isdigit():
+        return jsonify({'error': '位元率格式錯誤'}), 400
+    
+    file_ext = os.path.splitext(filename)[1].lower()
+    if file_ext not in CONVERT_EXTENSIONS and file_ext != '.mp3':
+        return jsonify({'error': f'不支援的檔案格式: {file_ext}。支援格式: {", ".join(CONVERT_EXTENSIONS)}'}), 400
+    
+    ffmpeg_stream = FFmpegStream(
+        request.stream,
+        file_ext,
+        [],
+        ['-vn', '-acodec', 'libmp3lame', '-ab', f'{bitrate}k', '-ar', '44100', '-ac', '2', '-f', 'mp3'],
+        get_temp_dir()
+    )
+    return stream_ffmpeg_response(
+        ffmpeg_stream,
+        'audio/mpeg',
+        os.path.splitext(filename)[0] + '.mp3',
+        '轉換失敗'
+    )
+
+# ============ PDF APIs ============
+
+@app.route('/api/pdf/sessions', methods=['POST'])
+def create_pdf_session():
+    """上傳 PDF 建立文件工作階段，之後的操作以 session 參數引用，不需重新上傳"""
     if 'pdf' not in request.files:
         return jsonify({'error': '請上傳 PDF 檔案'}), 400
+    try:
+        return jsonify(create_session(request.files['pdf']))
+    except Exception as e:
+        return jsonify({'error': f'無法讀取 PDF: {e}'}), 400
+
+@app.route('/api/pdf/sessions/<session_id>', methods=['GET'])
+def pdf_session_info(session_id):
+    """查詢文件工作階段"""
+    try:
+        return jsonify(session_info(session_id))
+    except SessionNotFound:
+        return jsonify({'error': '文件不存在或已過期'}), 404
+
+@app.route('/api/pdf/sessions/<session_id>', methods=['DELETE'])
+def remove_pdf_session(session_id):
+    """結束使用文件工作階段（其他人可能上傳了相同檔案，檔案在閒置逾時後才刪除）"""
+    if not delete_session(session_id):
+        return jsonify({'error': '文件不存在或已過期'}), 404
+    return jsonify({'success': True})
+
+@app.route('/api/pdf/sessions/<session_id>/thumbnails')
+def pdf_thumbnails(session_id):
+    """以 Server-Sent Events 逐批回報已完成的頁面縮圖（前面的頁面先完成）
     
-    pdf_file = request.files['pdf']
-    rotation = request.form.get('rotation', 90, type=int)  # 90, 180, 270
-    pages = request.form.get('pages', 'all')  # "all" or "1,2,3"
+    查詢參數 width 為縮圖寬度，pages 為頁碼範圍（預設全部）。
+    """
+    try:
+        info = session_info(session_id)
+        path = session_path(session_id)
+        pages = parse_page_range(request.args.get('pages', ''), info['pages'])
+    except SessionNotFound:
+        return jsonify({'error': '文件不存在或已過期'}), 404
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    width = normalize_width(request.args.get('width', 200, type=int))
     
-    temp_dir = get_temp_dir()
-    input_path = temp_dir / f"input_{uuid.uuid4()}.pdf"
-    output_path = temp_dir / f"rotated_{uuid.uuid4()}.pdf"
+    try:
+        events = stream_thumbnails(session_id, path, pages, width)
+        first = next(events)  # 先確認可以渲染，錯誤仍能以 JSON 回報
+    except ThumbnailUnavailable as e:
+        return jsonify({'error': str(e)}), 500
     
+    def generate():
+        yield first
+        yield from events
+    
+    return Response(
+        generate(),
+        mimetype='text/event-stream',
+        headers={
+            'Cache-Control': 'no-cache',
+            'X-Accel-Buffering': 'no',
+        }
+    )
+
+@app.route('/api/pdf/sessions/<session_id>/thumbnails/<int:page>')
+def pdf_thumbnail(session_id, page):
+    """取得單一頁面縮圖（以文件雜湊為鍵，內容不會改變，可長期快取）"""
     try:
-        pdf_file.save(str(input_path))
-        
-        from PyPDF2 import PdfReader, PdfWriter
-        reader = PdfReader(str(input_path))
-        writer = PdfWriter()
-        
-        if pages == 'all':
-            pages_to_rotate = list(range(1, len(reader.pages) + 1))
-        else:
-            pages_to_rotate = [int(p.strip()) for p in pages.split(',')]
-        
-        for i, page in enumerate(reader.pages):
-            if (i + 1) in pages_to_rotate:
-                page.rotate(rotation)
-            writer.add_page(page)
-        
-        with open(str(output_path), 'wb') as f:
-            writer.write(f)
-        
-        return send_file(str(output_path), as_attachment=True, download_name="rotated.pdf")
-        
-    finally:
-        if input_path.exists():
-            input_path.unlink()
+        info = session_info(session_id)
+        path = session_path(session_id)
+    except SessionNotFound:
+        return jsonify({'error': '文件不存在或已過期'}), 404
+    if not 1 <= page <= info['pages']:
+        return jsonify({'error': '頁碼超出範圍'}), 404
+    width = normalize_width(request.args.get('width', 200, type=int))
+    
+    try:
+        thumbnail = get_thumbnail(session_id, path, page, width)
+    except ThumbnailUnavailable as e:
+        return jsonify({'error': str(e)}), 500
+    except Exception as e:
+        return jsonify({'error': f'無法產生預覽: {e}'}), 500
+    
+    response = send_file(str(thumbnail), mimetype='image/jpeg', conditional=True, max_age=PDF_SESSION_TTL)
+    response.headers['Cache-Control'] = f'private, max-age={PDF_SESSION_TTL}, immutable'
+    return response
 
-@app.route('/api/pdf/delete', methods=['POST'])
-def delete_pdf_pages():
-    """刪除 PDF 頁面"""
-    if 'pdf' not in request.files:
-        return jsonify({'error': '請上傳 PDF 檔案'}), 400
+class PdfInputs:
+    """收集 PDF 輸入：上傳檔存到暫存目錄，工作階段直接引用"""
     
-    pdf_file = request.files['pdf']
-    pages_to_delete = request.form.get('pages', '')  # "1,3,5"
+    def __init__(self):
+        self.sources = []
+        self.temp_paths = []
     
-    temp_dir = get_temp_dir()
-    input_path = temp_dir / f"input_{uuid.uuid4()}.pdf"
-    output_path = temp_dir / f"deleted_{uuid.uuid4()}.pdf"
+    def add_upload(self, file_storage):
+        path = get_temp_dir() / f"input_{uuid.uuid4()}.pdf"
+        self.temp_paths.append(str(path))
+        file_storage.save(str(path))
+        self.sources.append(str(path))
+    
+    def add_session(self, session_id):
+        session_path(session_id)  # 不存在時拋出 SessionNotFound
+        self.sources.append(SessionSource(session_id))
+    
+    def cleanup(self):
+        for path in self.temp_paths:
+            if Path(path).exists():
+                Path(path).unlink()
+
+def stream_pdf_response(inputs, plan, download_name, kind):
+    """以串流回傳依頁面計畫產生的 PDF，進度可用 X-Progress-Id 查詢
     
+    所有 PDF 端點都可加上 optimize=1（以及 image_dpi、jpeg_quality）壓縮輸出。
+    """
     try:
-        pdf_file.save(str(input_path))
-        
-        from PyPDF2 import PdfReader, PdfWriter
-        reader = PdfReader(str(input_path))
-        writer = PdfWriter()
-        
-        delete_set = set(int(p.strip()) for p in pages_to_delete.split(',') if p.strip())
-        
-        for i, page in enumerate(reader.pages):
-            if (i + 1) not in delete_set:
-                writer.add_page(page)
-        
-        with open(str(output_path), 'wb') as f:
-            writer.write(f)
-        
-        return send_file(str(output_path), as_attachment=True, download_name="modified.pdf")
-        
-    finally:
-        if input_path.exists():
-            input_path.unlink()
+        optimize = parse_optimize_options(request.form)
+    except ValueError as e:
+        inputs.cleanup()
+        return jsonify({'error': str(e)}), 400
+    progress_id = create_merge_progress(len(plan), kind=kind)
+    
+    def generate():
+        try:
+            yield from write_pages(inputs.sources, plan, progress_id, optimize)
+        finally:
+            inputs.cleanup()
+    
+    response = Response(generate(), mimetype='application/pdf', headers=attachment_headers(download_name))
+    response.headers['X-Progress-Id'] = progress_id
+    return response
 
-def parse_page_range(page_string, total_pages):
-    """解析頁碼範圍字串，如 '1-3,5,7-9'"""
-    pages = set()
-    if not page_string:
-        return list(range(1, total_pages + 1))
-    
-    for part in page_string.split(','):
-        part = part.strip()
-        if '-' in part:
-            start, end = part.split('-')
-            pages.update(range(int(start), int(end) + 1))
+def run_pdf_operations(operations, download_name, kind):
+    """讀取主文件（上傳的 pdf 或 session）與合併檔，編譯操作清單後單次輸出"""
+    try:
+        fields = merge_sources(operations)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    session_id = request.form.get('session')
+    if 'pdf' not in request.files and not session_id:
+        return jsonify({'error': '請上傳 PDF 檔案'}), 400
+    
+    inputs = PdfInputs()
+    try:
+        if 'pdf' in request.files:
+            inputs.add_upload(request.files['pdf'])
         else:
-            pages.add(int(part))
+            inputs.add_session(session_id)
+        for field in fields:
+            if field in request.files:
+                inputs.add_upload(request.files[field])
+            elif is_session_id(field):
+                inputs.add_session(field)
+            else:
+                inputs.cleanup()
+                return jsonify({'error': f'缺少合併檔案: {field}'}), 400
+        counts = page_counts(inputs.sources)
+        plan = compile_plan(operations, counts)
+    except SessionNotFound:
+        inputs.cleanup()
+        return jsonify({'error': '文件不存在或已過期，請重新上傳'}), 404
+    except ValueError as e:
+        inputs.cleanup()
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        inputs.cleanup()
+        return jsonify({'error': f'無法讀取 PDF: {e}'}), 400
+    
+    return stream_pdf_response(inputs, plan, download_name, kind)
+
+@app.route('/api/pdf/merge', methods=['POST'])
+def merge_pdfs():
+    """合併多個 PDF（逐頁串流輸出，進度可用 X-Progress-Id 查詢）
+    
+    可上傳 pdfs 檔案，或以 sessions（逗號分隔的工作階段 ID）引用已上傳的文件。
+    """
+    files = request.files.getlist('pdfs')
+    session_ids = [s.strip() for s in request.form.get('sessions', '').split(',') if s.strip()]
+    if len(files) + len(session_ids) < 2:
+        return jsonify({'error': '請至少上傳 2 個 PDF 檔案'}), 400
+    
+    inputs = PdfInputs()
+    try:
+        for f in files:
+            inputs.add_upload(f)
+        for session_id in session_ids:
+            inputs.add_session(session_id)
+        
+        # 開始輸出前先檢查所有檔案，錯誤仍能以 JSON 回報
+        counts = page_counts(inputs.sources)
+    except SessionNotFound:
+        inputs.cleanup()
+        return jsonify({'error': '文件不存在或已過期，請重新上傳'}), 404
+    except Exception as e:
+        inputs.cleanup()
+        return jsonify({'error': f'無法讀取 PDF: {e}'}), 400
     
-    return sorted([p for p in pages if 1 <= p <= total_pages])
+    return stream_pdf_response(inputs, merge_plan(counts), 'merged.pdf', 'pdf_merge')
+
+@app.route('/api/pdf/edit', methods=['POST'])
+def edit_pdf():
+    """依操作清單編輯 PDF（選取、旋轉、刪除、重排、插入其他檔案），單次讀寫完成
+    
+    operations 為 JSON 陣列，例如：
+    [{"op": "select", "pages": "1-10"}, {"op": "rotate", "pages": "2,3", "angle": 90},
+     {"op": "delete", "pages": "5"}, {"op": "reorder", "order": "3,1,2,4-8"},
+     {"op": "merge", "file": "extra", "pages": "1-2", "after": 4}]
+    merge 的 file 為另一個上傳欄位名稱或工作階段 ID。
+    """
+    try:
+        operations = parse_operations(request.form.get('operations'))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return run_pdf_operations(operations, 'edited.pdf', 'pdf_edit')
+
+@app.route('/api/pdf/split', methods=['POST'])
+def split_pdf():
+    """分割 PDF"""
+    split_pages = request.form.get('pages', '')  # e.g., "1-3,5,7-9"
+    return run_pdf_operations([{'op': 'select', 'pages': split_pages}], 'split.pdf', 'pdf_split')
+
+@app.route('/api/pdf/rotate', methods=['POST'])
+def rotate_pdf():
+    """旋轉 PDF 頁面"""
+    rotation = request.form.get('rotation', 90, type=int)  # 90, 180, 270
+    pages = request.form.get('pages', 'all')  # "all" or "1,2,3"
+    return run_pdf_operations([{'op': 'rotate', 'pages': pages, 'angle': rotation}], 'rotated.pdf', 'pdf_rotate')
+
+@app.route('/api/pdf/delete', methods=['POST'])
+def delete_pdf_pages():
+    """刪除 PDF 頁面"""
+    pages_to_delete = request.form.get('pages', '')  # "1,3,5"
+    return run_pdf_operations([{'op': 'delete', 'pages': pages_to_delete}], 'modified.pdf', 'pdf_delete')
 
 # ============ QR Code & URL Shortener ============
 
@@ -338,6 +717,22 @@ def tools_page():
     """更多工具頁面"""
     return render_template('tools.html')
 
+def qrcode_image_url(content, options):
+    """可被瀏覽器與 CDN 快取的 QR Code 圖片網址"""
+    from urllib.parse import urlencode
+    return '/api/qrcode/image?' + urlencode({'content': content, **options})
+
+def qrcode_response(content, options, download=False):
+    """回傳 QR Code 圖片（含 ETag 與 Cache-Control，支援 304）"""
+    image, mimetype, etag = get_qr(content, options)
+    response = Response(image, mimetype=mimetype)
+    response.set_etag(etag)
+    response.cache_control.public = True
+    response.cache_control.max_age = QR_CACHE_MAX_AGE
+    if download:
+        response.headers.update(attachment_headers(f"qrcode.{options['format']}"))
+    return response.make_conditional(request)
+
 @app.route('/api/qrcode', methods=['POST'])
 def generate_qrcode():
     """產生 QR Code"""
@@ -348,35 +743,37 @@ def generate_qrcode():
         return jsonify({'error': '請輸入內容'}), 400
     
     try:
-        import qrcode
-        from io import BytesIO
         import base64
         
-        qr = qrcode.QRCode(
-            version=1,
-            error_correction=qrcode.constants.ERROR_CORRECT_H,
-            box_size=10,
-            border=4,
-        )
-        qr.add_data(content)
-        qr.make(fit=True)
-        
-        img = qr.make_image(fill_color="black", back_color="white")
-        
-        buffer = BytesIO()
-        img.save(buffer, format='PNG')
-        buffer.seek(0)
-        
-        img_base64 = base64.b64encode(buffer.getvalue()).decode()
+        options = parse_qr_options(data)
+        image, mimetype, _ = get_qr(content, options)
+        img_base64 = base64.b64encode(image).decode()
         
         return jsonify({
             'success': True,
-            'image': f'data:image/png;base64,{img_base64}'
+            'image': f'data:{mimetype};base64,{img_base64}',
+            'url': qrcode_image_url(content, options)
         })
         
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@app.route('/api/qrcode/image', methods=['GET'])
+def qrcode_image():
+    """以 GET 取得 QR Code 圖片（參數：content、format、size、border、error_correction、download）"""
+    content = request.args.get('content', '')
+    
+    if not content:
+        return jsonify({'error': '請輸入內容'}), 400
+    
+    try:
+        options = parse_qr_options(request.args)
+        return qrcode_response(content, options, download=request.args.get('download') == '1')
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
 @app.route('/api/qrcode/download', methods=['POST'])
 def download_qrcode():
     """下載 QR Code"""
@@ -387,62 +784,78 @@ def download_qrcode():
         return jsonify({'error': '請輸入內容'}), 400
     
     try:
-        import qrcode
-        from io import BytesIO
-        
-        qr = qrcode.QRCode(
-            version=1,
-            error_correction=qrcode.constants.ERROR_CORRECT_H,
-            box_size=10,
-            border=4,
-        )
-        qr.add_data(content)
-        qr.make(fit=True)
-        
-        img = qr.make_image(fill_color="black", back_color="white")
-        
-        buffer = BytesIO()
-        img.save(buffer, format='PNG')
-        buffer.seek(0)
-        
-        return send_file(buffer, mimetype='image/png', as_attachment=True, download_name='qrcode.png')
+        options = parse_qr_options(data)
+        return qrcode_response(content, options, download=True)
         
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@app.route('/api/qrcode/batch', methods=['POST'])
+def batch_qrcode():
+    """批次產生 QR Code，串流回傳 ZIP（PNG／SVG）或可列印的 PDF 標籤頁
+    
+    JSON：{"items": [{"content": "...", "label": "..."}], "output": "zip" | "pdf",
+    "format", "size", "border", "error_correction", "columns"}；
+    也可用表單上傳 csv 檔案（每列「內容,標籤」），其他設定放在表單欄位。
+    """
+    try:
+        items, values = batch_request_items(request)
+        options = parse_qr_options(values)
+        output = parse_batch_output(values.get('output'))
+        columns = parse_sheet_columns(values.get('columns'))
+    except UnicodeDecodeError:
+        return jsonify({'error': 'CSV 必須是 UTF-8 編碼'}), 400
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    if output == 'pdf':
+        return Response(stream_qr_sheet(items, options, columns), mimetype='application/pdf',
+                        headers=attachment_headers('qrcodes.pdf'))
+    return Response(stream_qr_zip(items, options), mimetype='application/zip',
+                    headers=attachment_headers('qrcodes.zip'))
+
 @app.route('/api/shorten', methods=['POST'])
 def shorten_url():
-    """縮短網址 - 使用 TinyURL API"""
+    """縮短網址（本地短網址服務，相同網址共用同一個代碼）"""
     data = request.get_json()
     url = data.get('url', '')
     
-    if not url:
-        return jsonify({'error': '請輸入網址'}), 400
-    
     try:
-        import urllib.request
-        import urllib.parse
-        
-        # 使用 TinyURL API (無需額外套件)
-        api_url = f"http://tinyurl.com/api-create.php?url={urllib.parse.quote(url, safe='')}"
-        
-        with urllib.request.urlopen(api_url, timeout=10) as response:
-            short_url = response.read().decode('utf-8')
-        
+        short_url, code = shorten(url, request.host_url)
         return jsonify({
             'success': True,
             'original': url,
-            'short': short_url
+            'short': short_url,
+            'code': code
         })
-        
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         return jsonify({'error': f'無法產生短網址: {str(e)}'}), 500
 
+@app.route('/api/shorten/<code>', methods=['GET'])
+def short_url_stats(code):
+    """短網址資訊與點擊次數"""
+    try:
+        return jsonify(url_stats(code))
+    except ShortUrlNotFound:
+        return jsonify({'error': '短網址不存在'}), 404
+
+@app.route('/s/<code>')
+def short_url_redirect(code):
+    """短網址轉址（使用 302，瀏覽器不會永久快取，點擊次數才會被記錄）"""
+    try:
+        return redirect(resolve(code), code=302)
+    except ShortUrlNotFound:
+        return jsonify({'error': '短網址不存在'}), 404
+
 # ============ Image Tools ============
 
 @app.route('/api/remove-bg', methods=['POST'])
 def remove_background():
-    """移除圖片背景"""
+    """移除圖片背景（使用常駐的模型工作階段，可用 model 欄位指定允許的模型）"""
     if 'image' not in request.files:
         return jsonify({'error': '請上傳圖片'}), 400
     
@@ -451,82 +864,91 @@ def remove_background():
     if not image_file.filename:
         return jsonify({'error': '請選擇檔案'}), 400
     
-    temp_dir = get_temp_dir()
     filename = secure_filename(image_file.filename)
-    input_path = temp_dir / f"input_{uuid.uuid4()}_{filename}"
-    output_path = temp_dir / f"nobg_{uuid.uuid4()}.png"
     
     try:
-        image_file.save(str(input_path))
-        
-        from rembg import remove
-        from PIL import Image
-        
-        with open(str(input_path), 'rb') as inp:
-            input_data = inp.read()
-        
-        output_data = remove(input_data)
-        
-        with open(str(output_path), 'wb') as out:
-            out.write(output_data)
+        model = parse_model(request.form.get('model'))
+        output_data = remove_image_background(image_file.read(), model)
         
+        from io import BytesIO
         return send_file(
-            str(output_path),
+            BytesIO(output_data),
             mimetype='image/png',
             as_attachment=True,
             download_name=f"nobg_{filename.rsplit('.', 1)[0]}.png"
         )
     
-    except ImportError:
-        return jsonify({'error': '圖片去背功能需要安裝 rembg 套件。請執行: pip install rembg'}), 500
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except RembgUnavailable as e:
+        return jsonify({'error': str(e)}), 500
+    except RembgBusy as e:
+        return jsonify({'error': str(e)}), 503
     except Exception as e:
         return jsonify({'error': str(e)}), 500
-    finally:
-        if input_path.exists():
-            input_path.unlink()
 
 @app.route('/api/mask-text', methods=['POST'])
 def mask_sensitive_text():
-    """遮蓋敏感資訊"""
-    data = request.get_json()
-    text = data.get('text', '')
-    patterns = data.get('patterns', [])
-    mask_char = data.get('mask_char', '*')
+    """遮蓋敏感資訊
+    
+    JSON：text、patterns（預設模式名稱）、custom_patterns（[{"name", "pattern"}]）、mask_char。
+    上傳 file（UTF-8 文字檔）時改為串流處理，直接回傳遮蓋後的檔案；
+    設定放在表單欄位，patterns 以逗號分隔，custom_patterns 為 JSON 字串。
+    """
+    if 'file' in request.files:
+        values = request.form
+        patterns = [p.strip() for p in values.get('patterns', '').split(',') if p.strip()]
+        custom_patterns = values.get('custom_patterns')
+    else:
+        values = request.get_json()
+        patterns = values.get('patterns', [])
+        custom_patterns = values.get('custom_patterns')
+    mask_char = values.get('mask_char') or '*'
     
+    try:
+        import json
+        if isinstance(custom_patterns, str):
+            custom_patterns = json.loads(custom_patterns) if custom_patterns.strip() else None
+        mask_pattern = get_mask_pattern(patterns, custom_patterns)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    if 'file' in request.files:
+        upload = request.files['file']
+        name = secure_filename(upload.filename or '') or 'text.txt'
+        # 上傳內容在回應開始後就無法讀取，先存成暫存檔再逐塊處理
+        input_path = get_temp_dir() / f"mask_{uuid.uuid4()}_{name}"
+        upload.save(str(input_path))
+        try:
+            mask_pattern.check_input(input_path.stat().st_size)
+        except ValueError as e:
+            input_path.unlink()
+            return jsonify({'error': str(e)}), 400
+        
+        def generate():
+            try:
+                with open(str(input_path), 'rb') as f:
+                    yield from mask_stream(iter(lambda: f.read(STREAM_CHUNK_SIZE), b''), mask_pattern, mask_char)
+            finally:
+                input_path.unlink()
+        
+        return Response(generate(), mimetype='text/plain; charset=utf-8', headers=attachment_headers(f"masked_{name}"))
+    
+    text = values.get('text', '')
     if not text:
         return jsonify({'error': '請輸入文字'}), 400
+    try:
+        mask_pattern.check_input(len(text.encode('utf-8')))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     
-    import re
-    
-    result = text
-    masked_items = []
-    
-    # 預設敏感資訊模式
-    default_patterns = {
-        'email': r'\b[A-Za-z0-9._%+-]+@[A-Za-z0-9.-]+\.[A-Z|a-z]{2,}\b',
-        'phone': r'\b0\d{1,2}[-\s]?\d{3,4}[-\s]?\d{3,4}\b',
-        'id': r'\b[A-Z][12]\d{8}\b',  # 台灣身分證
-        'credit_card': r'\b\d{4}[-\s]?\d{4}[-\s]?\d{4}[-\s]?\d{4}\b',
-    }
-    
-    # 如果沒有指定模式，使用全部預設模式
-    if not patterns:
-        patterns = list(default_patterns.keys())
-    
-    for pattern_name in patterns:
-        if pattern_name in default_patterns:
-            pattern = default_patterns[pattern_name]
-            matches = re.findall(pattern, result)
-            for match in matches:
-                masked = mask_char * len(match)
-                result = result.replace(match, masked)
-                masked_items.append({'type': pattern_name, 'original': match, 'masked': masked})
-    
+    masked, items, count = mask_text(text, mask_pattern, mask_char)
     return jsonify({
         'success': True,
         'original': text,
-        'masked': result,
-        'items': masked_items
+        'masked': masked,
+        'items': items,
+        'count': count
     })
 
 if __name__ == '__main__':
@@ -0,0 +1,180 @@
+import os
+import json
+import uuid
+import threading
+import subprocess
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pathlib import Path
+from ffmpeg_jobs import ffmpeg_slot, FFMPEG_WORKERS
+from zip_stream import ZipStream
+import metrics
+
+# 支援的輸出格式：編碼器、副檔名、允許的取樣率
+OUTPUT_FORMATS = {
+    'mp3': {'encoder': 'libmp3lame', 'ext': '.mp3', 'sample_rates': (22050, 32000, 44100, 48000), 'default_rate': 44100},
+    'aac': {'encoder': 'aac', 'ext': '.m4a', 'sample_rates': (22050, 32000, 44100, 48000), 'default_rate': 44100},
+    'opus': {'encoder': 'libopus', 'ext': '.opus', 'sample_rates': (16000, 24000, 48000), 'default_rate': 48000},
+}
+MAX_TARGETS = 6
+
+def _parse_int(value, label):
+    """轉成整數，格式錯誤時拋出帶有欄位名稱的 ValueError"""
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        raise ValueError(f'{label}格式錯誤: {value}')
+
+def parse_targets(raw):
+    """解析輸出目標
+
+    接受 JSON 陣列（[{"format": "mp3", "bitrate": 192, "sample_rate": 44100}]）
+    或簡寫字串 'mp3:192:44100,opus:96'。
+    """
+    raw = (raw or '').strip()
+    if not raw:
+        return [{'format': 'mp3', 'bitrate': 192, 'sample_rate': 44100}]
+
+    if raw.startswith('['):
+        try:
+            items = json.loads(raw)
+        except json.JSONDecodeError:
+            raise ValueError('輸出目標格式錯誤')
+    else:
+        items = []
+        for part in raw.split(','):
+            fields = part.strip().split(':')
+            items.append({
+                'format': fields[0],
+                'bitrate': fields[1] if len(fields) > 1 else 192,
+                'sample_rate': fields[2] if len(fields) > 2 else None,
+            })
+
+    targets = []
+    for item in items:
+        if not isinstance(item, dict):
+            raise ValueError(f'輸出目標格式錯誤: {json.dumps(item, ensure_ascii=False)}')
+        fmt = str(item.get('format', '')).lower()
+        if fmt not in OUTPUT_FORMATS:
+            raise ValueError(f'不支援的輸出格式: {fmt}')
+        spec = OUTPUT_FORMATS[fmt]
+        bitrate = _parse_int(item.get('bitrate') or 192, '位元率')
+        sample_rate = _parse_int(item.get('sample_rate') or spec['default_rate'], '取樣率')
+        if not 8 <= bitrate <= 512:
+            raise ValueError(f'位元率超出範圍: {bitrate}')
+        if sample_rate not in spec['sample_rates']:
+            raise ValueError(f'{fmt} 不支援取樣率 {sample_rate}')
+        target = {'format': fmt, 'bitrate': bitrate, 'sample_rate': sample_rate}
+        if target not in targets:
+            targets.append(target)
+
+    if not targets or len(targets) > MAX_TARGETS:
+        raise ValueError(f'輸出目標數量必須介於 1 到 {MAX_TARGETS}')
+    return targets
+
+def target_suffix(target, targets):
+    """輸出檔名後綴；同格式有多個設定時加上位元率／取樣率區分"""
+    same_format = [t for t in targets if t['format'] == target['format']]
+    suffix = ''
+    if len(same_format) > 1:
+        if len({t['bitrate'] for t in same_format}) > 1:
+            suffix += f"_{target['bitrate']}k"
+        if len({t['sample_rate'] for t in same_format}) > 1:
+            suffix += f"_{target['sample_rate']}"
+    return suffix + OUTPUT_FORMATS[target['format']]['ext']
+
+def build_multi_output_cmd(input_path, outputs):
+    """單次解碼、同時輸出多個目標的 FFmpeg 指令"""
+    cmd = ['ffmpeg', '-y', '-i', str(input_path)]
+    for target, output_path in outputs:
+        cmd += [
+            '-map', '0:a:0', '-vn',
+            '-c:a', OUTPUT_FORMATS[target['format']]['encoder'],
+            '-b:a', f"{target['bitrate']}k",
+            '-ar', str(target['sample_rate']),
+            '-ac', '2',
+            str(output_path)
+        ]
+    return cmd
+
+def _convert_one(input_path, stem, targets, temp_dir, cancelled):
+    """轉換單一檔案為所有目標，回傳 [(壓縮檔內名稱, 輸出路徑)]"""
+    outputs = [
+        (target, temp_dir / f"batch_{uuid.uuid4()}{OUTPUT_FORMATS[target['format']]['ext']}")
+        for target in targets
+    ]
+    try:
+        with ffmpeg_slot():
+            if cancelled.is_set():
+                return []
+            with metrics.stage('ffmpeg.batch') as stage:
+                result = subprocess.run(build_multi_output_cmd(input_path, outputs), capture_output=True, text=True)
+                stage.failed = result.returncode != 0
+        if result.returncode != 0:
+            raise RuntimeError(result.stderr.strip().splitlines()[-1] if result.stderr.strip() else 'FFmpeg 錯誤')
+        if cancelled.is_set():
+            raise RuntimeError('已取消')
+        return [(stem + target_suffix(target, targets), path) for target, path in outputs]
+    except Exception:
+        for _, path in outputs:
+            if path.exists():
+                path.unlink()
+        raise
+    finally:
+        if Path(input_path).exists():
+            Path(input_path).unlink()
+
+def _unique_name(name, used):
+    """避免壓縮檔內檔名重複"""
+    stem, ext = os.path.splitext(name)
+    candidate = name
+    counter = 2
+    while candidate in used:
+        candidate = f"{stem}_{counter}{ext}"
+        counter += 1
+    used.add(candidate)
+    return candidate
+
+def stream_batch_zip(inputs, targets, temp_dir):
+    """平行轉換多個檔案，每完成一個就寫入串流 ZIP
+
+    inputs 為 [(暫存輸入路徑, 原始檔名主檔名)]，輸入檔在轉換後刪除。
+    轉換失敗的檔案會列在 ZIP 內的 errors.txt。
+    """
+    cancelled = threading.Event()
+    executor = ThreadPoolExecutor(max_workers=max(1, min(FFMPEG_WORKERS, len(inputs))))
+    futures = {
+        executor.submit(_convert_one, path, stem, targets, temp_dir, cancelled): stem
+        for path, stem in inputs
+    }
+    zip_stream = ZipStream()
+    used_names = set()
+    errors = []
+    try:
+        for future in as_completed(futures):
+            try:
+                outputs = future.result()
+            except Exception as e:
+                errors.append(f"{futures[future]}: {e}")
+                continue
+            for arcname, path in outputs:
+                try:
+                    yield from zip_stream.add_file(path, _unique_name(arcname, used_names))
+                finally:
+                    path.unlink()
+        if errors:
+            yield from zip_stream.add_bytes('\n'.join(errors).encode('utf-8'), 'errors.txt')
+        yield from zip_stream.close()
+    finally:
+        # 客戶端中斷時停止尚未開始的轉換，並清掉已完成但未送出的檔案
+        cancelled.set()
+        for future in futures:
+            future.cancel()
+        executor.shutdown(wait=True)
+        for future in futures:
+            if future.done() and not future.cancelled() and future.exception() is None:
+                for _, path in future.result():
+                    if path.exists():
+                        path.unlink()
+        for path, _ in inputs:
+            if Path(path).exists():
+                Path(path).unlink()
@@ -0,0 +1,144 @@
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
+import uuid
+import metrics
+
+# 串流轉檔設定
+STREAM_CHUNK_SIZE = 64 * 1024
+SPOOL_MEMORY_LIMIT = 8 * 1024 * 1024  # 輸出暫存超過此大小改寫入磁碟
+
+# 輸出到管線時使用的 FFmpeg 容器參數
+PIPE_OUTPUT_FORMATS = {
+    '.mp3': ['-f', 'mp3'],
+    '.wav': ['-f', 'wav'],
+    '.flac': ['-f', 'flac'],
+    '.ogg': ['-f', 'ogg'],
+    '.opus': ['-f', 'opus'],
+    '.aac': ['-f', 'adts'],
+    '.wma': ['-f', 'asf'],
+    '.webm': ['-f', 'webm'],
+    '.mkv': ['-f', 'matroska'],
+    '.m4a': ['-f', 'ipod', '-movflags', 'frag_keyframe+empty_moov'],
+    '.mp4': ['-f', 'mp4', '-movflags', 'frag_keyframe+empty_moov'],
+    '.mov': ['-f', 'mov', '-movflags', 'frag_keyframe+empty_moov'],
+}
+
+class OutputSpool:
+    """FFmpeg 輸出緩衝：寫入端不會因客戶端讀取較慢而卡住
+
+    小量資料保留在記憶體，超過 SPOOL_MEMORY_LIMIT 後改存磁碟，
+    讓上傳與下載同時進行時不會互相阻塞。
+    """
+
+    def __init__(self, temp_dir):
+        self._file = tempfile.SpooledTemporaryFile(max_size=SPOOL_MEMORY_LIMIT, dir=str(temp_dir))
+        self._cond = threading.Condition()
+        self._written = 0
+        self._read = 0
+        self.closed = False
+
+    def write(self, data):
+        with self._cond:
+            self._file.seek(self._written)
+            self._file.write(data)
+            self._written += len(data)
+            self._cond.notify_all()
+
+    def close(self):
+        with self._cond:
+            self.closed = True
+            self._cond.notify_all()
+
+    def discard(self):
+        """不讀取輸出，直接釋放暫存"""
+        self._file.close()
+
+    def wait_for_data(self):
+        """等到有輸出或輸出結束，回傳是否有資料"""
+        with self._cond:
+            while self._written == 0 and not self.closed:
+                self._cond.wait()
+            return self._written > 0
+
+    def chunks(self):
+        """依序產生已寫入的資料，直到輸出結束"""
+        try:
+            while True:
+                with self._cond:
+                    while self._read >= self._written and not self.closed:
+                        self._cond.wait()
+                    if self._read >= self._written:
+                        return
+                    self._file.seek(self._read)
+                    data = self._file.read(min(self._written - self._read, STREAM_CHUNK_SIZE))
+                    self._read += len(data)
+                yield data
+        finally:
+            self._file.close()
+
+class FFmpegStream:
+    """將上傳內容交給 FFmpeg，並把 FFmpeg 的輸出串流回客戶端
+
+    請求內容在 view 回傳前就逐塊寫到磁碟（不經表單解析、不整份放進記憶體）：
+    view 回傳後 WSGI 伺服器會讀完或丟棄剩餘的請求內容並重用連線，不能再由背景執行緒讀取。
+    FFmpeg 從檔案讀取，也能處理需要隨機存取的容器（moov 在檔尾的 mp4／m4a）。
+    """
+
+    def __init__(self, input_stream, input_ext, before_input, after_input, temp_dir):
+        self.temp_dir = temp_dir
+        self.spool = OutputSpool(temp_dir)
+        self.stderr = []
+        self.input_path = temp_dir / f"stream_{uuid.uuid4()}{input_ext}"
+        try:
+            with open(str(self.input_path), 'wb') as f:
+                shutil.copyfileobj(input_stream, f, STREAM_CHUNK_SIZE)
+        except BaseException:
+            self.input_path.unlink(missing_ok=True)
+            raise
+
+        cmd = ['ffmpeg', '-y', '-loglevel', 'error', *before_input, '-i', str(self.input_path), *after_input, 'pipe:1']
+        self._started = time.perf_counter()
+        self.proc = subprocess.Popen(cmd, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+
+        self._stderr_thread = threading.Thread(target=self._drain_stderr, daemon=True)
+        for thread in (threading.Thread(target=self._drain_stdout, daemon=True), self._stderr_thread):
+            thread.start()
+
+    def _drain_stdout(self):
+        for chunk in iter(lambda: self.proc.stdout.read1(STREAM_CHUNK_SIZE), b''):
+            self.spool.write(chunk)
+        self.proc.wait()
+        metrics.record_stage('ffmpeg.stream', time.perf_counter() - self._started, self.proc.returncode != 0)
+        self.spool.close()
+
+    def _drain_stderr(self):
+        for line in self.proc.stderr:
+            self.stderr.append(line.decode('utf-8', errors='replace'))
+
+    def start(self):
+        """等待第一段輸出；FFmpeg 在輸出前就失敗時回傳錯誤訊息"""
+        if self.spool.wait_for_data():
+            return None
+        self.proc.wait()
+        self._stderr_thread.join(timeout=5)
+        self.spool.discard()
+        self.cleanup()
+        if self.proc.returncode != 0:
+            return ''.join(self.stderr) or f'FFmpeg 結束代碼 {self.proc.returncode}'
+        return 'FFmpeg 沒有產生任何輸出'
+
+    def iter_output(self):
+        """產生回應內容，結束或中斷時清理子行程與暫存檔"""
+        try:
+            yield from self.spool.chunks()
+        finally:
+            self.cleanup()
+
+    def cleanup(self):
+        if self.proc.poll() is None:
+            self.proc.kill()
+            self.proc.wait()
+        self.input_path.unlink(missing_ok=True)
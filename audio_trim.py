@@ -0,0 +1,247 @@
+import json
+import math
+import uuid
+import zipfile
+import subprocess
+from pathlib import Path
+import metrics
+
+# 切割模式：fast 直接複製串流（切在最接近的音訊框），exact 切在指定的時間點
+TRIM_MODES = ('fast', 'exact')
+# 多段切割的輸出方式：zip 打包各片段，concat 串接成單一檔案
+TRIM_OUTPUTS = ('zip', 'concat')
+
+# 精確模式重新編碼時使用的編碼器（需與原始編碼相同）
+BOUNDARY_ENCODERS = {
+    'mp3': 'libmp3lame',
+    'aac': 'aac',
+    'opus': 'libopus',
+    'vorbis': 'libvorbis',
+    'flac': 'flac',
+    'pcm_s16le': 'pcm_s16le',
+    'pcm_s24le': 'pcm_s24le',
+}
+# 只有無損編碼能只重新編碼邊界再串接；有損編碼器在每段頭尾加入的 priming／padding 會在接縫造成停頓或爆音
+LOSSLESS_CODECS = ('flac', 'pcm_s16le', 'pcm_s24le')
+PROBE_WINDOW = 2.0  # 秒，尋找邊界音訊框時讀取的範圍
+MIN_SEGMENT = 0.0005  # 秒，短於此長度的邊界片段略過
+
+class TrimError(Exception):
+    """FFmpeg 切割失敗"""
+
+def parse_timestamp(value):
+    """解析時間字串，支援 '83.5'、'1:23.5'、'0:01:23.5'，回傳秒數"""
+    parts = str(value).strip().split(':')
+    if not parts[0] or len(parts) > 3:
+        raise ValueError(f'時間格式錯誤: {value}')
+    seconds = 0.0
+    for part in parts:
+        try:
+            number = float(part)
+        except ValueError:
+            raise ValueError(f'時間格式錯誤: {value}')
+        if not math.isfinite(number):
+            raise ValueError(f'時間格式錯誤: {value}')
+        if number < 0 or part.strip().startswith('-'):
+            raise ValueError(f'時間不可為負數: {value}')
+        seconds = seconds * 60 + number
+    return seconds
+
+def parse_time_range(start, end):
+    """解析開始與結束時間，回傳 (開始秒數, 結束秒數)"""
+    start, end = parse_timestamp(start), parse_timestamp(end)
+    if start >= end:
+        raise ValueError('開始時間必須小於結束時間')
+    return start, end
+
+def parse_cuts(cuts_string):
+    """解析多段切割字串，如 '0-10.5,1:00-1:30.25'"""
+    cuts = []
+    for part in cuts_string.split(','):
+        part = part.strip()
+        if not part:
+            continue
+        start, sep, end = part.partition('-')
+        if not sep:
+            raise ValueError(f'切割範圍格式錯誤: {part}')
+        start, end = parse_timestamp(start), parse_timestamp(end)
+        if start >= end:
+            raise ValueError(f'開始時間必須小於結束時間: {part}')
+        cuts.append((start, end))
+    if not cuts:
+        raise ValueError('請指定切割範圍')
+    return cuts
+
+def _fmt(seconds):
+    return f'{seconds:.6f}'
+
+def _run(cmd):
+    with metrics.stage('ffmpeg.trim') as stage:
+        result = subprocess.run(cmd, capture_output=True, text=True)
+        stage.failed = result.returncode != 0
+    if result.returncode != 0:
+        raise TrimError(result.stderr)
+    return result.stdout
+
+def fast_trim_cmd(input_path, output_path, start, end):
+    """輸入端搜尋（-ss 在 -i 之前），不需從頭解碼，直接複製串流"""
+    return [
+        'ffmpeg', '-y',
+        '-ss', _fmt(start),
+        '-i', str(input_path),
+        '-t', _fmt(end - start),
+        '-c', 'copy',
+        str(output_path)
+    ]
+
+def _probe_audio(path):
+    """取得第一條音訊串流的編碼參數"""
+    output = _run([
+        'ffprobe', '-v', 'error', '-select_streams', 'a:0',
+        '-show_entries', 'stream=codec_name,sample_rate,channels,bit_rate',
+        '-of', 'json', str(path)
+    ])
+    streams = json.loads(output).get('streams') or [{}]
+    return streams[0]
+
+def _packet_times(path, start, end):
+    """讀取 [start, end] 附近的音訊封包時間（只讀取該區段）"""
+    output = _run([
+        'ffprobe', '-v', 'error', '-select_streams', 'a:0',
+        '-read_intervals', f'{_fmt(start)}%{_fmt(end)}',
+        '-show_entries', 'packet=pts_time',
+        '-of', 'csv=p=0', str(path)
+    ])
+    times = []
+    for line in output.splitlines():
+        try:
+            times.append(float(line.strip().rstrip(',')))
+        except ValueError:
+            continue
+    return sorted(times)
+
+def _encode_args(audio):
+    """重新編碼邊界片段的參數，盡量與原始串流一致"""
+    codec = audio.get('codec_name')
+    args = ['-c:a', BOUNDARY_ENCODERS[codec]]
+    if audio.get('sample_rate'):
+        args += ['-ar', str(audio['sample_rate'])]
+    if audio.get('channels'):
+        args += ['-ac', str(audio['channels'])]
+    if audio.get('bit_rate') and codec not in LOSSLESS_CODECS:
+        args += ['-b:a', str(audio['bit_rate'])]
+    return args
+
+def concat_files(paths, output_path, temp_dir):
+    """以 concat demuxer 串接相同編碼的檔案（不重新編碼）"""
+    list_path = temp_dir / f"concat_{uuid.uuid4()}.txt"
+    try:
+        with open(str(list_path), 'w', encoding='utf-8') as f:
+            for path in paths:
+                escaped = str(Path(path).resolve()).replace("'", "'\\''")
+                f.write(f"file '{escaped}'\n")
+        _run(['ffmpeg', '-y', '-f', 'concat', '-safe', '0', '-i', str(list_path), '-c', 'copy', str(output_path)])
+    finally:
+        if list_path.exists():
+            list_path.unlink()
+
+def cut_fast(input_path, output_path, start, end, temp_dir):
+    """快速切割：切點落在最接近的音訊框"""
+    _run(fast_trim_cmd(input_path, output_path, start, end))
+
+def _reencode(input_path, output_path, start, end, audio):
+    """整段重新編碼（切點精確，輸出為單一連續的編碼串流）"""
+    codec = audio.get('codec_name')
+    encode = _encode_args(audio) if codec in BOUNDARY_ENCODERS else ['-c:a', 'libmp3lame']
+    _run([
+        'ffmpeg', '-y', '-ss', _fmt(start), '-i', str(input_path),
+        '-t', _fmt(end - start), '-map', '0:a:0', *encode, str(output_path)
+    ])
+
+def cut_exact(input_path, output_path, start, end, temp_dir):
+    """精確切割
+
+    無損編碼（PCM、FLAC）只重新編碼頭尾不足一個音訊框的部分，中段直接複製，
+    串接後沒有縫隙；有損編碼整段重新編碼。
+    """
+    audio = _probe_audio(input_path)
+    if audio.get('codec_name') not in LOSSLESS_CODECS:
+        _reencode(input_path, output_path, start, end, audio)
+        return
+
+    head_times = [t for t in _packet_times(input_path, start, start + PROBE_WINDOW) if t >= start]
+    tail_times = [t for t in _packet_times(input_path, max(0, end - PROBE_WINDOW), end) if t <= end]
+    head_end = head_times[0] if head_times else None
+    tail_start = tail_times[-1] if tail_times else None
+
+    if head_end is None or tail_start is None or tail_start <= head_end:
+        # 片段太短，無法只處理邊界
+        _reencode(input_path, output_path, start, end, audio)
+        return
+
+    ext = Path(output_path).suffix
+    encode = _encode_args(audio)
+    segments = []
+    plan = [
+        (start, head_end, encode),
+        (head_end, tail_start, ['-c', 'copy']),
+        (tail_start, end, encode),
+    ]
+    try:
+        for seg_start, seg_end, codec_args in plan:
+            if seg_end - seg_start < MIN_SEGMENT:
+                continue
+            segment_path = temp_dir / f"segment_{uuid.uuid4()}{ext}"
+            segments.append(segment_path)
+            _run([
+                'ffmpeg', '-y', '-ss', _fmt(seg_start), '-i', str(input_path),
+                '-t', _fmt(seg_end - seg_start), '-map', '0:a:0', *codec_args, str(segment_path)
+            ])
+        concat_files(segments, output_path, temp_dir)
+    finally:
+        for segment_path in segments:
+            if segment_path.exists():
+                segment_path.unlink()
+
+def trim(input_path, cuts, mode, output_mode, output_path, download_stem, temp_dir):
+    """依 cuts 切割音訊
+
+    單一片段直接輸出到 output_path；多個片段依 output_mode 串接，
+    或打包為 output_path 同名的 .zip（以 ZIP_STORED 避免重複壓縮）。
+    回傳實際輸出檔案路徑；失敗時刪除寫到一半的輸出（包含 .zip）後再拋出例外。
+    """
+    try:
+        return _trim(input_path, cuts, mode, output_mode, output_path, download_stem, temp_dir)
+    except BaseException:
+        for path in (Path(output_path), Path(output_path).with_suffix('.zip')):
+            path.unlink(missing_ok=True)
+        raise
+
+def _trim(input_path, cuts, mode, output_mode, output_path, download_stem, temp_dir):
+    cut = cut_exact if mode == 'exact' else cut_fast
+    ext = Path(input_path).suffix
+
+    if len(cuts) == 1:
+        cut(input_path, output_path, *cuts[0], temp_dir)
+        return Path(output_path)
+
+    parts = []
+    try:
+        for start, end in cuts:
+            part_path = temp_dir / f"cut_{uuid.uuid4()}{ext}"
+            parts.append(part_path)
+            cut(input_path, part_path, start, end, temp_dir)
+
+        if output_mode == 'concat':
+            concat_files(parts, output_path, temp_dir)
+            return Path(output_path)
+
+        zip_path = Path(output_path).with_suffix('.zip')
+        with zipfile.ZipFile(str(zip_path), 'w', zipfile.ZIP_STORED) as zf:
+            for i, part_path in enumerate(parts, 1):
+                zf.write(str(part_path), f"{download_stem}_{i:02d}{ext}")
+        return zip_path
+    finally:
+        for part_path in parts:
+            if part_path.exists():
+                part_path.unlink()
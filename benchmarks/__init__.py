@@ -0,0 +1 @@
+"""離線效能測試（見 run.py）"""
@@ -0,0 +1,129 @@
+"""效能測試用的 HTTP 客戶端（只用標準函式庫，每個執行緒一條持續連線）"""
+import http.client
+import json
+import threading
+import time
+import urllib.parse
+import uuid
+from pathlib import Path
+
+READ_CHUNK = 256 * 1024
+
+
+class HttpError(Exception):
+    """回應狀態碼不在預期範圍內"""
+
+    def __init__(self, status, body):
+        super().__init__(f'HTTP {status}: {body[:200]!r}')
+        self.status = status
+        self.body = body
+
+
+class Response:
+    def __init__(self, status, headers, body, size):
+        self.status = status
+        self.headers = headers
+        self.body = body  # 超過 keep_body 上限時為 None（只計算長度）
+        self.size = size
+
+    def json(self):
+        return json.loads(self.body)
+
+
+def multipart(fields=None, files=None):
+    """組成 multipart/form-data 內容
+
+    files 為 [(欄位名稱, 檔名, 內容或路徑, MIME 類型)]，回傳 (內容, Content-Type)。
+    """
+    boundary = uuid.uuid4().hex
+    parts = []
+    for name, value in (fields or {}).items():
+        parts.append(
+            f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'.encode('utf-8')
+        )
+    for name, filename, data, content_type in files or []:
+        if isinstance(data, Path):
+            data = data.read_bytes()
+        parts.append(
+            f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"; filename="{filename}"\r\n'
+            f'Content-Type: {content_type}\r\n\r\n'.encode('utf-8') + data + b'\r\n'
+        )
+    parts.append(f'--{boundary}--\r\n'.encode('ascii'))
+    return b''.join(parts), f'multipart/form-data; boundary={boundary}'
+
+
+class Client:
+    """對同一台伺服器送出請求；每個執行緒各自保留一條 keep-alive 連線"""
+
+    def __init__(self, base_url, timeout=600):
+        parsed = urllib.parse.urlsplit(base_url)
+        self.host = parsed.hostname
+        self.port = parsed.port or 80
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._local.conn = http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+        return conn
+
+    def close(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+    def request(self, method, path, body=None, headers=None, json_body=None, expect=(200,), keep_body=4 * 1024 * 1024):
+        """送出請求並讀完整個回應（下載時間計入延遲），狀態碼不符時拋出 HttpError"""
+        headers = dict(headers or {})
+        if json_body is not None:
+            body = json.dumps(json_body).encode('utf-8')
+            headers['Content-Type'] = 'application/json'
+        for attempt in range(2):
+            conn = self._connection()
+            try:
+                conn.request(method, path, body=body, headers=headers)
+                response = conn.getresponse()
+                break
+            except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError):
+                # 伺服器關閉了閒置的 keep-alive 連線，重新連線一次
+                self.close()
+                if attempt:
+                    raise
+        chunks = []
+        size = 0
+        while True:
+            chunk = response.read(READ_CHUNK)
+            if not chunk:
+                break
+            size += len(chunk)
+            if size <= keep_body:
+                chunks.append(chunk)
+        if response.will_close:
+            self.close()
+        data = b''.join(chunks) if size <= keep_body else None
+        if expect and response.status not in expect:
+            raise HttpError(response.status, data or b'')
+        return Response(response.status, response.headers, data, size)
+
+    def get(self, path, **kwargs):
+        return self.request('GET', path, **kwargs)
+
+    def post(self, path, **kwargs):
+        return self.request('POST', path, **kwargs)
+
+    def post_form(self, path, fields=None, files=None, **kwargs):
+        body, content_type = multipart(fields, files)
+        return self.request('POST', path, body=body, headers={'Content-Type': content_type}, **kwargs)
+
+    def poll(self, path, done, interval=0.05, timeout=600):
+        """輪詢 JSON 狀態直到 done(狀態) 為真，回傳最後的狀態"""
+        deadline = time.monotonic() + timeout
+        while True:
+            status = self.get(path).json()
+            if done(status):
+                return status
+            if time.monotonic() > deadline:
+                raise TimeoutError(f'{path} 逾時: {status}')
+            time.sleep(interval)
@@ -0,0 +1,146 @@
+"""產生效能測試用的合成檔案（音訊、PDF、圖片、文字），不需要任何外部素材"""
+import io
+import math
+import random
+import struct
+import wave
+import zlib
+from pathlib import Path
+
+AUDIO_SECONDS = 30
+AUDIO_RATE = 44100
+PDF_PAGES = 20
+TEXT_BYTES = 1024 * 1024
+
+
+def write_wav(path, seconds=AUDIO_SECONDS, rate=AUDIO_RATE):
+    """雙聲道 16-bit 正弦波（左右聲道頻率不同，避免被編碼器當成靜音）"""
+    period = [
+        struct.pack('<hh', int(12000 * math.sin(2 * math.pi * 440 * i / rate)),
+                    int(12000 * math.sin(2 * math.pi * 660 * i / rate)))
+        for i in range(rate // 20)  # 440 與 660 Hz 在 1/20 秒內都是整數週期
+    ]
+    chunk = b''.join(period)
+    with wave.open(str(path), 'wb') as f:
+        f.setnchannels(2)
+        f.setsampwidth(2)
+        f.setframerate(rate)
+        for _ in range(seconds * 20):
+            f.writeframes(chunk)
+    return path
+
+
+def _jpeg(width, height, seed):
+    from PIL import Image, ImageDraw
+
+    rng = random.Random(seed)
+    image = Image.new('RGB', (width, height), (rng.randrange(256), rng.randrange(256), rng.randrange(256)))
+    draw = ImageDraw.Draw(image)
+    for _ in range(40):
+        x, y = rng.randrange(width), rng.randrange(height)
+        color = (rng.randrange(256), rng.randrange(256), rng.randrange(256))
+        draw.ellipse((x, y, x + rng.randrange(20, 200), y + rng.randrange(20, 200)), fill=color)
+    buffer = io.BytesIO()
+    image.save(buffer, 'JPEG', quality=92)
+    return buffer.getvalue()
+
+
+def write_pdf(path, pages=PDF_PAGES, seed=0):
+    """每頁有文字、向量圖形與一張 JPEG 圖片的 A4 PDF（縮圖與壓縮輸出才有東西可處理）"""
+    objects = {}
+    page_numbers = []
+    font = 3
+    objects[font] = b'<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>'
+    number = 4
+    for index in range(pages):
+        image, content, page = number, number + 1, number + 2
+        number += 3
+        data = _jpeg(800, 600, seed * 1000 + index)
+        objects[image] = (
+            b'<< /Type /XObject /Subtype /Image /Width 800 /Height 600 /ColorSpace /DeviceRGB '
+            b'/BitsPerComponent 8 /Filter /DCTDecode /Length %d >>\nstream\n' % len(data) + data + b'\nendstream'
+        )
+        ops = [b'BT /F1 24 Tf 72 770 Td (Benchmark page %d) Tj ET' % (index + 1)]
+        for line in range(30):
+            ops.append(b'BT /F1 10 Tf 72 %d Td (Line %d lorem ipsum dolor sit amet consectetur) Tj ET' % (740 - line * 14, line))
+        ops.append(b'q 0.2 0.4 0.8 rg 72 60 451 200 re f Q')
+        ops.append(b'q 400 0 0 300 120 250 cm /Im1 Do Q')
+        stream = zlib.compress(b'\n'.join(ops))
+        objects[content] = b'<< /Length %d /Filter /FlateDecode >>\nstream\n' % len(stream) + stream + b'\nendstream'
+        objects[page] = (
+            b'<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] /Contents %d 0 R '
+            b'/Resources << /Font << /F1 %d 0 R >> /XObject << /Im1 %d 0 R >> >> >>' % (content, font, image)
+        )
+        page_numbers.append(page)
+    objects[1] = b'<< /Type /Catalog /Pages 2 0 R >>'
+    objects[2] = b'<< /Type /Pages /Kids [%s] /Count %d >>' % (
+        b' '.join(b'%d 0 R' % n for n in page_numbers), len(page_numbers))
+
+    out = io.BytesIO()
+    out.write(b'%PDF-1.4\n%\xe2\xe3\xcf\xd3\n')
+    offsets = {}
+    for n in sorted(objects):
+        offsets[n] = out.tell()
+        out.write(b'%d 0 obj\n' % n + objects[n] + b'\nendobj\n')
+    xref = out.tell()
+    size = max(objects) + 1
+    out.write(b'xref\n0 %d\n0000000000 65535 f \n' % size)
+    for n in range(1, size):
+        out.write(b'%010d 00000 n \n' % offsets[n])
+    out.write(b'trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n' % (size, xref))
+    Path(path).write_bytes(out.getvalue())
+    return path
+
+
+def write_image(path, size=512):
+    """前景物體與漸層背景的 PNG（去背用）"""
+    from PIL import Image, ImageDraw
+
+    image = Image.new('RGB', (size, size))
+    draw = ImageDraw.Draw(image)
+    for y in range(size):
+        draw.line((0, y, size, y), fill=(180, 200 + y * 55 // size, 255 - y * 80 // size))
+    draw.ellipse((size // 4, size // 6, size * 3 // 4, size * 5 // 6), fill=(200, 60, 40))
+    draw.rectangle((size * 2 // 5, size // 2, size * 3 // 5, size * 9 // 10), fill=(40, 40, 40))
+    image.save(str(path), 'PNG')
+    return path
+
+
+def sensitive_text(size=TEXT_BYTES, seed=0):
+    """含電子郵件、電話、身分證字號與信用卡號的合成日誌"""
+    rng = random.Random(seed)
+    lines = []
+    total = 0
+    while total < size:
+        index = len(lines)
+        kind = index % 5
+        if kind == 0:
+            line = f'{index:08d} INFO user{rng.randrange(10**6)}@example.com logged in from 10.0.{index % 256}.{rng.randrange(256)}'
+        elif kind == 1:
+            line = f'{index:08d} INFO callback 09{rng.randrange(10**8):08d} requested'
+        elif kind == 2:
+            letter = chr(ord('A') + rng.randrange(26))
+            line = f'{index:08d} WARN identity {letter}{rng.choice("12")}{rng.randrange(10**8):08d} verification pending'
+        elif kind == 3:
+            line = f'{index:08d} INFO card 4111-{rng.randrange(10**4):04d}-{rng.randrange(10**4):04d}-{rng.randrange(10**4):04d} charged'
+        else:
+            line = f'{index:08d} DEBUG request handled in {rng.randrange(1000)} ms without sensitive fields'
+        lines.append(line)
+        total += len(line) + 1
+    return '\n'.join(lines) + '\n'
+
+
+def build_fixtures(directory, audio_seconds=AUDIO_SECONDS, pdf_pages=PDF_PAGES):
+    """在 directory 產生所有測試檔案，回傳 {名稱: 路徑}"""
+    directory = Path(directory)
+    directory.mkdir(parents=True, exist_ok=True)
+    text_path = directory / 'log.txt'
+    text_path.write_text(sensitive_text(), encoding='utf-8')
+    return {
+        'audio': write_wav(directory / 'tone.wav', audio_seconds),
+        'audio_short': write_wav(directory / 'short.wav', max(1, audio_seconds // 6)),
+        'pdf': write_pdf(directory / 'doc.pdf', pdf_pages, seed=1),
+        'pdf_small': write_pdf(directory / 'small.pdf', max(1, pdf_pages // 4), seed=2),
+        'image': write_image(directory / 'photo.png'),
+        'text': text_path,
+    }
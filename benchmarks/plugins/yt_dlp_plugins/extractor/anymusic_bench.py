@@ -0,0 +1,56 @@
+"""效能測試用的 yt-dlp 擷取器（不連網）
+
+對應 benchmarks/standins.py 的本地媒體伺服器：
+  http://127.0.0.1:<port>/watch/<id>             單一影片，音訊為本地 WAV
+  http://127.0.0.1:<port>/playlist/<id>?n=<數量>  播放清單
+
+不送出任何請求就產生影片資訊，音訊檔由本地媒體伺服器提供。
+將 benchmarks/plugins 加入 PYTHONPATH 後 yt-dlp 會自動載入。
+"""
+import os
+import urllib.parse
+
+from yt_dlp.extractor.common import InfoExtractor
+
+BENCH_HOST = r'https?://(?:127\.0\.0\.1|localhost):\d+'
+BENCH_DURATION = int(os.environ.get('ANYMUSIC_BENCH_DURATION', '30'))  # 秒，由測試程式設定為音訊長度
+
+
+class AnyMusicBenchIE(InfoExtractor):
+    IE_NAME = 'anymusic:bench'
+    _VALID_URL = BENCH_HOST + r'/watch/(?P<id>[\w-]+)'
+
+    def _real_extract(self, url):
+        video_id = self._match_id(url)
+        base = url.split('/watch/', 1)[0]
+        return {
+            'id': video_id,
+            'title': f'bench {video_id}',
+            'duration': BENCH_DURATION,
+            'formats': [{
+                'format_id': 'wav',
+                'url': f'{base}/media/{video_id}.wav',
+                'ext': 'wav',
+                'acodec': 'pcm_s16le',
+                'vcodec': 'none',
+                'protocol': 'http',
+            }],
+        }
+
+
+class AnyMusicBenchPlaylistIE(InfoExtractor):
+    IE_NAME = 'anymusic:bench:playlist'
+    _VALID_URL = BENCH_HOST + r'/playlist/(?P<id>[\w-]+)'
+
+    def _real_extract(self, url):
+        playlist_id = self._match_id(url)
+        base = url.split('/playlist/', 1)[0]
+        query = urllib.parse.parse_qs(urllib.parse.urlsplit(url).query)
+        count = int((query.get('n') or ['5'])[0])
+        entries = [
+            self.url_result(
+                f'{base}/watch/{playlist_id}-{i}', AnyMusicBenchIE,
+                f'{playlist_id}-{i}', f'bench {playlist_id}-{i}')
+            for i in range(count)
+        ]
+        return self.playlist_result(entries, playlist_id, f'bench playlist {playlist_id}')
@@ -0,0 +1,447 @@
+"""離線效能測試：以 gunicorn 啟動 app，逐一對每個 API 端點施壓並與基準比較
+
+    python -m benchmarks.run                          # 全部情境，並行數 1 與 8
+    python -m benchmarks.run --only pdf,qr -c 1,4,16  # 只測 PDF 與 QR Code 群組
+    python -m benchmarks.run --save-baseline          # 將結果存為基準（benchmarks/baseline.json）
+    python -m benchmarks.run --baseline benchmarks/baseline.json  # 與基準比較，退步時結束碼為 1
+
+yt-dlp 擷取改用 benchmarks/plugins 中的本地擷取器、音訊來源與 TinyURL 改用
+standins.py 的本地伺服器，全程不連網。伺服器的暫存、下載目錄與所有資料庫都放在
+獨立的工作目錄，不會影響正式資料。
+"""
+import argparse
+import json
+import os
+import platform
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from .client import Client, HttpError
+from .fixtures import AUDIO_SECONDS, PDF_PAGES, build_fixtures
+from .scenarios import SCENARIOS, Context
+from .standins import StandInServer
+
+ROOT = Path(__file__).resolve().parent.parent
+PLUGIN_DIR = Path(__file__).resolve().parent / 'plugins'
+DEFAULT_BASELINE = Path(__file__).resolve().parent / 'baseline.json'
+SAMPLE_INTERVAL = 0.1  # 秒，記憶體與磁碟用量的取樣間隔
+READY_TIMEOUT = 60
+MIN_REGRESSION_MS = 2.0  # 延遲差距小於此值不視為退步（避免極快端點的雜訊）
+PAGE_SIZE = os.sysconf('SC_PAGE_SIZE') if hasattr(os, 'sysconf') else 4096
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def _tree_rss(root_pid):
+    """行程與所有子孫行程（gunicorn worker、FFmpeg、渲染行程）的 RSS 總和，無 /proc 時回傳 None"""
+    if not os.path.isdir('/proc'):
+        return None
+    children = {}
+    for entry in os.listdir('/proc'):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f'/proc/{entry}/stat', 'rb') as f:
+                stat = f.read()
+        except OSError:
+            continue
+        ppid = int(stat[stat.rindex(b')') + 2:].split()[1])
+        children.setdefault(ppid, []).append(int(entry))
+    total = 0
+    pending = [root_pid]
+    while pending:
+        pid = pending.pop()
+        try:
+            with open(f'/proc/{pid}/statm', 'rb') as f:
+                total += int(f.read().split()[1]) * PAGE_SIZE
+        except OSError:
+            continue
+        pending.extend(children.get(pid, ()))
+    return total
+
+
+def _dir_size(path):
+    total = 0
+    for root, _, names in os.walk(str(path)):
+        for name in names:
+            try:
+                total += os.lstat(os.path.join(root, name)).st_size
+            except OSError:
+                pass
+    return total
+
+
+class AppServer:
+    """在獨立工作目錄以 gunicorn 執行 app.py"""
+
+    def __init__(self, workdir, standins, args):
+        self.workdir = Path(workdir)
+        self.port = args.port or _free_port()
+        self.workers = args.workers
+        self.ready_seconds = None
+        self.temp_dir = self.workdir / 'temp'
+        self.download_dir = self.workdir / 'downloads'
+        self.scratch_dir = None
+        self.log_path = self.workdir / 'server.log'
+        self.env = dict(os.environ)
+        self.env.update({
+            'PYTHONPATH': os.pathsep.join(filter(None, [str(PLUGIN_DIR), os.environ.get('PYTHONPATH')])),
+            'TEMP_DIR': str(self.temp_dir),
+            'DOWNLOAD_DIR': str(self.download_dir),
+            'JOB_JOURNAL_PATH': str(self.workdir / 'jobs.db'),
+            'PROGRESS_DB_PATH': str(self.workdir / 'progress.db'),
+            'DOWNLOAD_CACHE_DB_PATH': str(self.workdir / 'cache.db'),
+            'STORAGE_DB_PATH': str(self.workdir / 'storage.db'),
+            'SHORT_URL_DB_PATH': str(self.workdir / 'short_urls.db'),
+            'PDF_SESSION_DIR': str(self.temp_dir / 'pdf_sessions'),
+            'FFMPEG_LOCK_DIR': str(self.workdir),
+            'SHORT_URL_PROVIDER': args.short_url_provider,
+            'SHORT_URL_PROVIDER_API': standins.shortener_api,
+            'ANYMUSIC_BENCH_DURATION': str(args.audio_seconds),
+        })
+        for item in args.env:
+            key, _, value = item.partition('=')
+            self.env[key] = value
+        if self.env.get('SCRATCH_DIR'):
+            self.scratch_dir = Path(self.env['SCRATCH_DIR']) / 'anymusic'
+        self.cmd = [
+            sys.executable, '-m', 'gunicorn', 'app:app',
+            '--bind', f'127.0.0.1:{self.port}',
+            '--workers', str(args.workers),
+            '--worker-class', args.worker_class,
+            '--threads', str(args.threads),
+            '--timeout', '600',
+            '--graceful-timeout', '5',
+        ]
+        self.process = None
+
+    @property
+    def base_url(self):
+        return f'http://127.0.0.1:{self.port}'
+
+    def start(self):
+        self._log = open(str(self.log_path), 'wb')
+        started = time.monotonic()
+        self.process = subprocess.Popen(self.cmd, cwd=str(ROOT), env=self.env, stdout=self._log, stderr=subprocess.STDOUT)
+        client = Client(self.base_url, timeout=5)
+        deadline = started + READY_TIMEOUT
+        ready = set()
+        while True:
+            if self.process.poll() is not None:
+                raise RuntimeError(f'gunicorn 啟動失敗：\n{self.log_tail()}')
+            try:
+                # 每次重新連線，直到每個 worker 都回報預熱完成
+                ready.add(json.loads(client.get('/readyz').body)['pid'])
+                if len(ready) >= self.workers:
+                    self.ready_seconds = time.monotonic() - started
+                    return self
+            except (OSError, HttpError):
+                if time.monotonic() > deadline:
+                    self.stop()
+                    raise RuntimeError(f'gunicorn {READY_TIMEOUT} 秒內未就緒：\n{self.log_tail()}')
+                time.sleep(0.2)
+            finally:
+                client.close()
+
+    def stop(self):
+        if self.process and self.process.poll() is None:
+            self.process.terminate()
+            try:
+                self.process.wait(timeout=15)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+                self.process.wait()
+        if self.process:
+            self._log.close()
+
+    def log_tail(self, lines=30):
+        try:
+            return '\n'.join(self.log_path.read_text(errors='replace').splitlines()[-lines:])
+        except OSError:
+            return ''
+
+    def rss(self):
+        return _tree_rss(self.process.pid)
+
+    def temp_usage(self):
+        usage = _dir_size(self.temp_dir)
+        if self.scratch_dir is not None:
+            usage += _dir_size(self.scratch_dir)
+        return usage
+
+
+class ResourceSampler:
+    """背景取樣伺服器的記憶體與暫存空間，記錄期間內的峰值"""
+
+    def __init__(self, server):
+        self.server = server
+        self.peak_rss = None
+        self.peak_temp = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _sample(self):
+        rss = self.server.rss()
+        if rss is not None:
+            self.peak_rss = max(self.peak_rss or 0, rss)
+        self.peak_temp = max(self.peak_temp, self.server.temp_usage())
+
+    def _loop(self):
+        while not self._stop.wait(SAMPLE_INTERVAL):
+            self._sample()
+
+    def __enter__(self):
+        self._sample()
+        self._thread = threading.Thread(target=self._loop, daemon=True, name='bench-sampler')
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self._sample()
+
+
+def percentile(sorted_values, fraction):
+    """最近排名法的百分位數"""
+    if not sorted_values:
+        return None
+    index = max(0, min(len(sorted_values) - 1, int(round(fraction * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[index]
+
+
+def run_level(scenario, ctx, server, concurrency, requests):
+    """以固定並行數執行 requests 次，回傳統計"""
+    client = Client(server.base_url)
+    latencies = []
+    errors = []
+    lock = threading.Lock()
+    counter = iter(range(requests))
+
+    def worker():
+        try:
+            while True:
+                with lock:
+                    i = next(counter, None)
+                if i is None:
+                    return
+                started = time.perf_counter()
+                try:
+                    scenario.run(ctx, client, i)
+                except Exception as e:
+                    with lock:
+                        errors.append(str(e))
+                    continue
+                elapsed = time.perf_counter() - started
+                with lock:
+                    latencies.append(elapsed)
+        finally:
+            client.close()
+
+    downloads_before = _dir_size(server.download_dir)
+    with ResourceSampler(server) as sampler:
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            for _ in range(concurrency):
+                pool.submit(worker)
+        wall = time.perf_counter() - started
+
+    latencies.sort()
+    ms = lambda value: None if value is None else round(value * 1000, 2)
+    return {
+        'scenario': scenario.name,
+        'group': scenario.group,
+        'concurrency': concurrency,
+        'requests': requests,
+        'errors': len(errors),
+        'error_sample': errors[0][:300] if errors else None,
+        'p50_ms': ms(percentile(latencies, 0.50)),
+        'p99_ms': ms(percentile(latencies, 0.99)),
+        'mean_ms': ms(sum(latencies) / len(latencies)) if latencies else None,
+        'rps': round(len(latencies) / wall, 2) if wall > 0 else None,
+        'peak_rss_mb': round(sampler.peak_rss / 1024 / 1024, 1) if sampler.peak_rss is not None else None,
+        'peak_temp_mb': round(sampler.peak_temp / 1024 / 1024, 1),
+        'downloads_mb': round((_dir_size(server.download_dir) - downloads_before) / 1024 / 1024, 1),
+    }
+
+
+def select_scenarios(only, skip):
+    """依名稱或群組篩選情境"""
+    selected = []
+    for scenario in SCENARIOS:
+        keys = {scenario.name, scenario.group}
+        if only and not keys & only:
+            continue
+        if keys & skip:
+            continue
+        selected.append(scenario)
+    return selected
+
+
+def compare(results, baseline, tolerance):
+    """與基準比較，回傳退步項目的說明"""
+    regressions = []
+    for key, current in results.items():
+        base = baseline.get(key)
+        if base is None:
+            continue
+        for metric in ('p50_ms', 'p99_ms', 'peak_rss_mb', 'peak_temp_mb'):
+            old, new = base.get(metric), current.get(metric)
+            if old is None or new is None:
+                continue
+            floor = MIN_REGRESSION_MS if metric.endswith('_ms') else 1.0
+            if new > old * (1 + tolerance) and new - old > floor:
+                regressions.append(f'{key} {metric}: {old} → {new}')
+        old, new = base.get('rps'), current.get('rps')
+        if old and new is not None and new < old / (1 + tolerance):
+            regressions.append(f'{key} rps: {old} → {new}')
+        if current['errors'] > base.get('errors', 0):
+            regressions.append(f"{key} errors: {base.get('errors', 0)} → {current['errors']}")
+    return regressions
+
+
+def _format(value):
+    return '-' if value is None else str(value)
+
+
+def print_table(results):
+    columns = ('scenario', 'concurrency', 'requests', 'errors', 'p50_ms', 'p99_ms', 'rps', 'peak_rss_mb', 'peak_temp_mb')
+    rows = [[_format(result[c]) for c in columns] for result in results.values()]
+    widths = [max(len(c), *(len(row[n]) for row in rows)) if rows else len(c) for n, c in enumerate(columns)]
+    print('  '.join(c.ljust(w) for c, w in zip(columns, widths)))
+    for row in rows:
+        print('  '.join(value.ljust(w) for value, w in zip(row, widths)))
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='AnyMusic 離線效能測試')
+    parser.add_argument('-c', '--concurrency', default='1,8', help='並行數，逗號分隔（預設 1,8）')
+    parser.add_argument('-n', '--requests', type=int, default=40, help='每個情境、每個並行數的請求數')
+    parser.add_argument('--warmup', type=int, default=2, help='計時前先執行的次數')
+    parser.add_argument('--only', default='', help='只執行這些情境或群組（逗號分隔）')
+    parser.add_argument('--skip', default='', help='略過這些情境或群組（逗號分隔）')
+    parser.add_argument('--list', action='store_true', help='列出所有情境')
+    parser.add_argument('--workers', type=int, default=2, help='gunicorn worker 數')
+    parser.add_argument('--threads', type=int, default=8, help='每個 gunicorn worker 的執行緒數')
+    parser.add_argument('--worker-class', default='gthread')
+    parser.add_argument('--port', type=int, default=0)
+    parser.add_argument('--env', action='append', default=[], metavar='KEY=VALUE', help='額外傳給伺服器的環境變數')
+    parser.add_argument('--short-url-provider', default='tinyurl', choices=('local', 'tinyurl'),
+                        help='tinyurl 時外部服務改用本地替身')
+    parser.add_argument('--upstream-latency', type=float, default=0.0, help='替身伺服器每個請求的延遲秒數')
+    parser.add_argument('--audio-seconds', type=int, default=AUDIO_SECONDS)
+    parser.add_argument('--pdf-pages', type=int, default=PDF_PAGES)
+    parser.add_argument('--output', type=Path, help='將結果寫入 JSON 檔')
+    parser.add_argument('--save-baseline', nargs='?', const=DEFAULT_BASELINE, type=Path, help='將結果存為基準')
+    parser.add_argument('--baseline', type=Path, help='與此基準比較，退步時結束碼為 1')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='允許的退步比例（預設 0.25）')
+    parser.add_argument('--keep', action='store_true', help='保留工作目錄（伺服器日誌與產出檔）')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    split = lambda value: {item.strip() for item in value.split(',') if item.strip()}
+    scenarios = select_scenarios(split(args.only), split(args.skip))
+    if args.list:
+        for scenario in scenarios:
+            requires = f" [{', '.join(scenario.requires)}]" if scenario.requires else ''
+            print(f'{scenario.group:<10} {scenario.name:<22} {scenario.description}{requires}')
+        return 0
+    levels = [int(c) for c in args.concurrency.split(',') if c.strip()]
+
+    workdir = Path(tempfile.mkdtemp(prefix='anymusic-bench-'))
+    print(f'[INFO] 工作目錄: {workdir}')
+    fixtures = build_fixtures(workdir / 'fixtures', args.audio_seconds, args.pdf_pages)
+    standins = StandInServer(fixtures['audio'], delay=args.upstream_latency).start()
+    server = AppServer(workdir / 'server', standins, args)
+    server.workdir.mkdir()
+    results = {}
+    skipped = {}
+    try:
+        server.start()
+        print(f'[INFO] gunicorn 已就緒: {server.base_url}（{args.workers} workers × {args.threads} threads，'
+              f'啟動到全部預熱完成 {server.ready_seconds:.2f} 秒）')
+        ctx = Context(fixtures, standins, server.download_dir)
+        for scenario in scenarios:
+            missing = scenario.missing()
+            if missing:
+                skipped[scenario.name] = f"缺少 {', '.join(missing)}"
+                print(f'[SKIP] {scenario.name}: {skipped[scenario.name]}')
+                continue
+            client = Client(server.base_url)
+            try:
+                if scenario.setup:
+                    scenario.setup(ctx, client)
+                for i in range(args.warmup):
+                    scenario.run(ctx, client, i)
+            except Exception as e:
+                skipped[scenario.name] = f'準備失敗: {str(e)[:300]}'
+                print(f'[SKIP] {scenario.name}: {skipped[scenario.name]}')
+                continue
+            finally:
+                client.close()
+            for concurrency in levels:
+                result = run_level(scenario, ctx, server, concurrency, args.requests)
+                results[f'{scenario.name}@{concurrency}'] = result
+                print(f"[RUN ] {scenario.name}@{concurrency}: p50 {_format(result['p50_ms'])} ms, "
+                      f"p99 {_format(result['p99_ms'])} ms, {_format(result['rps'])} req/s, "
+                      f"{result['errors']} errors")
+                if result['error_sample']:
+                    print(f"       {result['error_sample']}")
+    finally:
+        server.stop()
+        standins.stop()
+        if args.keep:
+            print(f'[INFO] 保留工作目錄: {workdir}')
+        else:
+            shutil.rmtree(str(workdir), ignore_errors=True)
+
+    print()
+    print_table(results)
+    report = {
+        'meta': {
+            'created_at': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpus': os.cpu_count(),
+            'workers': args.workers,
+            'threads': args.threads,
+            'worker_class': args.worker_class,
+            'requests': args.requests,
+            'audio_seconds': args.audio_seconds,
+            'pdf_pages': args.pdf_pages,
+            'upstream_hits': standins.hits,
+            'skipped': skipped,
+        },
+        'results': results,
+    }
+    for path in filter(None, (args.output, args.save_baseline)):
+        path.write_text(json.dumps(report, ensure_ascii=False, indent=2), encoding='utf-8')
+        print(f'[INFO] 已寫入 {path}')
+
+    if args.baseline:
+        baseline = json.loads(args.baseline.read_text(encoding='utf-8'))
+        regressions = compare(results, baseline['results'], args.tolerance)
+        if regressions:
+            print(f'\n[FAIL] 與基準相比有 {len(regressions)} 項退步（容許 {args.tolerance:.0%}）：')
+            for line in regressions:
+                print(f'  {line}')
+            return 1
+        print(f'\n[PASS] 與基準相比沒有超過 {args.tolerance:.0%} 的退步')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
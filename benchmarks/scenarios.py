@@ -0,0 +1,403 @@
+"""每個 API 端點的測試情境
+
+每個情境的 run(ctx, client, i) 執行一次完整操作（非同步端點包含輪詢到完成與下載結果），
+其耗時即為一次的延遲；setup(ctx) 在計時前執行一次，準備需要的工作階段或檔案。
+requires 列出缺少時略過的外部相依（ffmpeg、rembg、pypdfium2）。
+"""
+import importlib.util
+import itertools
+import json
+import shutil
+import urllib.parse
+import uuid
+
+REQUIREMENTS = {
+    'ffmpeg': lambda: shutil.which('ffmpeg') is not None,
+    'rembg': lambda: importlib.util.find_spec('rembg') is not None,
+    'pypdfium2': lambda: importlib.util.find_spec('pypdfium2') is not None,
+}
+
+DOWNLOAD_FOLDER = 'bench'  # 預先放入下載目錄的「播放清單」資料夾
+DOWNLOAD_TRACKS = 5
+PLAYLIST_SIZE = 4
+QR_BATCH_SIZE = 200
+FINISHED = ('completed', 'error', 'cancelled', 'not_found')
+
+SCENARIOS = []
+
+
+class Scenario:
+    def __init__(self, name, group, run, setup=None, requires=()):
+        self.name = name
+        self.group = group
+        self.run = run
+        self.setup = setup
+        self.requires = tuple(requires)
+        self.description = (run.__doc__ or '').strip()
+
+    def missing(self):
+        """缺少的外部相依"""
+        return [name for name in self.requires if not REQUIREMENTS[name]()]
+
+
+def scenario(name, group, setup=None, requires=()):
+    def register(run):
+        SCENARIOS.append(Scenario(name, group, run, setup, requires))
+        return run
+    return register
+
+
+class Context:
+    """情境共用的狀態：測試檔案、替身伺服器、伺服器的下載目錄與 setup 的結果"""
+
+    def __init__(self, fixtures, standins, download_dir):
+        self.fixtures = fixtures
+        self.standins = standins
+        self.download_dir = download_dir
+        self.state = {}
+        self.run_id = uuid.uuid4().hex[:8]
+        self._counter = itertools.count()
+
+    def unique(self):
+        """每次呼叫都不同的識別碼（避免命中伺服器快取）"""
+        return f'{self.run_id}-{next(self._counter)}'
+
+    def read(self, name):
+        data = self.state.get(('bytes', name))
+        if data is None:
+            data = self.state[('bytes', name)] = self.fixtures[name].read_bytes()
+        return data
+
+
+def _audio_file(ctx, name='audio', filename='tone.wav'):
+    return ('audio', filename, ctx.read(name), 'audio/wav')
+
+
+def _pdf_file(ctx, name='pdf', field='pdf', suffix=None):
+    data = ctx.read(name)
+    if suffix:
+        # 檔尾加上註解，內容相同但雜湊不同，不會命中工作階段與縮圖快取
+        data += f'\n%bench {suffix}\n'.encode('ascii')
+    return (field, f'{name}.pdf', data, 'application/pdf')
+
+
+def _wait_download(client, task_id):
+    status = client.poll(f'/api/progress/{task_id}', lambda s: s.get('status') in FINISHED, interval=0.1)
+    if status['status'] != 'completed':
+        raise RuntimeError(f"下載失敗: {status.get('error')}")
+    return status
+
+
+def _wait_job(client, job_id):
+    status = client.poll(f'/api/jobs/{job_id}', lambda s: s.get('status') in FINISHED)
+    if status['status'] != 'completed':
+        raise RuntimeError(f"工作失敗: {status.get('error')}")
+    return client.get(f'/api/jobs/{job_id}/result')
+
+
+# ============ 頁面 ============
+
+@scenario('index', 'pages')
+def index(ctx, client, i):
+    """GET / 首頁"""
+    client.get('/')
+
+
+# ============ 下載（擷取器與媒體來源為本地替身） ============
+
+def setup_cached_download(ctx, client):
+    task_id = client.post('/api/download', json_body={'url': ctx.standins.watch_url('cached')}).json()['task_id']
+    _wait_download(client, task_id)
+
+
+@scenario('download', 'download', requires=('ffmpeg',))
+def download(ctx, client, i):
+    """POST /api/download 單一影片（不同影片），輪詢到轉檔完成"""
+    task_id = client.post('/api/download', json_body={'url': ctx.standins.watch_url(ctx.unique())}).json()['task_id']
+    _wait_download(client, task_id)
+
+
+@scenario('download_cached', 'download', setup=setup_cached_download, requires=('ffmpeg',))
+def download_cached(ctx, client, i):
+    """POST /api/download 已下載過的影片（快取命中）"""
+    task_id = client.post('/api/download', json_body={'url': ctx.standins.watch_url('cached')}).json()['task_id']
+    _wait_download(client, task_id)
+
+
+@scenario('playlist', 'download', requires=('ffmpeg',))
+def playlist(ctx, client, i):
+    """POST /api/download 播放清單（每次不同的 4 首），輪詢到全部完成"""
+    url = ctx.standins.playlist_url(ctx.unique(), PLAYLIST_SIZE)
+    task_id = client.post('/api/download', json_body={'url': url, 'is_playlist': True}).json()['task_id']
+    _wait_download(client, task_id)
+
+
+def setup_progress(ctx, client):
+    # 沒有 FFmpeg 時任務會以錯誤結束，查詢進度的成本相同
+    ctx.state['task_id'] = client.post('/api/download', json_body={'url': ctx.standins.watch_url('progress')}).json()['task_id']
+
+
+@scenario('progress', 'download', setup=setup_progress)
+def progress(ctx, client, i):
+    """GET /api/progress/<task_id>"""
+    client.get(f"/api/progress/{ctx.state['task_id']}")
+
+
+# ============ 檔案傳送 ============
+
+def setup_downloads(ctx, client):
+    """直接在伺服器的下載目錄放入檔案（不需要 FFmpeg）"""
+    folder = ctx.download_dir / DOWNLOAD_FOLDER
+    folder.mkdir(parents=True, exist_ok=True)
+    for n in range(DOWNLOAD_TRACKS):
+        # 內容是 WAV，副檔名用 .mp3 才會被打包；傳送不解析內容，不影響測試
+        shutil.copyfile(str(ctx.fixtures['audio']), str(folder / f'track-{n}.mp3'))
+    ctx.state['file_path'] = f'/downloads/{DOWNLOAD_FOLDER}/track-0.mp3'
+    ctx.state['zip_path'] = '/api/downloads/zip?' + urllib.parse.urlencode({'folder': DOWNLOAD_FOLDER})
+    for key in ('file', 'zip'):
+        response = client.get(ctx.state[f'{key}_path'], keep_body=0)
+        ctx.state[f'{key}_etag'] = response.headers['ETag']
+        ctx.state[f'{key}_size'] = response.size
+
+
+@scenario('downloads_file', 'delivery', setup=setup_downloads)
+def downloads_file(ctx, client, i):
+    """GET /downloads/<path> 完整檔案"""
+    client.get(ctx.state['file_path'], keep_body=0)
+
+
+@scenario('downloads_resume', 'delivery', setup=setup_downloads)
+def downloads_resume(ctx, client, i):
+    """GET /downloads/<path> 以 Range + If-Range 續傳後半段"""
+    headers = {'Range': f"bytes={ctx.state['file_size'] // 2}-", 'If-Range': ctx.state['file_etag']}
+    client.get(ctx.state['file_path'], headers=headers, expect=(206,), keep_body=0)
+
+
+@scenario('downloads_zip', 'delivery', setup=setup_downloads)
+def downloads_zip(ctx, client, i):
+    """GET /api/downloads/zip 打包 5 個檔案"""
+    client.get(ctx.state['zip_path'], keep_body=0)
+
+
+@scenario('downloads_zip_resume', 'delivery', setup=setup_downloads)
+def downloads_zip_resume(ctx, client, i):
+    """GET /api/downloads/zip 從中間續傳（需重新計算略過檔案的 CRC）"""
+    headers = {'Range': f"bytes={ctx.state['zip_size'] // 2}-", 'If-Range': ctx.state['zip_etag']}
+    client.get(ctx.state['zip_path'], headers=headers, expect=(206,), keep_body=0)
+
+
+# ============ 音訊處理（FFmpeg） ============
+
+@scenario('trim', 'audio', requires=('ffmpeg',))
+def trim(ctx, client, i):
+    """POST /api/trim 兩段切割打包 ZIP"""
+    client.post_form('/api/trim', {'cuts': '0-5,10-15', 'mode': 'fast', 'output': 'zip'}, [_audio_file(ctx)], keep_body=0)
+
+
+@scenario('trim_stream', 'audio', requires=('ffmpeg',))
+def trim_stream(ctx, client, i):
+    """POST /api/trim/stream 串流上傳與下載"""
+    query = urllib.parse.urlencode({'filename': 'tone.wav', 'start_time': 5, 'end_time': 20})
+    client.post(f'/api/trim/stream?{query}', body=ctx.read('audio'), headers={'Content-Type': 'audio/wav'}, keep_body=0)
+
+
+@scenario('convert', 'audio', requires=('ffmpeg',))
+def convert(ctx, client, i):
+    """POST /api/convert-to-mp3"""
+    client.post_form('/api/convert-to-mp3', {'bitrate': '192'}, [_audio_file(ctx)], keep_body=0)
+
+
+@scenario('convert_stream', 'audio', requires=('ffmpeg',))
+def convert_stream(ctx, client, i):
+    """POST /api/convert-to-mp3/stream"""
+    query = urllib.parse.urlencode({'filename': 'tone.wav', 'bitrate': 192})
+    client.post(f'/api/convert-to-mp3/stream?{query}', body=ctx.read('audio'), headers={'Content-Type': 'audio/wav'}, keep_body=0)
+
+
+@scenario('convert_batch', 'audio', requires=('ffmpeg',))
+def convert_batch(ctx, client, i):
+    """POST /api/convert/batch 兩個檔案 × mp3、opus"""
+    files = [_audio_file(ctx, 'audio_short', 'a.wav'), _audio_file(ctx, 'audio_short', 'b.wav')]
+    client.post_form('/api/convert/batch', {'targets': 'mp3:192,opus:96'}, files, keep_body=0)
+
+
+@scenario('job_trim', 'audio', requires=('ffmpeg',))
+def job_trim(ctx, client, i):
+    """POST /api/jobs/trim，輪詢到完成後下載結果"""
+    job_id = client.post_form('/api/jobs/trim', {'start_time': '5', 'end_time': '20'}, [_audio_file(ctx)]).json()['job_id']
+    _wait_job(client, job_id)
+
+
+@scenario('job_convert', 'audio', requires=('ffmpeg',))
+def job_convert(ctx, client, i):
+    """POST /api/jobs/convert-to-mp3，輪詢到完成後下載結果"""
+    job_id = client.post_form('/api/jobs/convert-to-mp3', {'bitrate': '192'}, [_audio_file(ctx)]).json()['job_id']
+    _wait_job(client, job_id)
+
+
+# ============ PDF ============
+
+def setup_pdf_session(ctx, client):
+    info = client.post_form('/api/pdf/sessions', files=[_pdf_file(ctx)]).json()
+    ctx.state['session'] = info['session_id']
+    ctx.state['pages'] = info['pages']
+
+
+def setup_pdf_thumbnails(ctx, client):
+    setup_pdf_session(ctx, client)
+    for page in range(1, ctx.state['pages'] + 1):
+        client.get(f"/api/pdf/sessions/{ctx.state['session']}/thumbnails/{page}", keep_body=0)
+
+
+@scenario('pdf_session', 'pdf')
+def pdf_session(ctx, client, i):
+    """POST /api/pdf/sessions 上傳新文件"""
+    client.post_form('/api/pdf/sessions', files=[_pdf_file(ctx, suffix=ctx.unique())])
+
+
+@scenario('pdf_session_info', 'pdf', setup=setup_pdf_session)
+def pdf_session_info(ctx, client, i):
+    """GET /api/pdf/sessions/<id>"""
+    client.get(f"/api/pdf/sessions/{ctx.state['session']}")
+
+
+@scenario('pdf_thumbnails', 'pdf', requires=('pypdfium2',))
+def pdf_thumbnails(ctx, client, i):
+    """上傳新文件後以 SSE 取得所有頁面縮圖（未快取）"""
+    info = client.post_form('/api/pdf/sessions', files=[_pdf_file(ctx, 'pdf_small', suffix=ctx.unique())]).json()
+    client.get(f"/api/pdf/sessions/{info['session_id']}/thumbnails")
+
+
+@scenario('pdf_thumbnail_cached', 'pdf', setup=setup_pdf_thumbnails, requires=('pypdfium2',))
+def pdf_thumbnail_cached(ctx, client, i):
+    """GET /api/pdf/sessions/<id>/thumbnails/<page>（已產生的縮圖）"""
+    page = i % ctx.state['pages'] + 1
+    client.get(f"/api/pdf/sessions/{ctx.state['session']}/thumbnails/{page}", keep_body=0)
+
+
+@scenario('pdf_merge', 'pdf')
+def pdf_merge(ctx, client, i):
+    """POST /api/pdf/merge 兩個上傳檔"""
+    files = [_pdf_file(ctx, 'pdf', 'pdfs'), _pdf_file(ctx, 'pdf_small', 'pdfs')]
+    client.post_form('/api/pdf/merge', files=files, keep_body=0)
+
+
+@scenario('pdf_merge_optimize', 'pdf')
+def pdf_merge_optimize(ctx, client, i):
+    """POST /api/pdf/merge optimize=1（重新壓縮圖片與串流）"""
+    files = [_pdf_file(ctx, 'pdf', 'pdfs'), _pdf_file(ctx, 'pdf_small', 'pdfs')]
+    client.post_form('/api/pdf/merge', {'optimize': '1'}, files, keep_body=0)
+
+
+@scenario('pdf_edit', 'pdf', setup=setup_pdf_session)
+def pdf_edit(ctx, client, i):
+    """POST /api/pdf/edit 以工作階段執行選取、旋轉、刪除、重排"""
+    operations = [
+        {'op': 'select', 'pages': '1-12'},
+        {'op': 'rotate', 'pages': '2,3', 'angle': 90},
+        {'op': 'delete', 'pages': '5'},
+        {'op': 'reorder', 'order': '3,1,2,4-11'},
+    ]
+    client.post_form('/api/pdf/edit', {'session': ctx.state['session'], 'operations': json.dumps(operations)}, keep_body=0)
+
+
+@scenario('pdf_split', 'pdf')
+def pdf_split(ctx, client, i):
+    """POST /api/pdf/split 上傳檔"""
+    client.post_form('/api/pdf/split', {'pages': '1-5,8'}, [_pdf_file(ctx)], keep_body=0)
+
+
+@scenario('pdf_rotate', 'pdf')
+def pdf_rotate(ctx, client, i):
+    """POST /api/pdf/rotate 上傳檔"""
+    client.post_form('/api/pdf/rotate', {'rotation': '90', 'pages': 'all'}, [_pdf_file(ctx)], keep_body=0)
+
+
+@scenario('pdf_delete', 'pdf')
+def pdf_delete(ctx, client, i):
+    """POST /api/pdf/delete 上傳檔"""
+    client.post_form('/api/pdf/delete', {'pages': '1,3,5'}, [_pdf_file(ctx)], keep_body=0)
+
+
+# ============ QR Code ============
+
+@scenario('qrcode', 'qr')
+def qrcode(ctx, client, i):
+    """POST /api/qrcode（每次不同內容）"""
+    client.post('/api/qrcode', json_body={'content': f'https://example.com/item/{ctx.unique()}'})
+
+
+@scenario('qrcode_image', 'qr')
+def qrcode_image(ctx, client, i):
+    """GET /api/qrcode/image（相同內容，快取命中）"""
+    client.get('/api/qrcode/image?' + urllib.parse.urlencode({'content': 'https://example.com/', 'size': 10}))
+
+
+@scenario('qrcode_download', 'qr')
+def qrcode_download(ctx, client, i):
+    """POST /api/qrcode/download SVG（每次不同內容）"""
+    client.post('/api/qrcode/download', json_body={'content': f'https://example.com/svg/{ctx.unique()}', 'format': 'svg'})
+
+
+def _qr_items(ctx):
+    prefix = ctx.unique()
+    return [{'content': f'https://example.com/{prefix}/{n}', 'label': f'#{n}'} for n in range(QR_BATCH_SIZE)]
+
+
+@scenario('qrcode_batch_zip', 'qr')
+def qrcode_batch_zip(ctx, client, i):
+    """POST /api/qrcode/batch 200 個 PNG 打包 ZIP"""
+    client.post('/api/qrcode/batch', json_body={'items': _qr_items(ctx), 'output': 'zip'}, keep_body=0)
+
+
+@scenario('qrcode_batch_pdf', 'qr')
+def qrcode_batch_pdf(ctx, client, i):
+    """POST /api/qrcode/batch 200 個標籤排成 PDF"""
+    client.post('/api/qrcode/batch', json_body={'items': _qr_items(ctx), 'output': 'pdf'}, keep_body=0)
+
+
+# ============ 短網址（外部服務為本地替身） ============
+
+def setup_short_url(ctx, client):
+    ctx.state['code'] = client.post('/api/shorten', json_body={'url': 'https://example.com/bench'}).json()['code']
+
+
+@scenario('shorten', 'short_url')
+def shorten(ctx, client, i):
+    """POST /api/shorten（每次不同網址）"""
+    client.post('/api/shorten', json_body={'url': f'https://example.com/page/{ctx.unique()}'})
+
+
+@scenario('short_stats', 'short_url', setup=setup_short_url)
+def short_stats(ctx, client, i):
+    """GET /api/shorten/<code>"""
+    client.get(f"/api/shorten/{ctx.state['code']}")
+
+
+@scenario('short_redirect', 'short_url', setup=setup_short_url)
+def short_redirect(ctx, client, i):
+    """GET /s/<code> 302 轉址"""
+    client.get(f"/s/{ctx.state['code']}", expect=(302,))
+
+
+# ============ 圖片與文字 ============
+
+@scenario('remove_bg', 'image', requires=('rembg',))
+def remove_bg(ctx, client, i):
+    """POST /api/remove-bg 512×512 PNG"""
+    client.post_form('/api/remove-bg', files=[('image', 'photo.png', ctx.read('image'), 'image/png')], keep_body=0)
+
+
+@scenario('mask_text', 'text')
+def mask_text(ctx, client, i):
+    """POST /api/mask-text JSON（約 4 KB）"""
+    text = ctx.state.get('mask_text')
+    if text is None:
+        text = ctx.state['mask_text'] = ctx.read('text')[:4096].decode('utf-8', 'ignore')
+    client.post('/api/mask-text', json_body={'text': text})
+
+
+@scenario('mask_file', 'text')
+def mask_file(ctx, client, i):
+    """POST /api/mask-text 上傳 1 MB 文字檔串流處理"""
+    client.post_form('/api/mask-text', files=[('file', 'log.txt', ctx.read('text'), 'text/plain')], keep_body=0)
@@ -0,0 +1,135 @@
+"""取代外部服務的本地替身伺服器
+
+- /media/<id>.wav：任何 id 都回傳同一個合成音訊（支援 Range，yt-dlp 與 FFmpeg 可續傳）
+- /watch/<id>、/playlist/<id>：只供擷取器辨識網址，內容不會被讀取
+- /api-create.php?url=...：TinyURL 相容的短網址 API
+
+可設定每個請求的延遲，模擬外部服務的網路往返時間。
+"""
+import hashlib
+import re
+import threading
+import time
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+RANGE_RE = re.compile(r'bytes=(\d*)-(\d*)$')
+COPY_CHUNK = 64 * 1024
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status, body=b'', content_type='text/plain; charset=utf-8', headers=None):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        if self.command != 'HEAD':
+            self.wfile.write(body)
+
+    def do_HEAD(self):
+        self.do_GET()
+
+    def do_GET(self):
+        server = self.server
+        if server.delay:
+            time.sleep(server.delay)
+        parsed = urllib.parse.urlsplit(self.path)
+        kind = parsed.path.split('/')[1]
+        with server.lock:
+            server.hits[kind] = server.hits.get(kind, 0) + 1
+        if parsed.path.startswith('/media/'):
+            return self._media()
+        if parsed.path == '/api-create.php':
+            url = urllib.parse.parse_qs(parsed.query).get('url', [''])[0]
+            if not url:
+                return self._send(400, b'Error')
+            code = hashlib.sha1(url.encode('utf-8')).hexdigest()[:8]
+            return self._send(200, f'http://{self.headers.get("Host")}/t/{code}'.encode('ascii'))
+        if parsed.path.startswith(('/watch/', '/playlist/')):
+            return self._send(200, b'<html><body>bench</body></html>', 'text/html; charset=utf-8')
+        self._send(404, b'Not Found')
+
+    def _media(self):
+        path = self.server.media_path
+        size = path.stat().st_size
+        start, stop = 0, size
+        status = 200
+        headers = {'Accept-Ranges': 'bytes'}
+        match = RANGE_RE.match(self.headers.get('Range', ''))
+        if match and (match.group(1) or match.group(2)):
+            if match.group(1):
+                start = int(match.group(1))
+                stop = min(int(match.group(2)) + 1, size) if match.group(2) else size
+            else:
+                start = max(0, size - int(match.group(2)))
+            if start >= size:
+                return self._send(416, headers={'Content-Range': f'bytes */{size}'})
+            status = 206
+            headers['Content-Range'] = f'bytes {start}-{stop - 1}/{size}'
+
+        self.send_response(status)
+        self.send_header('Content-Type', 'audio/wav')
+        self.send_header('Content-Length', str(stop - start))
+        for key, value in headers.items():
+            self.send_header(key, value)
+        self.end_headers()
+        if self.command == 'HEAD':
+            return
+        with open(str(path), 'rb') as f:
+            f.seek(start)
+            remaining = stop - start
+            while remaining > 0:
+                chunk = f.read(min(COPY_CHUNK, remaining))
+                if not chunk:
+                    break
+                try:
+                    self.wfile.write(chunk)
+                except (BrokenPipeError, ConnectionResetError):
+                    return
+                remaining -= len(chunk)
+
+
+class StandInServer(ThreadingHTTPServer):
+    """在背景執行緒執行的本地替身伺服器"""
+
+    daemon_threads = True
+
+    def __init__(self, media_path, delay=0.0, host='127.0.0.1', port=0):
+        super().__init__((host, port), _Handler)
+        self.media_path = Path(media_path)
+        self.delay = delay
+        self.hits = {}
+        self.lock = threading.Lock()
+        self._thread = None
+
+    @property
+    def base_url(self):
+        host, port = self.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def watch_url(self, video_id):
+        return f'{self.base_url}/watch/{video_id}'
+
+    def playlist_url(self, playlist_id, count):
+        return f'{self.base_url}/playlist/{playlist_id}?n={count}'
+
+    @property
+    def shortener_api(self):
+        return f'{self.base_url}/api-create.php'
+
+    def start(self):
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True, name='bench-standins')
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
@@ -0,0 +1,157 @@
+import os
+import queue
+import threading
+from contextlib import contextmanager
+import metrics
+import startup
+
+# 圖片去背設定（可用環境變數調整）
+REMBG_MODEL = os.environ.get('REMBG_MODEL', 'u2net')  # 預設模型
+REMBG_MODELS = tuple(
+    m.strip() for m in os.environ.get('REMBG_MODELS', REMBG_MODEL).split(',') if m.strip()
+)  # 允許請求指定的模型
+REMBG_POOL_SIZE = int(os.environ.get('REMBG_POOL_SIZE', '1'))  # 每個行程、每個模型最多的推論工作階段數
+REMBG_INTRA_OP_THREADS = int(os.environ.get('REMBG_INTRA_OP_THREADS', '0'))  # 0 表示使用 ONNX Runtime 預設
+REMBG_INTER_OP_THREADS = int(os.environ.get('REMBG_INTER_OP_THREADS', '0'))
+REMBG_QUEUE_TIMEOUT = float(os.environ.get('REMBG_QUEUE_TIMEOUT', '60'))  # 秒，等待空閒工作階段的上限
+REMBG_PRELOAD = os.environ.get('REMBG_PRELOAD', '0') == '1'  # 啟動時載入 rembg 與預設模型（未設定時第一個請求才載入）
+
+_pools = {}
+_pools_pid = None
+_pools_lock = threading.Lock()
+
+class RembgUnavailable(Exception):
+    """未安裝 rembg"""
+
+class RembgBusy(Exception):
+    """等待空閒工作階段逾時"""
+
+def _session_options():
+    import onnxruntime as ort
+
+    options = ort.SessionOptions()
+    if REMBG_INTRA_OP_THREADS > 0:
+        options.intra_op_num_threads = REMBG_INTRA_OP_THREADS
+    if REMBG_INTER_OP_THREADS > 0:
+        options.inter_op_num_threads = REMBG_INTER_OP_THREADS
+    return options
+
+def _create_session(model):
+    """載入模型並建立推論工作階段（數百 MB，只在池中數量不足時執行）"""
+    try:
+        from rembg import new_session
+    except ImportError:
+        raise RembgUnavailable('圖片去背功能需要安裝 rembg 套件。請執行: pip install rembg')
+    try:
+        from rembg.sessions import sessions_class
+    except ImportError:
+        sessions_class = []
+    for session_class in sessions_class:
+        if session_class.name() == model:
+            # 與 new_session 相同，但可以指定 ONNX Runtime 的執行緒數
+            return session_class(model, _session_options())
+    return new_session(model)
+
+class _SessionPool:
+    """單一模型的工作階段池：需要時才建立，最多 REMBG_POOL_SIZE 個，用完放回重複使用"""
+
+    def __init__(self, model):
+        self.model = model
+        self._idle = queue.LifoQueue()  # 最近用過的優先，較少的工作階段保持常駐
+        self._created = 0
+        self._lock = threading.Lock()
+
+    def _acquire(self):
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self._lock:
+            create = self._created < max(1, REMBG_POOL_SIZE)
+            if create:
+                self._created += 1
+        if create:
+            try:
+                with metrics.stage('rembg.load'):
+                    return _create_session(self.model)
+            except Exception:
+                with self._lock:
+                    self._created -= 1
+                raise
+        try:
+            with metrics.stage('rembg.wait'):
+                return self._idle.get(timeout=REMBG_QUEUE_TIMEOUT)
+        except queue.Empty:
+            raise RembgBusy('去背服務忙碌中，請稍後再試')
+
+    @contextmanager
+    def session(self):
+        session = self._acquire()
+        try:
+            yield session
+        finally:
+            self._idle.put(session)
+
+    def warm(self):
+        """確保至少有一個已載入的工作階段"""
+        with self.session():
+            pass
+
+def _get_pool(model):
+    global _pools_pid
+    with _pools_lock:
+        if _pools_pid != os.getpid():
+            # fork 後的子行程不沿用父行程的工作階段
+            _pools.clear()
+            _pools_pid = os.getpid()
+        pool = _pools.get(model)
+        if pool is None:
+            pool = _pools[model] = _SessionPool(model)
+        return pool
+
+def parse_model(value):
+    model = value or REMBG_MODEL
+    if model != REMBG_MODEL and model not in REMBG_MODELS:
+        raise ValueError(f'不支援的模型: {model}（可用：{", ".join(REMBG_MODELS)}）')
+    return model
+
+def remove_image_background(data, model=None):
+    """移除圖片背景，回傳 PNG 位元組"""
+    try:
+        from rembg import remove
+    except ImportError:
+        raise RembgUnavailable('圖片去背功能需要安裝 rembg 套件。請執行: pip install rembg')
+    with _get_pool(model or REMBG_MODEL).session() as session, metrics.stage('rembg.infer'):
+        return remove(data, session=session)
+
+def preload_model(background=True):
+    """預先載入預設模型，避免第一個請求等待模型載入"""
+    def load():
+        try:
+            _get_pool(REMBG_MODEL).warm()
+            print(f"[INFO] 去背模型已載入: {REMBG_MODEL}")
+        except Exception as e:
+            print(f"[WARN] 無法預先載入去背模型: {e}")
+    if background:
+        threading.Thread(target=load, daemon=True, name='rembg-preload').start()
+    else:
+        load()
+
+def _loaded_sessions():
+    with _pools_lock:
+        if _pools_pid != os.getpid():
+            return {}
+        return {(('model', model),): pool._created for model, pool in _pools.items()}
+
+metrics.register_collector('anymusic_rembg_sessions', '已載入的去背模型工作階段數', _loaded_sessions, scope='process')
+
+def _import_rembg():
+    """載入 rembg 與 ONNX Runtime 模組（可在 fork 前共用；工作階段則由各 worker 建立）"""
+    try:
+        import rembg  # noqa: F401
+    except ImportError:
+        raise RembgUnavailable('圖片去背功能需要安裝 rembg 套件。請執行: pip install rembg')
+
+if REMBG_PRELOAD:
+    startup.register_warmup('rembg', _import_rembg)
+    startup.register_warmup('rembg_model', lambda: preload_model(background=False), per_process=True)
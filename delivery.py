@@ -0,0 +1,121 @@
+import os
+import hashlib
+from pathlib import Path
+from flask import Response, request, send_file
+from werkzeug.datastructures import ContentRange
+from werkzeug.utils import safe_join
+import download_cache
+from storage import get_download_dir, touch, acquire, release
+from zip_stream import StoredZip
+
+ZIP_EXTENSIONS = ('.mp3',)  # 資料夾打包時包含的檔案類型
+
+class DeliveryNotFound(Exception):
+    """檔案不存在"""
+
+def resolve_download(relative_path):
+    """取得下載目錄中的檔案路徑（不允許跳出下載目錄）"""
+    path = safe_join(str(get_download_dir()), relative_path)
+    if path is None or not os.path.isfile(path):
+        raise DeliveryNotFound(relative_path)
+    return Path(path)
+
+def download_etag(relative_path, stat):
+    """強 ETag：有快取索引時以快取鍵與建立時間計算，否則以路徑、大小與修改時間計算"""
+    entry = download_cache.entry_for_path(relative_path)
+    if entry is not None and entry[1] == stat.st_size:
+        basis = f"{entry[0]}:{entry[1]}:{entry[2]}"
+    else:
+        basis = f"{relative_path}:{stat.st_size}:{stat.st_mtime_ns}"
+    return hashlib.sha1(basis.encode('utf-8')).hexdigest()
+
+def send_download(relative_path):
+    """送出下載檔案，支援 Range、If-Range 與 If-None-Match（中斷後可續傳）"""
+    path = resolve_download(relative_path)
+    stat = path.stat()
+    # 只更新 atime，ETag 與 Last-Modified 不變
+    touch(path)
+    return send_file(
+        str(path),
+        as_attachment=True,
+        download_name=path.name,
+        etag=download_etag(relative_path, stat),
+        conditional=True,
+    )
+
+def _unique_arcnames(paths):
+    """壓縮檔內名稱（檔名重複時加上編號）"""
+    used = set()
+    entries = []
+    for path in paths:
+        stem, ext = os.path.splitext(path.name)
+        name = path.name
+        counter = 2
+        while name in used:
+            name = f"{stem}_{counter}{ext}"
+            counter += 1
+        used.add(name)
+        entries.append((name, path))
+    return entries
+
+def folder_entries(folder):
+    """下載目錄中某個資料夾（例如播放清單）內的音訊檔"""
+    path = safe_join(str(get_download_dir()), folder)
+    if path is None or not os.path.isdir(path):
+        raise DeliveryNotFound(folder)
+    paths = sorted(p for p in Path(path).iterdir() if p.is_file() and p.suffix.lower() in ZIP_EXTENSIONS)
+    if not paths:
+        raise DeliveryNotFound(folder)
+    return _unique_arcnames(paths)
+
+def file_entries(relative_paths):
+    """依相對路徑清單（例如播放清單下載結果，可能包含位於其他資料夾的快取檔）取得項目"""
+    paths = []
+    for relative_path in relative_paths:
+        try:
+            paths.append(resolve_download(relative_path))
+        except DeliveryNotFound:
+            continue
+    if not paths:
+        raise DeliveryNotFound('')
+    return _unique_arcnames(paths)
+
+def zip_response(entries, headers=None):
+    """以 STORED ZIP 串流回傳多個檔案，記憶體用量固定，支援 Range 續傳
+
+    ETag 由檔名、大小與修改時間決定；If-Range 不符時回傳完整內容。
+    """
+    archive = StoredZip(entries)
+    etag = archive.etag
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+        response.set_etag(etag)
+        return response
+
+    start, stop, partial = 0, archive.size, False
+    if request.range is not None:
+        if_range = request.if_range
+        if (if_range.etag is None and if_range.date is None) or if_range.etag == etag:
+            byte_range = request.range.range_for_length(archive.size)
+            if byte_range is not None:
+                start, stop = byte_range
+                partial = True
+            elif len(request.range.ranges) == 1:
+                response = Response(status=416)
+                response.content_range = ContentRange('bytes', None, None, archive.size)
+                return response
+
+    # 壓縮檔內的檔案在送出時才逐一開啟，送完前不可被清理
+    paths = [entry['path'] for entry in archive.entries]
+    acquire(*paths)
+    response = Response(archive.iter_range(start, stop), mimetype='application/zip', headers=headers)
+    response.call_on_close(lambda: release(*paths))
+    response.content_length = stop - start
+    response.accept_ranges = 'bytes'
+    response.set_etag(etag)
+    for entry in archive.entries:
+        touch(entry['path'])
+    if partial:
+        response.status_code = 206
+        response.content_range = ContentRange('bytes', start, stop, archive.size)
+    return response
@@ -0,0 +1,122 @@
+import os
+import time
+import sqlite3
+import threading
+from pathlib import Path
+
+# 下載快取設定（可用環境變數調整）
+DOWNLOAD_CACHE_DB_PATH = Path(os.environ.get('DOWNLOAD_CACHE_DB_PATH', Path(__file__).parent / "cache.db"))
+DOWNLOAD_CACHE_MAX_BYTES = int(os.environ.get('DOWNLOAD_CACHE_MAX_BYTES', str(5 * 1024 * 1024 * 1024)))  # 預設 5GB
+
+_extractors = None
+_extractors_lock = threading.Lock()
+
+def _connect():
+    """開啟快取索引資料庫連線"""
+    conn = sqlite3.connect(str(DOWNLOAD_CACHE_DB_PATH), timeout=30, isolation_level=None)
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS cache (
+            cache_key TEXT PRIMARY KEY,
+            path TEXT NOT NULL,
+            title TEXT,
+            size INTEGER NOT NULL,
+            created_at REAL NOT NULL,
+            last_access REAL NOT NULL
+        )
+    ''')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_cache_access ON cache (last_access)')
+    return conn
+
+def make_cache_key(extractor, video_id, codec, quality):
+    """組合快取鍵：擷取器 + 影片 ID + 編碼 + 位元率"""
+    return f"{extractor}:{video_id}:{codec}:{quality}"
+
+def resolve_video_id(url):
+    """不連網，僅從網址判斷擷取器與影片 ID（無法判斷時回傳 None）"""
+    global _extractors
+    with _extractors_lock:
+        if _extractors is None:
+            from yt_dlp.extractor import gen_extractor_classes
+            _extractors = [ie for ie in gen_extractor_classes() if ie.ie_key() != 'Generic']
+
+    for ie in _extractors:
+        if ie.suitable(url):
+            video_id = ie.get_temp_id(url)
+            if video_id:
+                return ie.ie_key(), video_id
+            return None
+    return None
+
+def lookup(cache_key, download_dir):
+    """查詢快取，命中時更新存取時間並回傳 (相對路徑, 標題)"""
+    conn = _connect()
+    try:
+        row = conn.execute('SELECT path, title FROM cache WHERE cache_key = ?', (cache_key,)).fetchone()
+        if row is None:
+            return None
+        if not (Path(download_dir) / row[0]).exists():
+            # 檔案已被刪除，移除失效的索引
+            conn.execute('DELETE FROM cache WHERE cache_key = ?', (cache_key,))
+            return None
+        conn.execute('UPDATE cache SET last_access = ? WHERE cache_key = ?', (time.time(), cache_key))
+        return row[0], row[1]
+    finally:
+        conn.close()
+
+def entry_for_path(relative_path):
+    """依相對路徑查詢快取項目，回傳 (快取鍵, 大小, 建立時間) 或 None"""
+    conn = _connect()
+    try:
+        return conn.execute(
+            'SELECT cache_key, size, created_at FROM cache WHERE path = ?', (relative_path,)
+        ).fetchone()
+    finally:
+        conn.close()
+
+def store(cache_key, relative_path, title, download_dir):
+    """登錄下載完成的檔案，並依容量上限淘汰最久未使用的項目"""
+    file_path = Path(download_dir) / relative_path
+    if not file_path.exists():
+        return
+    now = time.time()
+    conn = _connect()
+    try:
+        conn.execute(
+            'INSERT OR REPLACE INTO cache (cache_key, path, title, size, created_at, last_access) VALUES (?, ?, ?, ?, ?, ?)',
+            (cache_key, relative_path, title, file_path.stat().st_size, now, now)
+        )
+        _evict(conn, download_dir, keep=cache_key)
+    finally:
+        conn.close()
+
+def _evict(conn, download_dir, keep=None):
+    """刪除最久未使用的檔案，直到總大小低於 DOWNLOAD_CACHE_MAX_BYTES"""
+    total = conn.execute('SELECT COALESCE(SUM(size), 0) FROM cache').fetchone()[0]
+    if total <= DOWNLOAD_CACHE_MAX_BYTES:
+        return
+
+    from storage import in_use_paths  # storage 的清理程序不限制下載目錄容量，由這裡統一淘汰
+
+    busy = in_use_paths()
+    rows = conn.execute('SELECT cache_key, path, size FROM cache ORDER BY last_access').fetchall()
+    for cache_key, relative_path, size in rows:
+        if total <= DOWNLOAD_CACHE_MAX_BYTES:
+            break
+        file_path = Path(download_dir) / relative_path
+        if cache_key == keep or str(file_path.resolve()) in busy:
+            continue
+        try:
+            file_path.unlink()
+        except FileNotFoundError:
+            pass
+        # 播放清單資料夾清空後一併移除
+        parent = file_path.parent
+        if parent != Path(download_dir):
+            try:
+                parent.rmdir()
+            except OSError:
+                pass
+        conn.execute('DELETE FROM cache WHERE cache_key = ?', (cache_key,))
+        total -= size
+        print(f"[INFO] 快取已滿，移除: {relative_path}")
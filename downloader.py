@@ -1,17 +1,43 @@
 import yt_dlp
 import os
 import uuid
+import time
+import socket
+import sqlite3
+import subprocess
 import threading
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
+from yt_dlp.utils import sanitize_filename
+from progress_store import get_progress_store, stream_status, public_view, PROGRESS_STEP, PROGRESS_TTL, FINISHED_STATUSES
+import download_cache
+import metrics
+import startup
+from storage import get_download_dir  # 下載目錄的容量與保留期限見 storage.py
 
-# 下載進度追蹤
-download_progress = {}
+# 下載進度追蹤（跨行程共用，見 progress_store.py）
+progress_store = get_progress_store()
 
-def get_download_dir():
-    """取得下載目錄"""
-    download_dir = Path(__file__).parent / "downloads"
-    download_dir.mkdir(exist_ok=True)
-    return download_dir
+# 輸出音訊格式（同時作為快取鍵的一部分）
+AUDIO_CODEC = 'mp3'
+AUDIO_QUALITY = '192'
+
+# 下載排程設定（可用環境變數調整）
+DOWNLOAD_WORKERS = int(os.environ.get('DOWNLOAD_WORKERS', '2'))
+JOB_JOURNAL_PATH = Path(os.environ.get('JOB_JOURNAL_PATH', Path(__file__).parent / "jobs.db"))
+JOB_POLL_INTERVAL = 1.0  # 秒，用於接手其他行程寫入的工作
+JOB_RETRY_MAX_DELAY = 30.0  # 秒，工作執行緒連續發生錯誤時重試間隔的上限
+PLAYLIST_WORKERS = int(os.environ.get('PLAYLIST_WORKERS', '4'))  # 單一播放清單同時下載的項目數
+STREAM_TRANSCODE = os.environ.get('STREAM_TRANSCODE', '1') == '1'  # 單一影片邊下載邊轉檔
+# 輸出檔名含影片 ID，同名的不同影片不會互相覆蓋（快取也以 ID 為鍵）
+OUTPUT_TEMPLATE = '%(title)s [%(id)s].%(ext)s'
+
+# 排程器狀態（每個行程各自一份）
+_scheduler_lock = threading.Lock()
+_scheduler_wakeup = threading.Event()
+_scheduler_pid = None
+_cancelled_tasks = set()
+_cancel_checked = {}
 
 def get_cookies_file():
     """取得 cookies 檔案路徑（如果存在）"""
@@ -34,17 +60,23 @@ def get_youtube_opts():
     return opts
 
 def progress_hook(task_id):
-    """建立進度回調函數"""
+    """建立進度回調函數（僅在狀態轉換或進度變化達 PROGRESS_STEP 時寫入）"""
+    last = {'status': None, 'progress': 0}
+
     def hook(d):
+        if is_cancelled(task_id):
+            raise yt_dlp.utils.DownloadCancelled('下載已取消')
         if d['status'] == 'downloading':
             total = d.get('total_bytes') or d.get('total_bytes_estimate', 0)
             downloaded = d.get('downloaded_bytes', 0)
             if total > 0:
                 percent = (downloaded / total) * 100
-                download_progress[task_id]['progress'] = percent
-                download_progress[task_id]['status'] = 'downloading'
+                if last['status'] != 'downloading' or percent - last['progress'] >= PROGRESS_STEP:
+                    progress_store.update(task_id, progress=percent, status='downloading')
+                    last.update(status='downloading', progress=percent)
         elif d['status'] == 'finished':
-            download_progress[task_id]['status'] = 'converting'
+            progress_store.update(task_id, status='converting')
+            last.update(status='converting', progress=0)
     return hook
 
 def get_video_info(url):
@@ -55,113 +87,676 @@ def get_video_info(url):
         'extract_flat': True,
     }
     
-    with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+    with yt_dlp.YoutubeDL(ydl_opts) as ydl, metrics.stage('ytdlp.extract'):
         info = ydl.extract_info(url, download=False)
         return info
 
-def download_single(url, task_id):
-    """下載單一影片為 MP3"""
-    download_dir = get_download_dir()
-    
+def _entry_cache_key(info):
+    """由 yt-dlp 資訊取得快取鍵"""
+    extractor = info.get('extractor_key') or info.get('ie_key')
+    if not extractor or not info.get('id'):
+        return None
+    return download_cache.make_cache_key(extractor, info['id'], AUDIO_CODEC, AUDIO_QUALITY)
+
+def _url_cache_key(url):
+    """不連網，從網址推算快取鍵（無法判斷時回傳 None）"""
+    resolved = download_cache.resolve_video_id(url)
+    if resolved is None:
+        return None
+    return download_cache.make_cache_key(*resolved, AUDIO_CODEC, AUDIO_QUALITY)
+
+def _downloaded_path(info, download_dir):
+    """取得轉檔後的實際檔案路徑（相對於下載目錄）"""
+    for requested in info.get('requested_downloads') or []:
+        filepath = requested.get('filepath')
+        if filepath:
+            return Path(filepath).relative_to(download_dir).as_posix()
+    return None
+
+def _cached_progress(relative_path, title):
+    """快取命中時的完成狀態"""
+    return {
+        'status': 'completed',
+        'progress': 100,
+        'files': [relative_path],
+        'title': title or Path(relative_path).stem,
+        'error': None,
+        'cached': True
+    }
+
+def _complete_from_cache(task_id, cache_key):
+    """快取命中時直接完成任務"""
+    hit = download_cache.lookup(cache_key, get_download_dir())
+    if hit is None:
+        return None
+    progress_store.update(task_id, **_cached_progress(*hit))
+    return hit[0]
+
+def _audio_opts(outtmpl, progress_hooks):
+    """建立下載最佳音訊並轉為 MP3 的 yt-dlp 選項"""
     # 取得 YouTube 認證選項
     youtube_opts = get_youtube_opts()
     
-    ydl_opts = {
+    return {
         'format': 'bestaudio/best',
         'postprocessors': [{
             'key': 'FFmpegExtractAudio',
-            'preferredcodec': 'mp3',
-            'preferredquality': '192',
+            'preferredcodec': AUDIO_CODEC,
+            'preferredquality': AUDIO_QUALITY,
         }],
-        'outtmpl': str(download_dir / '%(title)s.%(ext)s'),
-        'progress_hooks': [progress_hook(task_id)],
+        'outtmpl': outtmpl,
+        'progress_hooks': progress_hooks,
         'quiet': True,
         'no_warnings': True,
         **youtube_opts,  # 套用認證選項
     }
-    
-    try:
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+
+def _fetch_audio(url, outtmpl, hook):
+    """下載並轉檔單一影片、登錄快取，回傳 (相對路徑, 標題)"""
+    download_dir = get_download_dir()
+    with yt_dlp.YoutubeDL(_audio_opts(outtmpl, [hook])) as ydl:
+        with metrics.stage('ytdlp.download'):
             info = ydl.extract_info(url, download=True)
+        mp3_filename = _downloaded_path(info, download_dir)
+        if mp3_filename is None:
             filename = ydl.prepare_filename(info)
             # 變更副檔名為 mp3
-            mp3_filename = Path(filename).stem + '.mp3'
-            download_progress[task_id]['status'] = 'completed'
-            download_progress[task_id]['progress'] = 100
-            download_progress[task_id]['files'] = [mp3_filename]
-            download_progress[task_id]['title'] = info.get('title', 'Unknown')
-            return mp3_filename
-    except Exception as e:
-        download_progress[task_id]['status'] = 'error'
-        download_progress[task_id]['error'] = str(e)
-        return None
+            mp3_filename = Path(filename).relative_to(download_dir).with_suffix('.mp3').as_posix()
+    cache_key = _entry_cache_key(info)
+    if cache_key:
+        download_cache.store(cache_key, mp3_filename, info.get('title'), download_dir)
+    return mp3_filename, info.get('title', 'Unknown')
 
-def download_playlist(url, task_id):
-    """下載整個播放清單為 MP3"""
+def _stream_audio(url, task_id):
+    """邊下載邊轉檔：FFmpeg 直接讀取最佳音訊串流並寫出 MP3
+
+    來源已是 MP3 時只重新封裝不重新編碼。來源不是單一 HTTP 串流
+    （例如 HLS/DASH 分段）時回傳 None，由呼叫端改用一般下載流程。
+    """
     download_dir = get_download_dir()
-    downloaded_files = []
+    ydl_opts = {
+        'format': 'bestaudio/best',
+        'outtmpl': str(download_dir / OUTPUT_TEMPLATE),
+        'quiet': True,
+        'no_warnings': True,
+        **get_youtube_opts(),
+    }
     
-    # 取得 YouTube 認證選項
-    youtube_opts = get_youtube_opts()
+    with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+        with metrics.stage('ytdlp.extract'):
+            info = ydl.extract_info(url, download=False)
+        fmt = (info.get('requested_formats') or [info])[0]
+        if fmt.get('protocol') not in ('http', 'https') or not fmt.get('url'):
+            return None
+        output_path = Path(ydl.prepare_filename(info)).with_suffix('.mp3')
+    
+    part_path = output_path.with_name(output_path.name + '.part')
+    headers = ''.join(f'{k}: {v}\r\n' for k, v in (fmt.get('http_headers') or {}).items())
+    if fmt.get('acodec') == AUDIO_CODEC:
+        codec_args = ['-c:a', 'copy']
+    else:
+        codec_args = ['-c:a', 'libmp3lame', '-b:a', f'{AUDIO_QUALITY}k']
+    
+    cmd = [
+        'ffmpeg', '-y', '-nostdin', '-loglevel', 'error',
+        '-reconnect', '1', '-reconnect_streamed', '1',
+        '-headers', headers,
+        '-i', fmt['url'],
+        '-vn',
+        *codec_args,
+        '-f', 'mp3',
+        '-progress', 'pipe:1', '-nostats',
+        str(part_path)
+    ]
     
+    duration = info.get('duration') or 0
+    last_percent = 0
+    progress_store.update(task_id, status='downloading', title=info.get('title', ''))
+    
+    started = time.perf_counter()
+    proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+    try:
+        for line in proc.stdout:
+            if is_cancelled(task_id):
+                proc.kill()
+                raise yt_dlp.utils.DownloadCancelled('下載已取消')
+            key, _, value = line.strip().partition('=')
+            if key == 'out_time_us' and duration and value.isdigit():
+                percent = min(int(value) / 1_000_000 / duration * 100, 99)
+                if percent - last_percent >= PROGRESS_STEP:
+                    progress_store.update(task_id, progress=percent)
+                    last_percent = percent
+        stderr = proc.stderr.read()
+        proc.wait()
+        metrics.record_stage('ytdlp.stream', time.perf_counter() - started, proc.returncode != 0)
+        if proc.returncode != 0:
+            raise RuntimeError(f'FFmpeg 錯誤: {stderr}')
+        part_path.replace(output_path)
+    finally:
+        if proc.poll() is None:
+            proc.kill()
+            proc.wait()
+        if part_path.exists():
+            part_path.unlink()
+    
+    mp3_filename = output_path.relative_to(download_dir).as_posix()
+    cache_key = _entry_cache_key(info)
+    if cache_key:
+        download_cache.store(cache_key, mp3_filename, info.get('title'), download_dir)
+    return mp3_filename, info.get('title', 'Unknown')
+
+def download_single(url, task_id):
+    """下載單一影片為 MP3（已下載過的影片直接使用快取）"""
+    download_dir = get_download_dir()
+    
+    # 先以網址或輕量的 flat 擷取確認影片 ID，命中快取就不必下載
+    try:
+        cache_key = _url_cache_key(url)
+        if cache_key is None:
+            cache_key = _entry_cache_key(get_video_info(url))
+        if cache_key:
+            cached = _complete_from_cache(task_id, cache_key)
+            if cached:
+                return cached
+    except Exception as e:
+        print(f"[WARN] 無法解析影片 ID，略過快取: {e}")
+    
+    try:
+        result = None
+        if STREAM_TRANSCODE:
+            try:
+                result = _stream_audio(url, task_id)
+            except yt_dlp.utils.DownloadCancelled:
+                raise
+            except Exception as e:
+                print(f"[WARN] 串流轉檔失敗，改用一般下載: {e}")
+                progress_store.update(task_id, status='starting', progress=0)
+        if result is None:
+            result = _fetch_audio(
+                url,
+                str(download_dir / OUTPUT_TEMPLATE),
+                progress_hook(task_id)
+            )
+        mp3_filename, title = result
+        progress_store.update(
+            task_id,
+            status='completed',
+            progress=100,
+            files=[mp3_filename],
+            title=title
+        )
+        return mp3_filename
+    except Exception as e:
+        progress_store.update(task_id, status='error', error=str(e))
+        return None
+
+class _PlaylistProgress:
+    """彙整播放清單各項目的進度，並節流寫入進度儲存"""
+
+    # 單一項目進度中，下載佔 90%，轉檔完成補足剩餘部分
+    DOWNLOAD_SHARE = 90
+
+    def __init__(self, task_id, title, entries):
+        self.task_id = task_id
+        self.lock = threading.Lock()
+        self.last_progress = 0
+        self.entries = [
+            {
+                'title': entry.get('title') or entry.get('id') or f'#{i + 1}',
+                'status': 'queued',
+                'progress': 0,
+                'file': None,
+            }
+            for i, entry in enumerate(entries)
+        ]
+        progress_store.update(task_id, status='downloading', title=title, progress=0, files=[], entries=self.entries)
+
+    def files(self):
+        """已完成項目的檔案（依播放清單順序）"""
+        return [entry['file'] for entry in self.entries if entry['file']]
+
+    def errors(self):
+        return [entry['error'] for entry in self.entries if entry.get('error')]
+
+    def set(self, index, **fields):
+        """更新單一項目，只在狀態轉換或整體進度變化達 PROGRESS_STEP 時寫入"""
+        with self.lock:
+            entry = self.entries[index]
+            transition = 'status' in fields and fields['status'] != entry['status']
+            entry.update(fields)
+            aggregate = sum(e['progress'] for e in self.entries) / len(self.entries)
+            if not transition and aggregate - self.last_progress < PROGRESS_STEP:
+                return
+            self.last_progress = aggregate
+            progress_store.update(self.task_id, progress=aggregate, files=self.files(), entries=self.entries)
+
+    def hook(self, index):
+        """建立單一項目的 yt-dlp 進度回調"""
+        def hook(d):
+            if is_cancelled(self.task_id):
+                raise yt_dlp.utils.DownloadCancelled('下載已取消')
+            if d['status'] == 'downloading':
+                total = d.get('total_bytes') or d.get('total_bytes_estimate', 0)
+                downloaded = d.get('downloaded_bytes', 0)
+                if total > 0:
+                    percent = downloaded / total * self.DOWNLOAD_SHARE
+                    self.set(index, status='downloading', progress=percent)
+            elif d['status'] == 'finished':
+                self.set(index, status='converting', progress=self.DOWNLOAD_SHARE)
+        return hook
+
+def _flat_playlist(url):
+    """只取得播放清單項目列表，不解析各影片"""
     ydl_opts = {
-        'format': 'bestaudio/best',
-        'postprocessors': [{
-            'key': 'FFmpegExtractAudio',
-            'preferredcodec': 'mp3',
-            'preferredquality': '192',
-        }],
-        'outtmpl': str(download_dir / '%(playlist_title)s/%(title)s.%(ext)s'),
-        'progress_hooks': [progress_hook(task_id)],
         'quiet': True,
         'no_warnings': True,
-        'ignoreerrors': True,
-        **youtube_opts,  # 套用認證選項
+        'extract_flat': 'in_playlist',
+        **get_youtube_opts(),
     }
     
+    with yt_dlp.YoutubeDL(ydl_opts) as ydl, metrics.stage('ytdlp.playlist'):
+        return ydl.extract_info(url, download=False)
+
+def _download_playlist_entry(tracker, index, entry, outtmpl):
+    """下載播放清單中的單一項目（優先使用快取）"""
+    if is_cancelled(tracker.task_id):
+        tracker.set(index, status='cancelled')
+        return
+
+    cache_key = _entry_cache_key(entry)
+    if cache_key:
+        hit = download_cache.lookup(cache_key, get_download_dir())
+        if hit:
+            tracker.set(index, status='completed', progress=100, file=hit[0])
+            return
+
+    entry_url = entry.get('url') or entry.get('webpage_url') or entry.get('id')
     try:
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            info = ydl.extract_info(url, download=True)
-            
-            if 'entries' in info:
-                playlist_title = info.get('title', 'playlist')
-                for entry in info['entries']:
-                    if entry:
-                        mp3_filename = f"{playlist_title}/{entry.get('title', 'Unknown')}.mp3"
-                        downloaded_files.append(mp3_filename)
-            
-            download_progress[task_id]['status'] = 'completed'
-            download_progress[task_id]['progress'] = 100
-            download_progress[task_id]['files'] = downloaded_files
-            download_progress[task_id]['title'] = info.get('title', 'Unknown Playlist')
-            return downloaded_files
+        mp3_filename, title = _fetch_audio(entry_url, outtmpl, tracker.hook(index))
+        tracker.set(index, status='completed', progress=100, file=mp3_filename, title=title)
     except Exception as e:
-        download_progress[task_id]['status'] = 'error'
-        download_progress[task_id]['error'] = str(e)
+        if is_cancelled(tracker.task_id):
+            tracker.set(index, status='cancelled')
+        else:
+            tracker.set(index, status='error', progress=100, error=str(e))
+
+def download_playlist(url, task_id):
+    """平行下載整個播放清單為 MP3，每完成一首就更新結果"""
+    download_dir = get_download_dir()
+    
+    try:
+        playlist = _flat_playlist(url)
+    except Exception as e:
+        progress_store.update(task_id, status='error', error=str(e))
         return None
+    
+    if 'entries' not in playlist:
+        # 不是播放清單網址，視為單一影片
+        return download_single(url, task_id)
+    
+    entries = [entry for entry in playlist['entries'] if entry]
+    title = playlist.get('title') or 'Unknown Playlist'
+    outtmpl = str(download_dir / sanitize_filename(title) / OUTPUT_TEMPLATE)
+    tracker = _PlaylistProgress(task_id, title, entries)
+    
+    with ThreadPoolExecutor(max_workers=max(1, PLAYLIST_WORKERS)) as pool:
+        for i, entry in enumerate(entries):
+            pool.submit(_download_playlist_entry, tracker, i, entry, outtmpl)
+    
+    downloaded_files = tracker.files()
+    errors = tracker.errors()
+    if entries and not downloaded_files and errors:
+        progress_store.update(task_id, status='error', error=errors[0], entries=tracker.entries)
+        return None
+    
+    progress_store.update(
+        task_id,
+        status='completed',
+        progress=100,
+        files=downloaded_files,
+        entries=tracker.entries,
+        title=title
+    )
+    return downloaded_files
 
-def start_download(url, is_playlist=False):
-    """啟動背景下載任務"""
-    task_id = str(uuid.uuid4())
-    download_progress[task_id] = {
-        'status': 'starting',
+# ============ 下載排程器 ============
+
+def _journal():
+    """開啟工作日誌資料庫連線"""
+    conn = sqlite3.connect(str(JOB_JOURNAL_PATH), timeout=30, isolation_level=None)
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS jobs (
+            task_id TEXT PRIMARY KEY,
+            url TEXT NOT NULL,
+            is_playlist INTEGER NOT NULL,
+            priority INTEGER NOT NULL DEFAULT 0,
+            status TEXT NOT NULL,
+            owner_pid INTEGER,
+            cache_key TEXT,
+            created_at REAL NOT NULL
+        )
+    ''')
+    if 'owner_host' not in {row[1] for row in conn.execute('PRAGMA table_info(jobs)')}:
+        # 舊版日誌只記錄 owner_pid
+        conn.execute('ALTER TABLE jobs ADD COLUMN owner_host TEXT')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_jobs_cache_key ON jobs (cache_key, status)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_jobs_queue ON jobs (status, priority, created_at)')
+    return conn
+
+def _pid_alive(pid):
+    """檢查行程是否仍存在"""
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+def _read_id(path):
+    """讀取系統提供的識別檔（例如開機 ID），不存在時回傳空字串"""
+    try:
+        with open(path) as f:
+            return f.read().strip()
+    except OSError:
+        return ''
+
+def _owner_host(pid):
+    """執行工作的行程識別：主機名稱、開機 ID 與行程啟動時間，行程已結束時回傳 None
+
+    容器重新啟動後 worker 會拿到同樣的低編號 PID，只比對 PID 會把已結束行程的工作當成仍在執行；
+    主機名稱或行程啟動時間不同就表示是另一個行程。沒有 /proc 的系統只比對主機名稱與 PID。
+    """
+    if not _pid_alive(pid):
+        return None
+    stat = _read_id(f'/proc/{pid}/stat')
+    started = stat.rsplit(')', 1)[-1].split()[19] if stat else ''  # 第 22 欄 starttime
+    return f"{socket.gethostname()}/{_read_id('/proc/sys/kernel/random/boot_id')}/{started}"
+
+def _recover_jobs(conn):
+    """將已中斷行程遺留的執行中工作放回佇列"""
+    rows = conn.execute("SELECT task_id, owner_pid, owner_host FROM jobs WHERE status = 'running'").fetchall()
+    for task_id, owner_pid, owner_host in rows:
+        if owner_pid is None or owner_host is None or _owner_host(owner_pid) != owner_host:
+            conn.execute(
+                "UPDATE jobs SET status = 'queued', owner_pid = NULL, owner_host = NULL WHERE task_id = ? AND status = 'running'",
+                (task_id,)
+            )
+            progress_store.update(task_id, status='queued', progress=0)
+            print(f"[INFO] 恢復中斷的下載工作: {task_id}")
+
+def _claim_next_job(conn):
+    """從佇列取出下一個工作（依優先順序，其次先進先出）"""
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        row = conn.execute('''
+            SELECT task_id, url, is_playlist, created_at FROM jobs
+            WHERE status = 'queued'
+            ORDER BY priority, created_at
+            LIMIT 1
+        ''').fetchone()
+        if row:
+            conn.execute(
+                "UPDATE jobs SET status = 'running', owner_pid = ?, owner_host = ? WHERE task_id = ?",
+                (os.getpid(), _owner_host(os.getpid()), row[0])
+            )
+        conn.execute('COMMIT')
+        return row
+    except Exception:
+        conn.execute('ROLLBACK')
+        raise
+
+def _finish_job(conn, task_id, status):
+    """記錄工作結束狀態，並清除過期的已結束工作"""
+    conn.execute("UPDATE jobs SET status = ?, owner_pid = NULL, owner_host = NULL WHERE task_id = ?", (status, task_id))
+    conn.execute(
+        f"DELETE FROM jobs WHERE status IN ({', '.join('?' * len(FINISHED_STATUSES))}) AND created_at < ?",
+        (*FINISHED_STATUSES, time.time() - PROGRESS_TTL)
+    )
+
+def _run_job(task_id, url, is_playlist, created_at):
+    """執行已取出的工作，回傳結束狀態"""
+    metrics.record_stage('download.queue_wait', max(0.0, time.time() - created_at))
+    started = time.perf_counter()
+    if progress_store.get(task_id) is None:
+        progress_store.create(task_id, _new_progress())
+    progress_store.update(task_id, status='starting')
+
+    if is_playlist:
+        download_playlist(url, task_id)
+    else:
+        download_single(url, task_id)
+
+    if is_cancelled(task_id):
+        progress_store.update(task_id, status='cancelled', error=None)
+    entry = progress_store.get(task_id) or {}
+    status = entry.get('status', 'error')
+    metrics.record_stage('download.task', time.perf_counter() - started, status == 'error')
+    metrics.inc('anymusic_downloads_total', status=status, cached=str(bool(entry.get('cached'))).lower())
+    _cancelled_tasks.discard(task_id)
+    _cancel_checked.pop(task_id, None)
+    return status
+
+def _fail_task(task_id):
+    """工作執行到一半發生錯誤時標記為失敗（進度儲存本身也可能無法使用）"""
+    _cancelled_tasks.discard(task_id)
+    _cancel_checked.pop(task_id, None)
+    try:
+        progress_store.update(task_id, status='error', error='下載失敗，請稍後再試')
+    except Exception as e:
+        print(f"[WARN] 無法更新下載工作 {task_id} 的狀態: {e}")
+
+def _worker_loop():
+    """下載工作執行緒：持續從佇列取工作並執行
+
+    取工作或執行時發生錯誤（例如資料庫暫時鎖定）只記錄並延遲重試，不讓執行緒結束；
+    執行到一半失敗的工作標記為錯誤，結束狀態寫入失敗時會在下一輪重試。
+    """
+    conn = None
+    failures = 0
+    unfinished = None  # (task_id, 結束狀態)：已取出但尚未寫入日誌的工作
+    while True:
+        try:
+            if conn is None:
+                conn = _journal()
+            if unfinished is not None:
+                _finish_job(conn, *unfinished)
+                unfinished = None
+            job = _claim_next_job(conn)
+            if job is None:
+                failures = 0
+                _scheduler_wakeup.wait(JOB_POLL_INTERVAL)
+                _scheduler_wakeup.clear()
+                continue
+            unfinished = (job[0], 'error')
+            unfinished = (job[0], _run_job(*job))
+            _finish_job(conn, *unfinished)
+            unfinished = None
+            failures = 0
+        except Exception as e:
+            failures += 1
+            delay = min(JOB_RETRY_MAX_DELAY, JOB_POLL_INTERVAL * 2 ** failures)
+            print(f"[WARN] 下載工作執行緒發生錯誤，{delay:.1f} 秒後重試: {e}")
+            if unfinished is not None and unfinished[1] == 'error':
+                _fail_task(unfinished[0])
+            if conn is not None:
+                # 交易可能停在未完成的狀態，重新連線
+                conn.close()
+                conn = None
+            time.sleep(delay)
+
+def init_download_workers():
+    """啟動下載工作執行緒（每個行程僅啟動一次，fork 後會重新啟動）"""
+    global _scheduler_pid
+    with _scheduler_lock:
+        if _scheduler_pid == os.getpid():
+            return
+        _scheduler_pid = os.getpid()
+
+        conn = _journal()
+        _recover_jobs(conn)
+        conn.close()
+
+        for i in range(max(1, DOWNLOAD_WORKERS)):
+            thread = threading.Thread(target=_worker_loop, name=f"download-worker-{i}", daemon=True)
+            thread.start()
+
+def _new_progress():
+    """建立新的進度紀錄"""
+    return {
+        'status': 'queued',
         'progress': 0,
         'files': [],
         'title': '',
         'error': None
     }
-    
-    def run_download():
-        if is_playlist:
-            download_playlist(url, task_id)
-        else:
-            download_single(url, task_id)
-    
-    thread = threading.Thread(target=run_download)
-    thread.start()
-    
+
+def start_download(url, is_playlist=False, priority=0):
+    """將下載任務加入佇列（priority 數字越小越優先）
+
+    同一影片已在佇列或下載中時回傳既有的 task_id，已快取時直接完成。
+    """
+    init_download_workers()
+
+    task_id = str(uuid.uuid4())
+    cache_key = None if is_playlist else _url_cache_key(url)
+
+    if cache_key:
+        hit = download_cache.lookup(cache_key, get_download_dir())
+        if hit:
+            progress_store.create(task_id, _cached_progress(*hit))
+            return task_id
+
+    conn = _journal()
+    try:
+        conn.execute('BEGIN IMMEDIATE')
+        if cache_key:
+            row = conn.execute(
+                "SELECT task_id FROM jobs WHERE cache_key = ? AND status IN ('queued', 'running')",
+                (cache_key,)
+            ).fetchone()
+            if row:
+                conn.execute('COMMIT')
+                return row[0]
+        conn.execute(
+            "INSERT INTO jobs (task_id, url, is_playlist, priority, status, cache_key, created_at) VALUES (?, ?, ?, ?, 'queued', ?, ?)",
+            (task_id, url, int(bool(is_playlist)), int(priority), cache_key, time.time())
+        )
+        progress_store.create(task_id, _new_progress())
+        conn.execute('COMMIT')
+    except Exception:
+        conn.execute('ROLLBACK')
+        raise
+    finally:
+        conn.close()
+    _scheduler_wakeup.set()
+
     return task_id
 
+def cancel_download(task_id):
+    """取消下載任務，回傳是否成功"""
+    conn = _journal()
+    try:
+        row = conn.execute("SELECT status FROM jobs WHERE task_id = ?", (task_id,)).fetchone()
+        if row is None or row[0] not in ('queued', 'running'):
+            return False
+        conn.execute(
+            "UPDATE jobs SET status = 'cancelled' WHERE task_id = ? AND status IN ('queued', 'running')",
+            (task_id,)
+        )
+    finally:
+        conn.close()
+
+    _cancelled_tasks.add(task_id)
+    if row[0] == 'queued':
+        progress_store.update(task_id, status='cancelled')
+    return True
+
+def is_cancelled(task_id):
+    """檢查任務是否已被取消（包含其他行程送出的取消）"""
+    if task_id in _cancelled_tasks:
+        return True
+    now = time.time()
+    if now - _cancel_checked.get(task_id, 0) < JOB_POLL_INTERVAL:
+        return False
+    _cancel_checked[task_id] = now
+    conn = _journal()
+    try:
+        row = conn.execute("SELECT status FROM jobs WHERE task_id = ?", (task_id,)).fetchone()
+    finally:
+        conn.close()
+    if row and row[0] == 'cancelled':
+        _cancelled_tasks.add(task_id)
+        return True
+    return False
+
+def _queue_position(conn, task_id):
+    """計算任務在佇列中的位置（1 表示下一個）"""
+    row = conn.execute(
+        "SELECT priority, created_at FROM jobs WHERE task_id = ? AND status = 'queued'",
+        (task_id,)
+    ).fetchone()
+    if row is None:
+        return None
+    ahead = conn.execute('''
+        SELECT COUNT(*) FROM jobs
+        WHERE status = 'queued' AND (priority < ? OR (priority = ? AND created_at < ?))
+    ''', (row[0], row[0], row[1])).fetchone()[0]
+    return ahead + 1
+
 def get_progress(task_id):
     """取得下載進度"""
-    return download_progress.get(task_id, {'status': 'not_found'})
+    status = progress_store.get(task_id)
+    if status is None:
+        return {'status': 'not_found'}
+    # FFmpeg 工作也寫入同一個進度儲存，不能回傳其伺服器路徑
+    status = public_view(status)
+
+    if status['status'] == 'queued':
+        conn = _journal()
+        try:
+            position = _queue_position(conn, task_id)
+            if position is not None:
+                status['queue_position'] = position
+        finally:
+            conn.close()
+    return status
+
+def stream_progress(task_id):
+    """產生下載進度的 Server-Sent Events 串流"""
+    return stream_status(lambda: get_progress(task_id))
+
+def _job_counts():
+    """佇列中各狀態的工作數（queued 即為佇列長度）"""
+    conn = _journal()
+    try:
+        rows = conn.execute("SELECT status, COUNT(*) FROM jobs WHERE status IN ('queued', 'running') GROUP BY status").fetchall()
+    finally:
+        conn.close()
+    counts = {'queued': 0, 'running': 0}
+    counts.update(rows)
+    return {(('status', status),): count for status, count in counts.items()}
+
+def _alive_workers():
+    return sum(1 for thread in threading.enumerate() if thread.name.startswith('download-worker-'))
+
+metrics.register_collector('anymusic_download_jobs', '下載佇列中排隊與執行中的工作數', _job_counts)
+metrics.register_collector('anymusic_download_workers_alive', '存活的下載工作執行緒數', _alive_workers, scope='process')
+metrics.register_collector('anymusic_progress_entries', '進度儲存中的任務數', lambda: progress_store.count())
+
+def _warm_extractors():
+    """預先編譯所有擷取器的網址規則（第一次比對網址時才編譯，需時約半秒以上）"""
+    from yt_dlp.extractor import gen_extractor_classes
+
+    with yt_dlp.YoutubeDL({'quiet': True, 'no_warnings': True}):
+        pass
+    for ie in gen_extractor_classes():
+        try:
+            ie.suitable('')
+        except Exception:
+            pass
+
+startup.register_warmup('yt_dlp', _warm_extractors)
+# 開機時就恢復中斷的工作並開始處理佇列，不必等到下一個下載請求
+startup.register_warmup('download_workers', init_download_workers, per_process=True)
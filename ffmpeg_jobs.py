@@ -0,0 +1,251 @@
+import os
+import time
+import socket
+import uuid
+import tempfile
+import threading
+import subprocess
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from progress_store import get_progress_store, stream_status, public_view, PROGRESS_STEP
+from storage import track, acquire, release
+import metrics
+import startup
+
+try:
+    import fcntl
+except ImportError:  # Windows 沒有 fcntl，改為僅限制單一行程
+    fcntl = None
+
+# FFmpeg 工作設定（可用環境變數調整）
+FFMPEG_WORKERS = int(os.environ.get('FFMPEG_WORKERS', str(os.cpu_count() or 2)))  # 整台主機同時執行的 FFmpeg 數
+FFMPEG_JOB_TIMEOUT = int(os.environ.get('FFMPEG_JOB_TIMEOUT', '600'))  # 秒
+FFMPEG_RESULT_TTL = int(os.environ.get('FFMPEG_RESULT_TTL', '3600'))  # 秒，完成的結果保留多久
+FFMPEG_LOCK_DIR = Path(os.environ.get('FFMPEG_LOCK_DIR', tempfile.gettempdir()))
+SLOT_POLL_INTERVAL = 0.2  # 秒
+CANCEL_CHECK_INTERVAL = 1.0  # 秒
+
+job_store = get_progress_store()
+
+_executor = None
+_executor_pid = None
+_executor_lock = threading.Lock()
+_local_slots = threading.BoundedSemaphore(max(1, FFMPEG_WORKERS))
+_running = {}  # job_id -> Popen（本行程執行中的 FFmpeg）
+
+def _get_executor():
+    """取得本行程的工作執行緒池（fork 後重新建立）"""
+    global _executor, _executor_pid
+    with _executor_lock:
+        if _executor is None or _executor_pid != os.getpid():
+            _executor = ThreadPoolExecutor(max_workers=max(1, FFMPEG_WORKERS), thread_name_prefix='ffmpeg-job')
+            _executor_pid = os.getpid()
+        return _executor
+
+def _is_cancelled(job_id):
+    job = job_store.get(job_id)
+    return job is None or job['status'] == 'cancelled'
+
+class _Cancelled(Exception):
+    """工作已被取消"""
+
+@contextmanager
+def ffmpeg_slot(job_id=None):
+    """取得 FFmpeg 執行名額；以檔案鎖讓所有 gunicorn worker 共用同一上限
+
+    指定 job_id 時，等待期間工作被取消會拋出 _Cancelled。
+    """
+    waited = time.perf_counter()
+    if fcntl is None:
+        with _local_slots:
+            metrics.record_stage('ffmpeg.slot_wait', time.perf_counter() - waited)
+            yield
+        return
+
+    while True:
+        for i in range(max(1, FFMPEG_WORKERS)):
+            lock_file = open(FFMPEG_LOCK_DIR / f"anymusic-ffmpeg-{i}.lock", 'w')
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                lock_file.close()
+                continue
+            metrics.record_stage('ffmpeg.slot_wait', time.perf_counter() - waited)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+                lock_file.close()
+            return
+        if job_id is not None and _is_cancelled(job_id):
+            raise _Cancelled()
+        time.sleep(SLOT_POLL_INTERVAL)
+
+def probe_duration(path):
+    """以 ffprobe 取得媒體長度（秒），失敗時回傳 None"""
+    result = subprocess.run(
+        ['ffprobe', '-v', 'error', '-show_entries', 'format=duration', '-of', 'csv=p=0', str(path)],
+        capture_output=True, text=True
+    )
+    try:
+        return float(result.stdout.strip())
+    except ValueError:
+        return None
+
+def _run_job(job_id, cmd, input_paths, output_path, duration):
+    """執行 FFmpeg 並解析 -progress 輸出回報進度"""
+    proc = None
+    metrics.add_gauge('anymusic_ffmpeg_jobs_queued', -1)
+    try:
+        with ffmpeg_slot(job_id):
+            if _is_cancelled(job_id):
+                raise _Cancelled()
+            job_store.update(job_id, status='running')
+
+            if duration is None and input_paths:
+                duration = probe_duration(input_paths[0])
+
+            proc = subprocess.Popen(
+                [cmd[0], '-progress', 'pipe:1', '-nostats', *cmd[1:]],
+                stdin=subprocess.DEVNULL,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE,
+                text=True
+            )
+            _running[job_id] = proc
+            stderr_lines = []
+            stderr_thread = threading.Thread(target=lambda: stderr_lines.extend(proc.stderr), daemon=True)
+            stderr_thread.start()
+            # 逾時由計時器強制結束 FFmpeg，避免卡住的工作永遠佔用名額
+            timer = threading.Timer(FFMPEG_JOB_TIMEOUT, proc.kill)
+            timer.start()
+
+            started = time.time()
+            last_percent = 0
+            last_cancel_check = 0
+            try:
+                for line in proc.stdout:
+                    now = time.time()
+                    if now - last_cancel_check >= CANCEL_CHECK_INTERVAL:
+                        last_cancel_check = now
+                        if _is_cancelled(job_id):
+                            proc.kill()
+                            raise _Cancelled()
+                    key, _, value = line.strip().partition('=')
+                    if key == 'out_time_us' and duration and value.isdigit():
+                        percent = min(int(value) / 1_000_000 / duration * 100, 99)
+                        if percent - last_percent >= PROGRESS_STEP:
+                            job_store.update(job_id, progress=percent)
+                            last_percent = percent
+                proc.wait()
+            finally:
+                timer.cancel()
+            stderr_thread.join(timeout=5)
+            metrics.record_stage('ffmpeg.job', time.time() - started, proc.returncode != 0)
+
+            if _is_cancelled(job_id):
+                raise _Cancelled()
+            if time.time() - started >= FFMPEG_JOB_TIMEOUT:
+                raise RuntimeError(f'處理逾時（超過 {FFMPEG_JOB_TIMEOUT} 秒）')
+            if proc.returncode != 0:
+                raise RuntimeError(f'FFmpeg 錯誤: {"".join(stderr_lines)}')
+            if not Path(output_path).exists():
+                raise RuntimeError('輸出檔案不存在')
+
+        track(output_path, FFMPEG_RESULT_TTL)
+        job_store.update(job_id, status='completed', progress=100)
+    except _Cancelled:
+        job_store.update(job_id, status='cancelled')
+        _remove(output_path)
+    except Exception as e:
+        job_store.update(job_id, status='error', error=str(e))
+        _remove(output_path)
+    finally:
+        _running.pop(job_id, None)
+        if proc is not None and proc.poll() is None:
+            proc.kill()
+            proc.wait()
+        for path in input_paths:
+            _remove(path)
+        release(*input_paths, output_path)
+
+def _remove(path):
+    try:
+        Path(path).unlink()
+    except FileNotFoundError:
+        pass
+
+def submit_job(kind, cmd, input_paths, output_path, download_name, mimetype, duration=None):
+    """送出 FFmpeg 工作並立即回傳 job_id
+
+    cmd 為完整的 FFmpeg 參數（第一個元素為 'ffmpeg'），
+    input_paths 中的暫存檔會在工作結束後刪除。
+    """
+    job_id = str(uuid.uuid4())
+    job_store.create(job_id, {
+        'kind': kind,
+        'status': 'queued',
+        'progress': 0,
+        'error': None,
+        'output': str(output_path),
+        'download_name': download_name,
+        'mimetype': mimetype,
+        'owner': [socket.gethostname(), os.getpid()],  # 工作只存在此行程的記憶體中
+    })
+    metrics.add_gauge('anymusic_ffmpeg_jobs_queued', 1)
+    # 排隊中的輸入與寫到一半的輸出不可被清理（完成後輸出改由 track 的期限管理）
+    acquire(*input_paths, output_path)
+    _get_executor().submit(_run_job, job_id, cmd, list(input_paths), str(output_path), duration)
+    return job_id
+
+def get_job(job_id, public=True):
+    """取得工作狀態"""
+    job = job_store.get(job_id)
+    if job is None or 'kind' not in job:
+        return {'status': 'not_found'}
+    if public:
+        return public_view(job)
+    return job
+
+def cancel_job(job_id):
+    """取消工作並結束對應的 FFmpeg 子行程，回傳是否成功"""
+    job = job_store.get(job_id)
+    if job is None or 'kind' not in job or job['status'] not in ('queued', 'running'):
+        return False
+    job_store.update(job_id, status='cancelled')
+    proc = _running.get(job_id)
+    if proc is not None and proc.poll() is None:
+        proc.kill()
+    # 其他行程執行中的工作會在下一次檢查時自行結束
+    return True
+
+def _pid_alive(pid):
+    """檢查行程是否仍存在"""
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+def fail_orphaned_jobs():
+    """把執行行程已結束（重新啟動或部署）而永遠不會完成的工作標記為失敗，回傳筆數"""
+    host = socket.gethostname()
+    failed = 0
+    for job_id, job in job_store.unfinished():
+        owner = job.get('owner')
+        if 'kind' not in job or not owner or owner[0] != host or _pid_alive(owner[1]):
+            continue
+        job_store.update(job_id, status='error', error='伺服器已重新啟動，工作已中斷，請重新送出')
+        failed += 1
+    return failed
+
+def stream_job(job_id):
+    """產生工作進度的 Server-Sent Events 串流"""
+    return stream_status(lambda: get_job(job_id))
+
+metrics.register_collector('anymusic_ffmpeg_jobs_running', '本機執行中的非同步 FFmpeg 工作數', lambda: len(_running), scope='process')
+
+startup.register_warmup('ffmpeg_orphans', fail_orphaned_jobs, per_process=True)
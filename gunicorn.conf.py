@@ -0,0 +1,16 @@
+import os
+import startup
+
+# gunicorn 會自動載入目前目錄的 gunicorn.conf.py；命令列參數優先於此處的設定
+preload_app = os.environ.get('PRELOAD_APP', '0') == '1'  # master 載入並預熱後再 fork，worker 共用已載入的模組
+
+startup.use_gunicorn_hooks()
+
+def pre_fork(server, worker):
+    startup.before_fork()
+
+def post_fork(server, worker):
+    startup.after_fork()
+
+def post_worker_init(worker):
+    startup.start_worker()
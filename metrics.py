@@ -0,0 +1,409 @@
+import os
+import json
+import time
+import atexit
+import threading
+from pathlib import Path
+
+try:
+    import fcntl
+except ImportError:  # Windows 沒有 fcntl，彙整時不上鎖
+    fcntl = None
+
+# 監控設定（可用環境變數調整）
+METRICS_ENABLED = os.environ.get('METRICS_ENABLED', '0') == '1'  # 提供 /metrics 並記錄各項指標
+METRICS_DIR = os.environ.get('METRICS_DIR', '')  # 各 worker 的指標快照目錄，空白時使用 TEMP_DIR/metrics
+METRICS_FLUSH_INTERVAL = float(os.environ.get('METRICS_FLUSH_INTERVAL', '5'))  # 秒，快照寫入間隔
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN', '')  # 設定後 /metrics 需要 Authorization: Bearer <token>
+METRICS_SPAN_LOG = os.environ.get('METRICS_SPAN_LOG', '0') == '1'  # 每個請求輸出一行耗時紀錄（含各階段）
+METRICS_SPAN_MIN_MS = float(os.environ.get('METRICS_SPAN_MIN_MS', '0'))  # 只記錄超過此毫秒數的請求
+
+# 耗時分布的區間上限（秒），涵蓋從毫秒級 API 到數分鐘的 FFmpeg／下載
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+# 已知指標的類型與說明
+DESCRIPTIONS = {
+    'anymusic_http_requests_total': ('counter', 'HTTP 請求數'),
+    'anymusic_http_request_duration_seconds': ('histogram', 'HTTP 請求耗時（串流回應計算到送完為止）'),
+    'anymusic_http_requests_in_flight': ('gauge', '處理中的 HTTP 請求數'),
+    'anymusic_http_request_bytes_total': ('counter', '請求內容位元組數'),
+    'anymusic_http_response_bytes_total': ('counter', '回應內容位元組數'),
+    'anymusic_stage_duration_seconds': ('histogram', '各處理階段（FFmpeg、yt-dlp、PDF、去背）耗時'),
+    'anymusic_stage_errors_total': ('counter', '各處理階段失敗次數'),
+    'anymusic_downloads_total': ('counter', '已結束的下載任務數'),
+    'anymusic_ffmpeg_jobs_queued': ('gauge', '等待執行的非同步 FFmpeg 工作數'),
+}
+
+_active = METRICS_ENABLED or METRICS_SPAN_LOG  # 兩者皆關閉時所有記錄函式直接返回
+_lock = threading.Lock()
+_counters = {}  # (名稱, 標籤) -> 值
+_histograms = {}  # (名稱, 標籤) -> [各區間次數..., 超出最大區間的次數, 總和]
+_gauges = {}  # (名稱, 標籤) -> 值（本行程，例如處理中的請求）
+_collectors = []  # (名稱, 說明, 函式, scope)；scope 為 process 時各 worker 分別計算後加總
+_pid = None
+_local = threading.local()
+
+class _Stage:
+    """計時區塊：結束時記錄耗時，發生例外或設定 failed 時計為失敗"""
+
+    __slots__ = ('name', 'started', 'failed')
+
+    def __init__(self, name):
+        self.name = name
+        self.failed = False
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        record_stage(self.name, time.perf_counter() - self.started, self.failed or exc_type is not None)
+        return False
+
+class _NullStage:
+    """停用時的計時區塊（不做任何事）"""
+
+    failed = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+_NULL_STAGE = _NullStage()
+
+def _labels(labels):
+    return tuple(sorted(labels.items())) if labels else ()
+
+def _check_pid():
+    """fork 後的子行程不沿用父行程的數值，並啟動自己的快照執行緒"""
+    global _pid
+    if _pid == os.getpid():
+        return
+    with _lock:
+        if _pid == os.getpid():
+            return
+        _counters.clear()
+        _histograms.clear()
+        _gauges.clear()
+        _pid = os.getpid()
+    threading.Thread(target=_flush_loop, daemon=True, name='metrics-flush').start()
+
+def inc(name, value=1, **labels):
+    """累加計數器"""
+    if not METRICS_ENABLED:
+        return
+    _check_pid()
+    key = (name, _labels(labels))
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + value
+
+def observe(name, value, **labels):
+    """記錄一次耗時（秒）到分布中"""
+    if not METRICS_ENABLED:
+        return
+    _check_pid()
+    key = (name, _labels(labels))
+    with _lock:
+        histogram = _histograms.get(key)
+        if histogram is None:
+            histogram = _histograms[key] = [0] * (len(DURATION_BUCKETS) + 2)
+        for index, bound in enumerate(DURATION_BUCKETS):
+            if value <= bound:
+                break
+        else:
+            index = len(DURATION_BUCKETS)
+        histogram[index] += 1
+        histogram[-1] += value
+
+def add_gauge(name, value, **labels):
+    """調整本行程的量測值（例如處理中的請求數 +1／-1）"""
+    if not METRICS_ENABLED:
+        return
+    _check_pid()
+    key = (name, _labels(labels))
+    with _lock:
+        _gauges[key] = _gauges.get(key, 0) + value
+
+def record_stage(name, seconds, failed=False):
+    """記錄處理階段的耗時；在請求中執行時也加入該請求的耗時紀錄"""
+    if not _active:
+        return
+    observe('anymusic_stage_duration_seconds', seconds, stage=name)
+    if failed:
+        inc('anymusic_stage_errors_total', stage=name)
+    span = getattr(_local, 'span', None)
+    if span is not None:
+        span.stages.append((name, seconds))
+
+def stage(name):
+    """計時區塊：with metrics.stage('ffmpeg.convert'): ...；停用時幾乎沒有額外成本"""
+    if not _active:
+        return _NULL_STAGE
+    return _Stage(name)
+
+def register_collector(name, help_text, collect, scope='host'):
+    """登記在抓取時計算的量測值
+
+    collect 回傳數值，或 {標籤字典的 tuple: 數值}；scope 為 host 時只由回應 /metrics
+    的行程計算一次（例如目錄大小、佇列長度），為 process 時由各 worker 計算後加總。
+    """
+    _collectors.append((name, help_text, collect, scope))
+
+def _collect(scope):
+    samples = {}
+    for name, _, collect, collector_scope in _collectors:
+        if collector_scope != scope:
+            continue
+        try:
+            value = collect()
+        except Exception as e:
+            print(f"[WARN] 無法取得指標 {name}: {e}")
+            continue
+        if isinstance(value, dict):
+            for labels, item in value.items():
+                samples[(name, tuple(sorted(labels)))] = item
+        elif value is not None:
+            samples[(name, ())] = value
+    return samples
+
+# ============ 跨 worker 彙整 ============
+# 每個 worker 定期把自己的數值寫成 <pid>.json，/metrics 讀取所有快照後加總。
+# 已結束的 worker 的計數併入 _archive.json，計數器才不會因 worker 重啟而變小。
+
+def _metrics_dir():
+    if METRICS_DIR:
+        path = Path(METRICS_DIR)
+    else:
+        from storage import get_temp_dir
+        path = get_temp_dir() / 'metrics'
+    path.mkdir(parents=True, exist_ok=True)
+    return path
+
+def _snapshot():
+    with _lock:
+        snapshot = {
+            'counters': [[name, labels, value] for (name, labels), value in _counters.items()],
+            'histograms': [[name, labels, values] for (name, labels), values in _histograms.items()],
+            'gauges': [[name, labels, value] for (name, labels), value in _gauges.items()],
+        }
+    snapshot['gauges'] += [[name, labels, value] for (name, labels), value in _collect('process').items()]
+    return snapshot
+
+def flush():
+    """寫入本行程的快照"""
+    if not METRICS_ENABLED or _pid != os.getpid():
+        return
+    directory = _metrics_dir()
+    path = directory / f'{os.getpid()}.json'
+    temp_path = directory / f'.{os.getpid()}.tmp'
+    temp_path.write_text(json.dumps(_snapshot()), encoding='utf-8')
+    os.replace(str(temp_path), str(path))
+
+def _flush_loop():
+    pid = os.getpid()
+    while _pid == pid:
+        time.sleep(METRICS_FLUSH_INTERVAL)
+        try:
+            flush()
+        except Exception as e:
+            print(f"[WARN] 無法寫入指標快照: {e}")
+
+atexit.register(flush)
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+def _merge(target, snapshot, include_gauges):
+    for name, labels, value in snapshot.get('counters', []):
+        key = (name, tuple(map(tuple, labels)))
+        target['counters'][key] = target['counters'].get(key, 0) + value
+    for name, labels, values in snapshot.get('histograms', []):
+        key = (name, tuple(map(tuple, labels)))
+        existing = target['histograms'].get(key)
+        target['histograms'][key] = values if existing is None else [a + b for a, b in zip(existing, values)]
+    if include_gauges:
+        for name, labels, value in snapshot.get('gauges', []):
+            key = (name, tuple(map(tuple, labels)))
+            target['gauges'][key] = target['gauges'].get(key, 0) + value
+
+def _to_snapshot(merged):
+    return {
+        kind: [[name, list(labels), value] for (name, labels), value in merged[kind].items()]
+        for kind in ('counters', 'histograms')
+    }
+
+def aggregate():
+    """彙整所有 worker 的快照"""
+    flush()
+    directory = _metrics_dir()
+    merged = {'counters': {}, 'histograms': {}, 'gauges': {}}
+    with open(str(directory / '.lock'), 'a') as lock_file:
+        if fcntl is not None:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+        archive_path = directory / '_archive.json'
+        archive = {'counters': {}, 'histograms': {}, 'gauges': {}}
+        if archive_path.exists():
+            _merge(archive, json.loads(archive_path.read_text(encoding='utf-8')), False)
+        dead = []
+        for path in directory.glob('*.json'):
+            if not path.stem.isdigit():
+                continue
+            try:
+                snapshot = json.loads(path.read_text(encoding='utf-8'))
+            except (OSError, ValueError):
+                continue
+            if _pid_alive(int(path.stem)):
+                _merge(merged, snapshot, True)
+            else:
+                _merge(archive, snapshot, False)
+                dead.append(path)
+        if dead:
+            temp_path = directory / '._archive.tmp'
+            temp_path.write_text(json.dumps(_to_snapshot(archive)), encoding='utf-8')
+            os.replace(str(temp_path), str(archive_path))
+            for path in dead:
+                path.unlink()
+    _merge(merged, _to_snapshot(archive), False)
+    merged['gauges'].update(_collect('host'))
+    return merged
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _format_labels(labels, extra=()):
+    items = list(labels) + list(extra)
+    if not items:
+        return ''
+    return '{' + ','.join(f'{key}="{_escape(value)}"' for key, value in items) + '}'
+
+def _format_value(value):
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+def render():
+    """以 Prometheus 文字格式輸出所有指標"""
+    merged = aggregate()
+    descriptions = dict(DESCRIPTIONS)
+    for name, help_text, _, _ in _collectors:
+        descriptions.setdefault(name, ('gauge', help_text))
+
+    series = {}
+    for kind in ('counters', 'histograms', 'gauges'):
+        for (name, labels), value in merged[kind].items():
+            series.setdefault(name, []).append((labels, value))
+
+    lines = []
+    for name in sorted(series):
+        kind, help_text = descriptions.get(name, ('untyped', ''))
+        lines.append(f'# HELP {name} {help_text}')
+        lines.append(f'# TYPE {name} {kind}')
+        for labels, value in sorted(series[name]):
+            if kind != 'histogram':
+                lines.append(f'{name}{_format_labels(labels)} {_format_value(value)}')
+                continue
+            cumulative = 0
+            for bound, count in zip(DURATION_BUCKETS, value):
+                cumulative += count
+                lines.append(f'{name}_bucket{_format_labels(labels, [("le", bound)])} {cumulative}')
+            cumulative += value[len(DURATION_BUCKETS)]
+            lines.append(f'{name}_bucket{_format_labels(labels, [("le", "+Inf")])} {cumulative}')
+            lines.append(f'{name}_sum{_format_labels(labels)} {_format_value(value[-1])}')
+            lines.append(f'{name}_count{_format_labels(labels)} {cumulative}')
+    return '\n'.join(lines) + '\n'
+
+# ============ Flask 請求追蹤 ============
+
+class _Span:
+    """單一請求的耗時紀錄"""
+
+    __slots__ = ('route', 'method', 'started', 'stages', 'bytes_in', 'bytes_out', 'status', 'finished')
+
+    def __init__(self, route, method, bytes_in):
+        self.route = route
+        self.method = method
+        self.started = time.perf_counter()
+        self.stages = []
+        self.bytes_in = bytes_in
+        self.bytes_out = 0
+        self.status = 0
+        self.finished = False
+
+    def finish(self):
+        if self.finished:
+            return
+        self.finished = True
+        if getattr(_local, 'span', None) is self:
+            _local.span = None
+        elapsed = time.perf_counter() - self.started
+        labels = {'route': self.route, 'method': self.method}
+        inc('anymusic_http_requests_total', **labels, status=str(self.status))
+        observe('anymusic_http_request_duration_seconds', elapsed, **labels)
+        add_gauge('anymusic_http_requests_in_flight', -1, route=self.route)
+        if self.bytes_in:
+            inc('anymusic_http_request_bytes_total', self.bytes_in, route=self.route)
+        if self.bytes_out:
+            inc('anymusic_http_response_bytes_total', self.bytes_out, route=self.route)
+        if METRICS_SPAN_LOG and elapsed * 1000 >= METRICS_SPAN_MIN_MS:
+            stages = ' '.join(f'{name}={seconds * 1000:.1f}ms' for name, seconds in self.stages)
+            print(f"[SPAN] {self.method} {self.route} {self.status} {elapsed * 1000:.1f}ms "
+                  f"in={self.bytes_in}B out={self.bytes_out}B{' ' + stages if stages else ''}")
+
+def _count_bytes(iterable, span):
+    """串流回應：邊送邊累計位元組數"""
+    try:
+        for chunk in iterable:
+            span.bytes_out += len(chunk)
+            yield chunk
+    finally:
+        if hasattr(iterable, 'close'):
+            iterable.close()
+
+def init_app(app):
+    """為 Flask app 加上請求追蹤與 /metrics（兩者皆停用時不註冊任何掛鉤）"""
+    if not _active:
+        return
+    from flask import Response, abort, g, request
+
+    @app.before_request
+    def _start_span():
+        route = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+        span = _local.span = g._metrics_span = _Span(route, request.method, request.content_length or 0)
+        add_gauge('anymusic_http_requests_in_flight', 1, route=span.route)
+
+    @app.after_request
+    def _attach_span(response):
+        span = g.pop('_metrics_span', None)
+        if span is None:
+            return response
+        span.status = response.status_code
+        if response.is_streamed and not response.direct_passthrough:
+            response.response = _count_bytes(response.response, span)
+        else:
+            span.bytes_out = response.content_length or 0
+        # 串流回應送完（或連線中斷）時才結束計時
+        response.call_on_close(span.finish)
+        return response
+
+    @app.teardown_request
+    def _end_span(exc):
+        span = g.pop('_metrics_span', None)
+        if span is not None:
+            span.status = span.status or 500
+            span.finish()
+
+    if METRICS_ENABLED:
+        @app.route('/metrics')
+        def metrics_endpoint():
+            """Prometheus 指標"""
+            if METRICS_TOKEN and request.headers.get('Authorization') != f'Bearer {METRICS_TOKEN}':
+                abort(401)
+            return Response(render(), mimetype='text/plain; version=0.0.4; charset=utf-8')
@@ -0,0 +1,119 @@
+import json
+
+# 支援的編輯操作；頁碼皆指「套用前面操作後」目前文件中的頁碼（從 1 開始）
+EDIT_OPERATIONS = ('select', 'delete', 'rotate', 'reorder', 'merge')
+MAX_OPERATIONS = 100
+
+def _parse_number(value, label):
+    """轉成整數，格式錯誤時拋出帶有欄位名稱的 ValueError"""
+    try:
+        return int(str(value).strip())
+    except ValueError:
+        raise ValueError(f'{label}格式錯誤: {value}')
+
+def _parse_part(part):
+    """解析單一頁碼或範圍（'5' 或 '7-9'），回傳 (開始, 結束)"""
+    bounds = part.split('-')
+    if len(bounds) > 2:
+        raise ValueError(f'頁碼格式錯誤: {part}')
+    start = _parse_number(bounds[0], '頁碼')
+    return start, _parse_number(bounds[-1], '頁碼')
+
+def parse_page_range(page_string, total_pages):
+    """解析頁碼範圍字串，如 '1-3,5,7-9'"""
+    pages = set()
+    if not page_string:
+        return list(range(1, total_pages + 1))
+    
+    for part in str(page_string).split(','):
+        part = part.strip()
+        if not part:
+            continue
+        start, end = _parse_part(part)
+        # 超出範圍的頁碼直接忽略，先截斷避免 '1-999999999' 展開成巨大集合
+        pages.update(range(max(start, 1), min(end, total_pages) + 1))
+    
+    return sorted(pages)
+
+def parse_page_order(page_string, total_pages):
+    """解析頁面順序字串，保留順序（'3,1-2' → [3, 1, 2]）"""
+    order = []
+    for part in str(page_string).split(','):
+        part = part.strip()
+        if not part:
+            continue
+        start, end = _parse_part(part)
+        for page in (start, end):
+            if not 1 <= page <= total_pages:
+                raise ValueError(f'頁碼超出範圍: {page}')
+        step = 1 if end >= start else -1
+        order.extend(range(start, end + step, step))
+    return order
+
+def parse_operations(raw):
+    """解析 JSON 操作清單"""
+    try:
+        operations = json.loads(raw or '[]')
+    except json.JSONDecodeError as e:
+        raise ValueError(f'操作格式錯誤: {e}')
+    if not isinstance(operations, list) or not operations:
+        raise ValueError('請提供操作清單')
+    if len(operations) > MAX_OPERATIONS:
+        raise ValueError(f'操作數量不可超過 {MAX_OPERATIONS}')
+    for op in operations:
+        if not isinstance(op, dict) or op.get('op') not in EDIT_OPERATIONS:
+            raise ValueError(f'不支援的操作: {op}')
+    return operations
+
+def merge_sources(operations):
+    """操作清單中需要另外上傳的檔案欄位名稱（依出現順序）"""
+    fields = []
+    for op in operations:
+        if op['op'] == 'merge':
+            field = op.get('file')
+            if not field:
+                raise ValueError('merge 操作需指定 file 欄位')
+            if field not in fields:
+                fields.append(field)
+    return fields
+
+def compile_plan(operations, counts):
+    """把操作清單編譯為頁面計畫 [(輸入檔索引, 頁面索引, 旋轉角度)]
+
+    counts[0] 為主檔頁數，其後依 merge_sources 的順序對應合併檔。
+    只計算頁面的排列與旋轉，實際讀寫由 pdf_merge.write_pages 一次完成。
+    """
+    sources = merge_sources(operations)
+    plan = [(0, i, 0) for i in range(counts[0])]
+
+    for op in operations:
+        kind = op['op']
+        total = len(plan)
+        if kind == 'select':
+            plan = [plan[p - 1] for p in parse_page_range(op.get('pages', ''), total)]
+        elif kind == 'delete':
+            removed = set(parse_page_range(op.get('pages', ''), total)) if op.get('pages') else set()
+            plan = [entry for p, entry in enumerate(plan, 1) if p not in removed]
+        elif kind == 'rotate':
+            angle = _parse_number(op.get('angle', 90), '旋轉角度')
+            if angle % 90:
+                raise ValueError(f'旋轉角度必須是 90 的倍數: {angle}')
+            pages = op.get('pages', 'all')
+            targets = set(range(1, total + 1)) if pages in ('', 'all') else set(parse_page_range(pages, total))
+            plan = [
+                (source, index, (rotate + angle) % 360) if p in targets else (source, index, rotate)
+                for p, (source, index, rotate) in enumerate(plan, 1)
+            ]
+        elif kind == 'reorder':
+            plan = [plan[p - 1] for p in parse_page_order(op.get('order', ''), total)]
+        elif kind == 'merge':
+            source = sources.index(op['file']) + 1
+            merged = [(source, p - 1, 0) for p in parse_page_range(op.get('pages', ''), counts[source])]
+            position = _parse_number(op.get('after', total), '插入位置')
+            if not 0 <= position <= total:
+                raise ValueError(f'插入位置超出範圍: {position}')
+            plan = plan[:position] + merged + plan[position:]
+
+    if not plan:
+        raise ValueError('編輯後沒有任何頁面')
+    return plan
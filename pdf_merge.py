@@ -0,0 +1,535 @@
+import hashlib
+import mmap
+import os
+import time
+import uuid
+import zlib
+from array import array
+from contextlib import ExitStack, contextmanager
+from io import BytesIO
+from PyPDF2 import PdfReader
+from PyPDF2.generic import (
+    ArrayObject,
+    BooleanObject,
+    DictionaryObject,
+    IndirectObject,
+    NameObject,
+    NullObject,
+    NumberObject,
+    StreamObject,
+)
+from progress_store import get_progress_store, PROGRESS_STEP
+from pdf_optimize import StreamOptimizer
+import metrics
+
+# 合併記憶體上限說明：
+# 輸入以 mmap 開啟，檔案內容由作業系統依需要分頁載入並可隨時回收，不會整份讀進記憶體。
+# 每處理完一頁就清空讀取器的物件快取並送出已寫好的位元組，因此常駐記憶體約為
+# 「單一頁面（含其字型、圖片等資源）的物件大小」，加上每個開啟中輸入的 xref 表與頁面樹
+# （與該檔的物件數、頁數成正比，輸入最後一次用到後即釋放），以及每個輸出物件約 40 位元組的
+# 索引（xref 位置與去重雜湊）。開啟最佳化時，另外最多有
+# OPTIMIZE_WORKERS × MAX_PENDING_PER_WORKER 個串流與 OBJECT_STREAM_SIZE 個物件等待寫出。
+# 書籤的第一層項目與表單欄位參照需要在結尾才能串接，會保留到寫出目錄時。
+
+PDF_HEADER = b'%PDF-1.7\n%\xe2\xe3\xcf\xd3\n'
+OBJECT_STREAM_SIZE = 100  # 每個物件串流包含的物件數
+OBJECT_STREAM_LEVEL = 9
+FORM_SETTINGS = ('/DA', '/DR', '/Q', '/SigFlags')  # 合併時沿用第一個輸入檔的 AcroForm 設定
+
+progress_store = get_progress_store()
+
+class PdfStreamWriter:
+    """依序寫出 PDF 物件並記錄 xref 位置，已寫出的資料可隨時取走
+
+    object_streams 為 True 時，非串流物件每 OBJECT_STREAM_SIZE 個打包成壓縮的
+    物件串流，結尾改用 xref 串流（PDF 1.5）。
+    """
+
+    def __init__(self, object_streams=False):
+        self.offsets = array('Q', [0])  # 物件編號 → 檔案位置，或所在物件串流編號
+        self.indexes = array('H', [0])  # 位於物件串流時為串流內的索引
+        self.compressed = array('b', [0])  # 1 表示位於物件串流
+        self.object_streams = object_streams
+        self._pending = []  # 等待打包的 (物件編號, 內容)
+        self.position = 0
+        self._buffer = BytesIO()
+        self._write(PDF_HEADER)
+
+    def _write(self, data):
+        self._buffer.write(data)
+        self.position += len(data)
+
+    def reserve(self):
+        """預留物件編號"""
+        self.offsets.append(0)
+        self.indexes.append(0)
+        self.compressed.append(0)
+        return len(self.offsets) - 1
+
+    def write_object(self, number, data, is_stream=False):
+        """寫入已序列化的物件內容（串流物件不能放進物件串流）"""
+        if self.object_streams and not is_stream:
+            self._pending.append((number, data))
+            if len(self._pending) >= OBJECT_STREAM_SIZE:
+                self.flush_object_stream()
+            return
+        self.offsets[number] = self.position
+        self._write(b'%d 0 obj\n' % number)
+        self._write(data)
+        self._write(b'\nendobj\n')
+
+    def flush_object_stream(self):
+        """把等待中的物件打包成一個壓縮的物件串流"""
+        if not self._pending:
+            return
+        pending, self._pending = self._pending, []
+        stream_number = self.reserve()
+        header = []
+        body = BytesIO()
+        for index, (number, data) in enumerate(pending):
+            header.append(b'%d %d' % (number, body.tell()))
+            body.write(data)
+            body.write(b'\n')
+            self.offsets[number] = stream_number
+            self.indexes[number] = index
+            self.compressed[number] = 1
+        header = b' '.join(header) + b'\n'
+        data = zlib.compress(header + body.getvalue(), OBJECT_STREAM_LEVEL)
+        self.write_object(stream_number, b'<< /Type /ObjStm /N %d /First %d /Filter /FlateDecode /Length %d >>\nstream\n%s\nendstream' % (
+            len(pending), len(header), len(data), data
+        ), is_stream=True)
+
+    def take(self):
+        """取出目前累積的輸出"""
+        data = self._buffer.getvalue()
+        self._buffer = BytesIO()
+        return data
+
+    def finish(self, root_number):
+        """寫入 xref 表（或 xref 串流）與 trailer"""
+        if self.object_streams:
+            self._finish_xref_stream(root_number)
+            return
+        xref_position = self.position
+        lines = [b'xref\n0 %d\n' % len(self.offsets), b'0000000000 65535 f \n']
+        for offset in self.offsets[1:]:
+            lines.append(b'%010d 00000 n \n' % offset)
+        self._write(b''.join(lines))
+        self._write(
+            b'trailer\n<< /Size %d /Root %d 0 R >>\nstartxref\n%d\n%%%%EOF\n'
+            % (len(self.offsets), root_number, xref_position)
+        )
+
+    def _finish_xref_stream(self, root_number):
+        self.flush_object_stream()
+        xref_number = self.reserve()
+        xref_position = self.position
+        self.offsets[xref_number] = xref_position
+        # 每筆：類型（1 位元組）、位置或物件串流編號（5）、串流內索引（2）
+        rows = [b'\x00' + (0).to_bytes(5, 'big') + (65535).to_bytes(2, 'big')]
+        for number in range(1, len(self.offsets)):
+            kind = 2 if self.compressed[number] else 1
+            rows.append(bytes([kind]) + self.offsets[number].to_bytes(5, 'big') + self.indexes[number].to_bytes(2, 'big'))
+        data = zlib.compress(b''.join(rows), OBJECT_STREAM_LEVEL)
+        self._write(b'%d 0 obj\n' % xref_number)
+        self._write(
+            b'<< /Type /XRef /Size %d /Root %d 0 R /W [1 5 2] /Filter /FlateDecode /Length %d >>\nstream\n'
+            % (len(self.offsets), root_number, len(data))
+        )
+        self._write(data)
+        self._write(b'\nendstream\nendobj\nstartxref\n%d\n%%%%EOF\n' % xref_position)
+
+def _serialize(obj):
+    buffer = BytesIO()
+    obj.write_to_stream(buffer, None)
+    return buffer.getvalue()
+
+def _page_points(page):
+    try:
+        box = page.mediabox
+        return max(float(box.width), float(box.height))
+    except Exception:
+        return None
+
+class _ObjectCopier:
+    """把單一輸入檔的物件複製到輸出，重新編號並以內容雜湊去除重複資源"""
+
+    def __init__(self, writer, reader, pages_root, dedupe, included=None, optimizer=None):
+        self.writer = writer
+        self.optimizer = optimizer
+        self.page_points = None  # 目前頁面的最長邊（點），用來估計圖片解析度
+        self.reader = reader
+        self.pages_root = pages_root
+        self.dedupe = dedupe  # 跨輸入檔共用：內容雜湊 → 輸出物件編號
+        self.mapping = {}  # (物件編號, 世代) → 輸出物件編號
+        self.in_progress = set()
+        self.placed = set()  # 已放進頁面樹的頁面
+        self.page_index = {}
+        for i, page in enumerate(reader.pages):
+            ref = page.indirect_reference
+            if ref is not None and (included is None or i in included):
+                self.page_index[(ref.idnum, ref.generation)] = i
+
+    def _ref(self, number):
+        return IndirectObject(number, 0, None)
+
+    def copy_page(self, index, rotate=0):
+        """複製頁面（使用已展開繼承屬性的頁面物件），回傳輸出參照
+
+        同一頁在輸出中出現多次時，每次都寫入新的頁面物件（資源仍共用）。
+        """
+        page = self.reader.pages[index]
+        ref = page.indirect_reference
+        key = (ref.idnum, ref.generation) if ref is not None else None
+        if key is not None and key in self.mapping and key not in self.placed and not rotate:
+            # 已因其他物件的參照而寫出，直接放進頁面樹
+            self.placed.add(key)
+            return self._ref(self.mapping[key])
+
+        number = self.writer.reserve()
+        if key is not None:
+            self.mapping.setdefault(key, number)
+            self.placed.add(key)
+        self.page_points = _page_points(page)
+        copied = DictionaryObject()
+        for name, value in dict.items(page):
+            if name == '/Parent':
+                continue
+            copied[NameObject(name)] = self._copy_value(value)
+        copied[NameObject('/Parent')] = self._ref(self.pages_root)
+        if rotate:
+            current = page.get('/Rotate', 0)
+            if isinstance(current, IndirectObject):  # 實際檔案中常以間接參照存放
+                current = current.get_object()
+            current = int(current)
+            copied[NameObject('/Rotate')] = NumberObject((current + rotate) % 360)
+        self.writer.write_object(number, _serialize(copied))
+        return self._ref(number)
+
+    def copy_outline_items(self):
+        """複製書籤，回傳第一層項目 [(輸出物件編號, 內容)]
+
+        子項目直接寫出；第一層項目的 /Parent、/Prev、/Next 要跨輸入檔串接，由呼叫端補上後寫出。
+        須在所有頁面複製完成後呼叫，指向未輸出頁面的目的地會成為 null。
+        """
+        outlines = self.reader.trailer['/Root'].get('/Outlines')
+        if isinstance(outlines, IndirectObject):
+            outlines = outlines.get_object()
+        if not isinstance(outlines, DictionaryObject):
+            return []
+        items = []
+        ref = outlines.get('/First')
+        while isinstance(ref, IndirectObject):
+            key = (ref.idnum, ref.generation)
+            if key in self.mapping:  # 損壞的檔案中 /Next 形成循環
+                break
+            number = self.mapping[key] = self.writer.reserve()
+            item = ref.get_object()
+            copied = DictionaryObject()
+            for name, value in dict.items(item):
+                if name not in ('/Parent', '/Prev', '/Next'):
+                    copied[NameObject(name)] = self._copy_value(value)
+            items.append((number, copied))
+            ref = item.get('/Next')
+        return items
+
+    def copy_form(self):
+        """複製已輸出頁面上的表單欄位，回傳 (欄位參照清單, AcroForm 內容)"""
+        form = self.reader.trailer['/Root'].get('/AcroForm')
+        if isinstance(form, IndirectObject):
+            form = form.get_object()
+        if not isinstance(form, DictionaryObject):
+            return [], None
+        fields = form.get('/Fields', [])
+        if isinstance(fields, IndirectObject):
+            fields = fields.get_object()
+        # 頁面的 /Annots 已帶出有輸出的欄位（含上層欄位），其餘欄位的小工具都在未輸出的頁面上
+        refs = [
+            self._ref(self.mapping[(ref.idnum, ref.generation)]) for ref in fields
+            if isinstance(ref, IndirectObject) and (ref.idnum, ref.generation) in self.mapping
+        ]
+        return refs, form
+
+    def _reference_page(self, index):
+        """其他物件（連結、書籤）參照到的頁面"""
+        page = self.reader.pages[index]
+        ref = page.indirect_reference
+        key = (ref.idnum, ref.generation)
+        if key in self.mapping:
+            return self._ref(self.mapping[key])
+        number = self.writer.reserve()
+        self.mapping[key] = number
+        self.page_points = _page_points(page)
+        copied = DictionaryObject()
+        for name, value in dict.items(page):
+            if name != '/Parent':
+                copied[NameObject(name)] = self._copy_value(value)
+        copied[NameObject('/Parent')] = self._ref(self.pages_root)
+        self.writer.write_object(number, _serialize(copied))
+        return self._ref(number)
+
+    def _copy_indirect(self, ref):
+        key = (ref.idnum, ref.generation)
+        if key in self.mapping:
+            return self._ref(self.mapping[key])
+        if key in self.page_index:
+            return self._reference_page(self.page_index[key])
+        if key in self.in_progress:
+            # 循環參照：先預留編號，待外層複製完成時寫入
+            self.mapping[key] = self.writer.reserve()
+            return self._ref(self.mapping[key])
+
+        obj = ref.get_object()
+        if isinstance(obj, DictionaryObject) and obj.get('/Type') == '/Pages':
+            return self._ref(self.pages_root)
+        if isinstance(obj, DictionaryObject) and obj.get('/Type') == '/Page':
+            # 指向未輸出頁面的參照（例如已刪除頁面的連結）改為 null
+            return NullObject()
+
+        self.in_progress.add(key)
+        try:
+            copied = self._copy_value(obj)
+        finally:
+            self.in_progress.discard(key)
+        data = _serialize(copied)
+        is_stream = isinstance(copied, StreamObject)
+
+        if key in self.mapping:
+            self.writer.write_object(self.mapping[key], data, is_stream)
+            return self._ref(self.mapping[key])
+
+        # 以最佳化前的內容去重，相同的圖片只處理一次
+        digest = hashlib.sha1(data).digest()
+        number = self.dedupe.get(digest)
+        if number is None:
+            number = self.writer.reserve()
+            if is_stream and self.optimizer is not None:
+                self.optimizer.submit(number, copied, obj, self.page_points)
+            else:
+                self.writer.write_object(number, data, is_stream)
+            self.dedupe[digest] = number
+        self.mapping[key] = number
+        return self._ref(number)
+
+    def _copy_value(self, value):
+        if isinstance(value, IndirectObject):
+            return self._copy_indirect(value)
+        if isinstance(value, StreamObject):
+            copied = StreamObject()
+            copied._data = value._data
+            for name, item in dict.items(value):
+                if name != '/Length':
+                    copied[NameObject(name)] = self._copy_value(item)
+            return copied
+        if isinstance(value, DictionaryObject):
+            copied = DictionaryObject()
+            for name, item in dict.items(value):
+                copied[NameObject(name)] = self._copy_value(item)
+            return copied
+        if isinstance(value, ArrayObject):
+            return ArrayObject(self._copy_value(item) for item in value)
+        return value
+
+@contextmanager
+def open_reader(path):
+    """開啟 PDF（加密檔嘗試以空白密碼解密），離開時關閉
+
+    PdfReader 收到路徑時會把整個檔案讀進 BytesIO，改以 mmap 讀取（與 pdf_sessions 相同），
+    只有實際用到的部分會被載入。
+    """
+    name = path.name if hasattr(path, 'name') else path
+    with open(str(path), 'rb') as f:
+        try:
+            buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:  # 空白檔案無法 mmap
+            raise ValueError(f'PDF 檔案是空的: {name}')
+    try:
+        with metrics.stage('pdf.parse'):
+            reader = PdfReader(buffer, strict=False)
+            if reader.is_encrypted and not reader.decrypt(''):
+                raise ValueError(f'無法開啟加密的 PDF: {name}')
+            len(reader.pages)  # 頁面樹也在這裡解析，計入解析時間
+        yield reader
+    finally:
+        buffer.close()
+
+def create_merge_progress(total_pages, kind='pdf_merge'):
+    """建立 PDF 輸出進度紀錄，可用 /api/jobs/<id> 查詢"""
+    progress_id = str(uuid.uuid4())
+    progress_store.create(progress_id, {
+        'kind': kind,
+        'status': 'running',
+        'progress': 0,
+        'pages_done': 0,
+        'pages_total': total_pages,
+        'bytes_written': 0,
+        'error': None,
+    })
+    return progress_id
+
+def write_pages(sources, plan, progress_id=None, optimize=None):
+    """依頁面計畫單次讀寫輸出 PDF，產生輸出區塊
+
+    sources 為檔案路徑或文件工作階段；plan 為 [(輸入索引, 頁面索引, 額外旋轉角度)]，
+    依序成為輸出頁面。輸入在第一次用到時才開啟，最後一次用到後即釋放。
+    optimize 為 pdf_optimize.OptimizeOptions 時，串流在執行緒池中重新壓縮／縮小圖片，
+    並以物件串流與 xref 串流輸出。
+    """
+    last_use = {}
+    included = {}
+    for position, (source, index, _) in enumerate(plan):
+        last_use[source] = position
+        included.setdefault(source, set()).add(index)
+
+    writer = PdfStreamWriter(object_streams=optimize is not None and optimize.object_streams)
+
+    def write_stream(number, stream, result):
+        if result is not None:
+            data, updates = result
+            stream._data = data
+            for name, value in updates.items():
+                stream[NameObject(name)] = NameObject(value) if isinstance(value, str) else NumberObject(value)
+            if NameObject('/DecodeParms') in stream:
+                del stream[NameObject('/DecodeParms')]
+        writer.write_object(number, _serialize(stream), is_stream=True)
+
+    optimizer = StreamOptimizer(optimize, write_stream) if optimize is not None else None
+    pages_root = writer.reserve()
+    catalog = writer.reserve()
+    dedupe = {}
+    copiers = {}
+    opened = {}  # 輸入索引 -> ExitStack
+    kids = ArrayObject()
+    outline_items = []
+    form_fields = ArrayObject()
+    form = None
+    total_pages = len(plan)
+    last_percent = 0
+    busy = 0.0  # 實際產生 PDF 的時間（不含等待客戶端讀取）
+
+    try:
+        for position, (source, index, rotate) in enumerate(plan):
+            started = time.perf_counter()
+            copier = copiers.get(source)
+            if copier is None:
+                opened[source] = ExitStack()
+                reader = opened[source].enter_context(_open_source(sources[source]))
+                copier = copiers[source] = _ObjectCopier(
+                    writer, reader, pages_root, dedupe, included[source], optimizer
+                )
+            kids.append(copier.copy_page(index, rotate))
+            # 已寫出的物件不再需要，清掉快取讓記憶體維持在單頁的量
+            copier.reader.resolved_objects.clear()
+            if last_use[source] == position:
+                outline_items.extend(copier.copy_outline_items())
+                fields, source_form = copier.copy_form()
+                if fields:
+                    form_fields.extend(fields)
+                    if form is None:
+                        form = DictionaryObject()
+                    for name in FORM_SETTINGS:
+                        if name in source_form and name not in form:
+                            form[NameObject(name)] = copier._copy_value(dict.get(source_form, name))
+                    if source_form.get('/NeedAppearances') == True:  # BooleanObject(False) 也是真值
+                        form[NameObject('/NeedAppearances')] = BooleanObject(True)
+                del copiers[source]
+                opened.pop(source).close()
+            if optimizer is not None:
+                optimizer.drain()
+            chunk = writer.take()
+            busy += time.perf_counter() - started
+            yield chunk
+
+            if progress_id:
+                percent = len(kids) / max(total_pages, 1) * 100
+                if percent - last_percent >= PROGRESS_STEP:
+                    progress_store.update(
+                        progress_id,
+                        progress=min(percent, 99),
+                        pages_done=len(kids),
+                        bytes_written=writer.position
+                    )
+                    last_percent = percent
+
+        started = time.perf_counter()
+        if optimizer is not None:
+            optimizer.drain(wait=True)
+        pages = DictionaryObject({
+            NameObject('/Type'): NameObject('/Pages'),
+            NameObject('/Kids'): kids,
+            NameObject('/Count'): NumberObject(len(kids)),
+        })
+        writer.write_object(pages_root, _serialize(pages))
+        root = DictionaryObject({
+            NameObject('/Type'): NameObject('/Catalog'),
+            NameObject('/Pages'): IndirectObject(pages_root, 0, None),
+        })
+        if outline_items:
+            root[NameObject('/Outlines')] = _write_outlines(writer, outline_items)
+        if form is not None:
+            form[NameObject('/Fields')] = form_fields
+            root[NameObject('/AcroForm')] = form
+        writer.write_object(catalog, _serialize(root))
+        writer.finish(catalog)
+        chunk = writer.take()
+        busy += time.perf_counter() - started
+        metrics.record_stage('pdf.write', busy)
+        yield chunk
+
+        if progress_id:
+            progress_store.update(
+                progress_id,
+                status='completed',
+                progress=100,
+                pages_done=len(kids),
+                bytes_written=writer.position
+            )
+    except Exception as e:
+        metrics.record_stage('pdf.write', busy, failed=True)
+        if progress_id:
+            progress_store.update(progress_id, status='error', error=str(e))
+        raise
+    finally:
+        if optimizer is not None:
+            optimizer.cancel()
+        for stack in opened.values():
+            stack.close()
+
+def _write_outlines(writer, items):
+    """把各輸入檔的第一層書籤串成一個書籤樹並寫出，回傳書籤根節點的參照"""
+    root_number = writer.reserve()
+    visible = 0
+    for position, (number, item) in enumerate(items):
+        item[NameObject('/Parent')] = IndirectObject(root_number, 0, None)
+        if position > 0:
+            item[NameObject('/Prev')] = IndirectObject(items[position - 1][0], 0, None)
+        if position + 1 < len(items):
+            item[NameObject('/Next')] = IndirectObject(items[position + 1][0], 0, None)
+        writer.write_object(number, _serialize(item))
+        count = dict.get(item, '/Count')
+        visible += 1 + (count if isinstance(count, int) and count > 0 else 0)
+    writer.write_object(root_number, _serialize(DictionaryObject({
+        NameObject('/Type'): NameObject('/Outlines'),
+        NameObject('/First'): IndirectObject(items[0][0], 0, None),
+        NameObject('/Last'): IndirectObject(items[-1][0], 0, None),
+        NameObject('/Count'): NumberObject(visible),
+    })))
+    return IndirectObject(root_number, 0, None)
+
+def _open_source(source):
+    """開啟輸入來源：檔案路徑，或提供 open_reader() 的物件（例如文件工作階段）"""
+    if isinstance(source, (str, os.PathLike)):
+        return open_reader(source)
+    return source.open_reader()
+
+def page_counts(sources):
+    """預先檢查所有輸入並回傳各檔頁數（只解析 xref 與頁面樹）"""
+    counts = []
+    for source in sources:
+        with _open_source(source) as reader:
+            counts.append(len(reader.pages))
+    return counts
+
+def merge_plan(counts):
+    """依序串接所有輸入頁面的計畫（counts 為 page_counts 的結果）"""
+    return [(source, index, 0) for source, count in enumerate(counts) for index in range(count)]
@@ -0,0 +1,203 @@
+import os
+import zlib
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+from PIL import Image
+
+# PDF 最佳化設定（可用環境變數調整）
+OPTIMIZE_WORKERS = int(os.environ.get('OPTIMIZE_WORKERS', str(os.cpu_count() or 2)))  # 串流壓縮／圖片處理執行緒數
+IMAGE_DPI_CHOICES = (72, 100, 150, 200, 300)
+DEFAULT_JPEG_QUALITY = 75
+FLATE_LEVEL = 9
+MAX_PENDING_PER_WORKER = 4  # 每個執行緒最多排隊的串流數，限制等待寫出的資料量
+
+# 可以解碼後重新取樣的色彩空間（對應 Pillow 模式）
+IMAGE_MODES = {'/DeviceRGB': 'RGB', '/DeviceGray': 'L'}
+# 不重新壓縮的串流類型（XMP 中繼資料依規範應保持未壓縮）
+SKIP_STREAM_TYPES = ('/Metadata', '/XRef', '/ObjStm')
+
+_executor = None
+_executor_pid = None
+_executor_lock = threading.Lock()
+
+class OptimizeOptions:
+    """PDF 輸出最佳化選項"""
+
+    def __init__(self, object_streams=True, recompress=True, image_dpi=None, jpeg_quality=DEFAULT_JPEG_QUALITY):
+        self.object_streams = object_streams
+        self.recompress = recompress
+        self.image_dpi = image_dpi  # None 表示不縮小圖片
+        self.jpeg_quality = jpeg_quality
+
+def parse_optimize_options(form):
+    """從表單取得最佳化選項；未要求最佳化時回傳 None
+
+    optimize=1 開啟物件串流與串流重新壓縮；image_dpi 指定圖片目標解析度，
+    jpeg_quality 為重新編碼圖片的品質（30-95）。
+    """
+    if form.get('optimize', '').lower() not in ('1', 'true', 'on', 'yes'):
+        return None
+    image_dpi = form.get('image_dpi', type=int)
+    if image_dpi is not None and image_dpi not in IMAGE_DPI_CHOICES:
+        raise ValueError(f'圖片解析度必須是 {", ".join(map(str, IMAGE_DPI_CHOICES))} 之一')
+    jpeg_quality = form.get('jpeg_quality', DEFAULT_JPEG_QUALITY, type=int)
+    if not 30 <= jpeg_quality <= 95:
+        raise ValueError('JPEG 品質必須介於 30 到 95')
+    return OptimizeOptions(image_dpi=image_dpi, jpeg_quality=jpeg_quality)
+
+def _get_executor():
+    """取得本行程的最佳化執行緒池（zlib 與 Pillow 處理時會釋放 GIL）"""
+    global _executor, _executor_pid
+    with _executor_lock:
+        if _executor is None or _executor_pid != os.getpid():
+            _executor = ThreadPoolExecutor(max_workers=max(1, OPTIMIZE_WORKERS), thread_name_prefix='pdf-optimize')
+            _executor_pid = os.getpid()
+        return _executor
+
+def _resolve(stream, key):
+    """取得字典值並解開間接參照"""
+    value = stream.get(key)
+    return value.get_object() if value is not None else None
+
+def _filters(stream):
+    value = _resolve(stream, '/Filter')
+    if value is None:
+        return []
+    if isinstance(value, list):
+        return [str(f.get_object()) for f in value]
+    return [str(value)]
+
+def _image_mode(stream):
+    """圖片的 Pillow 模式；ICCBased 依色版數判斷，不支援時回傳 None"""
+    colorspace = _resolve(stream, '/ColorSpace')
+    if isinstance(colorspace, list) and len(colorspace) == 2 and colorspace[0] == '/ICCBased':
+        channels = _resolve(colorspace[1].get_object(), '/N')
+        return {1: 'L', 3: 'RGB'}.get(channels)
+    if isinstance(colorspace, str):
+        return IMAGE_MODES.get(colorspace)
+    return None
+
+def _resample_image(data, filters, width, height, mode, max_pixels, quality):
+    """縮小圖片並重新編碼為 JPEG，無法處理或不需縮小時回傳 None"""
+    scale = min(max_pixels / width, max_pixels / height)
+    if scale >= 1:
+        return None
+    size = (max(1, int(width * scale)), max(1, int(height * scale)))
+    if filters == ['/DCTDecode']:
+        image = Image.open(BytesIO(data))
+        image.draft(mode, size)  # JPEG 可直接以較小比例解碼
+        if image.mode not in ('RGB', 'L'):
+            return None
+    else:
+        raw = zlib.decompress(data) if filters == ['/FlateDecode'] else data
+        if len(raw) != width * height * len(mode):
+            return None
+        image = Image.frombytes(mode, (width, height), raw)
+    image = image.resize(size, Image.LANCZOS)
+    output = BytesIO()
+    image.save(output, 'JPEG', quality=quality, optimize=True)
+    return output.getvalue(), size
+
+def _recompress(data, filters):
+    """以最高壓縮率重新壓縮，變小時才回傳新資料"""
+    if not filters:
+        raw = data
+    elif filters == ['/FlateDecode']:
+        raw = zlib.decompress(data)
+    else:
+        return None
+    compressed = zlib.compress(raw, FLATE_LEVEL)
+    return compressed if len(compressed) < len(data) else None
+
+def optimize_stream(data, info, options):
+    """在工作執行緒中處理單一串流，回傳 (新資料, 字典更新) 或 None
+
+    info 為主執行緒事先取出的串流屬性，避免在執行緒中存取 PDF 物件。
+    """
+    try:
+        if info['image'] and options.image_dpi and info['max_points']:
+            max_pixels = info['max_points'] / 72 * options.image_dpi
+            result = _resample_image(
+                data, info['filters'], info['width'], info['height'], info['mode'], max_pixels, options.jpeg_quality
+            )
+            if result is not None and len(result[0]) < len(data):
+                new_data, (width, height) = result
+                return new_data, {'/Filter': '/DCTDecode', '/Width': width, '/Height': height, '/BitsPerComponent': 8}
+            if info['filters'] == ['/DCTDecode']:
+                return None
+        if options.recompress and not info['has_parms']:
+            compressed = _recompress(data, info['filters'])
+            if compressed is not None:
+                return compressed, {'/Filter': '/FlateDecode'}
+    except Exception:
+        # 無法解碼的串流維持原樣
+        return None
+    return None
+
+def stream_info(stream, max_points):
+    """從原始串流取出最佳化需要的屬性；不需處理的串流回傳 None
+
+    max_points 為圖片所在頁面的最長邊（點），用來估計圖片的有效解析度。
+    """
+    if _resolve(stream, '/Type') in SKIP_STREAM_TYPES:
+        return None
+    filters = _filters(stream)
+    info = {
+        'filters': filters,
+        'has_parms': '/DecodeParms' in stream,
+        'image': False,
+        'max_points': max_points,
+    }
+    if _resolve(stream, '/Subtype') == '/Image':
+        mode = _image_mode(stream)
+        if (
+            mode is not None
+            and not _resolve(stream, '/ImageMask')
+            and not any(key in stream for key in ('/SMask', '/Mask', '/Decode'))
+            and _resolve(stream, '/BitsPerComponent') == 8
+            and (filters in ([], ['/DCTDecode']) or (filters == ['/FlateDecode'] and not info['has_parms']))
+        ):
+            info.update(image=True, width=int(_resolve(stream, '/Width')), height=int(_resolve(stream, '/Height')), mode=mode)
+    if not info['image'] and (info['has_parms'] or filters not in ([], ['/FlateDecode'])):
+        return None
+    return info
+
+class StreamOptimizer:
+    """把串流送到執行緒池處理，完成後再寫出（物件位置不必依序）
+
+    等待中的串流數量有上限，超過時會等最早送出的完成，記憶體維持固定。
+    """
+
+    def __init__(self, options, write):
+        self.options = options
+        self.write = write  # write(物件編號, 串流物件, 處理結果)
+        self.executor = _get_executor()
+        self.pending = deque()
+        self.limit = max(1, OPTIMIZE_WORKERS) * MAX_PENDING_PER_WORKER
+
+    def submit(self, number, stream, original, max_points):
+        """送出複製後的串流（original 為來源檔中的原始串流）；不需處理時立即寫出"""
+        info = stream_info(original, max_points)
+        if info is None:
+            self.write(number, stream, None)
+            return
+        future = self.executor.submit(optimize_stream, stream._data, info, self.options)
+        self.pending.append((number, stream, future))
+        while len(self.pending) > self.limit:
+            self._write_next()
+
+    def _write_next(self):
+        number, stream, future = self.pending.popleft()
+        self.write(number, stream, future.result())
+
+    def drain(self, wait=False):
+        """寫出已完成的串流；wait 為 True 時等待全部完成"""
+        while self.pending and (wait or self.pending[0][2].done()):
+            self._write_next()
+
+    def cancel(self):
+        for _, _, future in self.pending:
+            future.cancel()
+        self.pending.clear()
@@ -0,0 +1,210 @@
+import io
+import os
+import re
+import mmap
+import time
+import uuid
+import shutil
+import hashlib
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from pathlib import Path
+from PyPDF2 import PdfReader
+import metrics
+
+# PDF 文件工作階段設定（可用環境變數調整）
+PDF_SESSION_DIR = Path(os.environ.get('PDF_SESSION_DIR', Path(__file__).parent / "temp" / "pdf_sessions"))
+PDF_SESSION_TTL = int(os.environ.get('PDF_SESSION_TTL', '3600'))  # 秒，最後一次使用後保留多久
+PDF_THUMBNAIL_DIR = PDF_SESSION_DIR / "thumbnails"  # 依文件雜湊分目錄，隨工作階段一起刪除
+PDF_SESSION_CACHE_SIZE = int(os.environ.get('PDF_SESSION_CACHE_SIZE', '16'))  # 每個行程保留的已解析文件數
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+EVICT_INTERVAL = 60  # 秒
+
+SESSION_ID_PATTERN = re.compile(r'^[0-9a-f]{64}$')
+
+class SessionNotFound(Exception):
+    """工作階段不存在或已過期"""
+
+class _MappedView(io.RawIOBase):
+    """共用 mmap 的唯讀檔案物件，各自記錄讀取位置（mmap 本身的位置不是執行緒安全的）"""
+
+    def __init__(self, buffer):
+        super().__init__()
+        self._buffer = buffer
+        self._position = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self._position
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        base = {io.SEEK_SET: 0, io.SEEK_CUR: self._position, io.SEEK_END: len(self._buffer)}[whence]
+        self._position = max(0, base + offset)
+        return self._position
+
+    def read(self, size=-1):
+        end = len(self._buffer) if size is None or size < 0 else self._position + size
+        data = self._buffer[self._position:end]
+        self._position += len(data)
+        return data
+
+class _Session:
+    """已驗證的文件：以 mmap 讀取，只有實際用到的頁面會被載入記憶體"""
+
+    def __init__(self, path):
+        with open(str(path), 'rb') as f:
+            self.buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self.pages = len(self.new_reader().pages)
+        self.size = len(self.buffer)
+
+    def new_reader(self):
+        """建立獨立的 PdfReader：共用同一份 mmap，但各自有讀取位置與物件快取
+
+        PdfReader 不是執行緒安全的，同一文件（內容雜湊相同，可能來自不同使用者）的每個請求
+        各用一個，串流回應再慢也不會擋住其他請求。
+        """
+        with metrics.stage('pdf.parse'):
+            reader = PdfReader(_MappedView(self.buffer), strict=False)
+            if reader.is_encrypted and not reader.decrypt(''):
+                raise ValueError('無法開啟加密的 PDF')
+            len(reader.pages)  # 頁面樹也在這裡解析，計入解析時間
+        return reader
+
+_cache = OrderedDict()  # session_id -> _Session（LRU）
+_cache_lock = threading.Lock()
+_last_evict = 0
+
+def _session_dir():
+    PDF_SESSION_DIR.mkdir(parents=True, exist_ok=True)
+    return PDF_SESSION_DIR
+
+def _remove_derived(session_id):
+    """刪除由文件產生的縮圖等衍生檔案"""
+    shutil.rmtree(str(PDF_THUMBNAIL_DIR / session_id), ignore_errors=True)
+
+def _touch(path):
+    """更新最後使用時間（以檔案 mtime 記錄，所有 worker 共用）"""
+    try:
+        os.utime(str(path))
+    except FileNotFoundError:
+        pass
+
+def session_path(session_id):
+    """取得工作階段檔案路徑，不存在時拋出 SessionNotFound"""
+    if not SESSION_ID_PATTERN.match(session_id or ''):
+        raise SessionNotFound(session_id)
+    path = _session_dir() / f"{session_id}.pdf"
+    if not path.exists():
+        with _cache_lock:
+            _cache.pop(session_id, None)
+        raise SessionNotFound(session_id)
+    _touch(path)
+    return path
+
+def _get(session_id):
+    """取得已解析的文件，未快取時開啟並放入 LRU"""
+    path = session_path(session_id)
+    with _cache_lock:
+        session = _cache.get(session_id)
+        if session is not None:
+            _cache.move_to_end(session_id)
+            return session
+
+    return _remember(session_id, _Session(path))
+
+def _remember(session_id, session):
+    with _cache_lock:
+        # 其他執行緒可能同時開啟了同一文件，以先放入的為準
+        session = _cache.setdefault(session_id, session)
+        _cache.move_to_end(session_id)
+        while len(_cache) > max(1, PDF_SESSION_CACHE_SIZE):
+            # 被移出的文件若仍在使用，mmap 會在最後一個參照消失後才關閉
+            _cache.popitem(last=False)
+    return session
+
+@contextmanager
+def open_session(session_id):
+    """取得此次使用專用的 PdfReader（只在查詢快取時持有鎖）"""
+    yield _get(session_id).new_reader()
+
+class SessionSource:
+    """可傳給 pdf_merge.write_pages 的輸入來源"""
+
+    def __init__(self, session_id):
+        self.session_id = session_id
+
+    def open_reader(self):
+        return open_session(self.session_id)
+
+def is_session_id(value):
+    return bool(SESSION_ID_PATTERN.match(value or ''))
+
+def create_session(file_storage):
+    """儲存上傳的 PDF 並建立工作階段，以內容雜湊為 ID（相同檔案只存一份）"""
+    directory = _session_dir()
+    evict_expired()
+    temp_path = directory / f"upload_{uuid.uuid4()}.tmp"
+    digest = hashlib.sha256()
+    try:
+        with open(str(temp_path), 'wb') as f:
+            for chunk in iter(lambda: file_storage.stream.read(UPLOAD_CHUNK_SIZE), b''):
+                digest.update(chunk)
+                f.write(chunk)
+        session_id = digest.hexdigest()
+        path = directory / f"{session_id}.pdf"
+        if path.exists():
+            _touch(path)
+        else:
+            # 先檢查檔案能否解析，再放到正式位置（mmap 在改名後仍有效）
+            _remember(session_id, _Session(temp_path))
+            os.replace(str(temp_path), str(path))
+    finally:
+        if temp_path.exists():
+            temp_path.unlink()
+    return session_info(session_id)
+
+def session_info(session_id):
+    """工作階段資訊"""
+    session = _get(session_id)
+    return {
+        'session_id': session_id,
+        'pages': session.pages,
+        'size': session.size,
+        'expires_in': PDF_SESSION_TTL,
+    }
+
+def delete_session(session_id):
+    """釋放工作階段，回傳是否存在
+
+    ID 是內容雜湊，上傳相同檔案的使用者共用同一份文件，因此只釋放本行程已解析的副本，
+    檔案與縮圖留給 evict_expired 在 PDF_SESSION_TTL 未使用後刪除。
+    """
+    if not SESSION_ID_PATTERN.match(session_id or '') or not (_session_dir() / f"{session_id}.pdf").exists():
+        return False
+    with _cache_lock:
+        _cache.pop(session_id, None)
+    return True
+
+def evict_expired():
+    """刪除超過 PDF_SESSION_TTL 未使用的文件（每 EVICT_INTERVAL 秒最多執行一次）"""
+    global _last_evict
+    now = time.time()
+    if now - _last_evict < EVICT_INTERVAL:
+        return
+    _last_evict = now
+    directory = _session_dir()
+    for path in list(directory.glob('*.pdf')) + list(directory.glob('*.tmp')):
+        try:
+            if now - path.stat().st_mtime > PDF_SESSION_TTL:
+                with _cache_lock:
+                    _cache.pop(path.stem, None)
+                path.unlink()
+                _remove_derived(path.stem)
+        except FileNotFoundError:
+            continue
@@ -0,0 +1,145 @@
+import os
+import json
+import uuid
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+from pathlib import Path
+from pdf_sessions import PDF_THUMBNAIL_DIR
+
+# 縮圖設定（可用環境變數調整）
+WEB_WORKERS = max(1, int(os.environ.get('WEB_CONCURRENCY', '1')))  # gunicorn worker 數（gunicorn 也以此變數為預設值）
+# 每個 worker 各有一個渲染行程池，預設平分 CPU 核心，避免整台主機的渲染行程數是核心數的好幾倍
+THUMBNAIL_WORKERS = int(os.environ.get('THUMBNAIL_WORKERS', str(max(1, (os.cpu_count() or 2) // WEB_WORKERS))))  # 渲染行程數
+THUMBNAIL_WIDTHS = (120, 200, 400, 800)  # 允許的寬度（像素），其他值往上取最接近的
+THUMBNAIL_BATCH = 8  # 每個渲染工作處理的頁數（減少重複開啟文件）
+THUMBNAIL_QUALITY = 80
+
+_executor = None
+_executor_pid = None
+_executor_lock = threading.Lock()
+_pending = {}  # (文件雜湊, 寬度, 頁碼) -> Future（避免同一行程重複渲染）
+_pending_lock = threading.Lock()
+
+class ThumbnailUnavailable(Exception):
+    """未安裝 PDF 渲染套件"""
+
+def normalize_width(width):
+    """把要求的寬度對應到允許的尺寸"""
+    for allowed in THUMBNAIL_WIDTHS:
+        if width <= allowed:
+            return allowed
+    return THUMBNAIL_WIDTHS[-1]
+
+def thumbnail_path(session_id, width, page):
+    return PDF_THUMBNAIL_DIR / session_id / str(width) / f"{page}.jpg"
+
+def _render_pages(pdf_path, pages, width, output_dir):
+    """在子行程中渲染多個頁面（頁碼從 1 開始），回傳完成的頁碼"""
+    import pypdfium2 as pdfium
+
+    output_dir = Path(output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    document = pdfium.PdfDocument(pdf_path)
+    try:
+        for page_number in pages:
+            page = document[page_number - 1]
+            try:
+                scale = width / max(page.get_width(), 1)
+                image = page.render(scale=scale).to_pil().convert('RGB')
+            finally:
+                page.close()
+            # 先寫到暫存檔再改名，其他行程不會讀到寫一半的圖片
+            temp_path = output_dir / f".{page_number}_{uuid.uuid4().hex}.jpg"
+            image.save(str(temp_path), 'JPEG', quality=THUMBNAIL_QUALITY)
+            os.replace(str(temp_path), str(output_dir / f"{page_number}.jpg"))
+    finally:
+        document.close()
+    return list(pages)
+
+def _get_executor(reset=False):
+    """取得渲染行程池（以 spawn 建立，避免在多執行緒的 worker 中 fork）"""
+    global _executor, _executor_pid
+    try:
+        import pypdfium2  # noqa: F401
+    except ImportError:
+        raise ThumbnailUnavailable('頁面預覽需要安裝 pypdfium2 套件。請執行: pip install pypdfium2')
+    with _executor_lock:
+        if _executor is None or _executor_pid != os.getpid() or reset:
+            _executor = ProcessPoolExecutor(
+                max_workers=max(1, THUMBNAIL_WORKERS),
+                mp_context=multiprocessing.get_context('spawn')
+            )
+            _executor_pid = os.getpid()
+        return _executor
+
+def _submit(session_id, pdf_path, pages, width):
+    """送出尚未快取也未在渲染中的頁面，回傳 {Future: [頁碼]}（含其他請求送出的）"""
+    futures = {}
+    missing = []
+    with _pending_lock:
+        for page in pages:
+            if thumbnail_path(session_id, width, page).exists():
+                continue
+            future = _pending.get((session_id, width, page))
+            if future is not None:
+                futures.setdefault(future, []).append(page)
+            else:
+                missing.append(page)
+
+        executor = _get_executor() if missing else None
+        output_dir = str(PDF_THUMBNAIL_DIR / session_id / str(width))
+        for i in range(0, len(missing), THUMBNAIL_BATCH):
+            batch = missing[i:i + THUMBNAIL_BATCH]
+            try:
+                future = executor.submit(_render_pages, str(pdf_path), batch, width, output_dir)
+            except BrokenProcessPool:
+                # 渲染行程異常結束（例如記憶體不足被終止），重建行程池
+                executor = _get_executor(reset=True)
+                future = executor.submit(_render_pages, str(pdf_path), batch, width, output_dir)
+            futures[future] = batch
+            for page in batch:
+                _pending[(session_id, width, page)] = future
+            future.add_done_callback(lambda f, keys=[(session_id, width, p) for p in batch]: _release(keys))
+    return futures
+
+def _release(keys):
+    with _pending_lock:
+        for key in keys:
+            _pending.pop(key, None)
+
+def get_thumbnail(session_id, pdf_path, page, width):
+    """取得單一頁面縮圖路徑，必要時立即渲染"""
+    path = thumbnail_path(session_id, width, page)
+    for future in _submit(session_id, pdf_path, [page], width):
+        future.result()
+    return path
+
+def stream_thumbnails(session_id, pdf_path, pages, width):
+    """依序渲染頁面並以 Server-Sent Events 回報完成的頁碼
+
+    已快取的頁面立即回報；其餘依頁碼順序分批送進行程池，
+    前面的頁面會先完成，前端可以邊收到邊顯示。
+    """
+    cached = [page for page in pages if thumbnail_path(session_id, width, page).exists()]
+    if cached:
+        yield f"data: {json.dumps({'pages': cached, 'width': width})}\n\n"
+
+    futures = _submit(session_id, pdf_path, pages, width)
+    # 在檢查快取與送出之間由其他請求完成的頁面
+    submitted = {page for batch in futures.values() for page in batch}
+    ready = [page for page in pages if page not in submitted and page not in cached]
+    if ready:
+        yield f"data: {json.dumps({'pages': ready, 'width': width})}\n\n"
+
+    failed = []
+    for future in as_completed(futures):
+        try:
+            future.result()
+        except Exception:
+            failed.extend(futures[future])
+            continue
+        yield f"data: {json.dumps({'pages': futures[future], 'width': width})}\n\n"
+
+    yield f"data: {json.dumps({'status': 'completed', 'failed': sorted(failed)})}\n\n"
@@ -0,0 +1,292 @@
+import os
+import json
+import time
+import sqlite3
+import threading
+from pathlib import Path
+
+# 進度儲存設定（可用環境變數調整）
+PROGRESS_STORE = os.environ.get('PROGRESS_STORE', 'sqlite')  # memory / sqlite / redis
+PROGRESS_DB_PATH = Path(os.environ.get('PROGRESS_DB_PATH', Path(__file__).parent / "progress.db"))
+PROGRESS_REDIS_URL = os.environ.get('PROGRESS_REDIS_URL', 'redis://localhost:6379/0')
+PROGRESS_TTL = int(os.environ.get('PROGRESS_TTL', '3600'))  # 已結束任務保留秒數
+EVICT_INTERVAL = 60  # 秒
+
+# 進度推送設定
+PROGRESS_STEP = 1.0  # 百分比變化達到此值才寫入／推送
+SSE_POLL_INTERVAL = 0.5  # 秒，串流檢查其他行程更新的間隔
+SSE_HEARTBEAT = 15  # 秒，無更新時送出 keepalive，避免代理伺服器斷線
+# 每個串流在連線期間佔用一個 worker 執行緒：縮短單次連線時間並限制同時串流數，其餘請求才有執行緒可用
+SSE_MAX_DURATION = float(os.environ.get('SSE_MAX_DURATION', '25'))  # 秒，單一串流最長時間，之後由瀏覽器自動重新連線
+SSE_MAX_STREAMS = int(os.environ.get('SSE_MAX_STREAMS', '4'))  # 每個行程同時保持的串流數，超過時只送出目前狀態
+SSE_BUSY_RETRY = 3000  # 毫秒，串流已滿時請瀏覽器等待多久再重新連線
+
+# 視為已結束的狀態，超過 TTL 後會被清除
+FINISHED_STATUSES = ('completed', 'error', 'cancelled')
+# 不對外公開的欄位（伺服器上的檔案路徑、執行工作的行程等），所有讀取 API 都需過濾
+PRIVATE_FIELDS = ('output', 'mimetype', 'download_name', 'owner')
+
+# 同一行程內的進度變更通知（SSE 用來即時推送，其他行程的變更則靠定期查詢）
+_changed = threading.Condition()
+_stream_slots = threading.BoundedSemaphore(max(1, SSE_MAX_STREAMS))
+
+def notify_change():
+    """通知等待中的串流：進度已更新"""
+    with _changed:
+        _changed.notify_all()
+
+def wait_for_change(timeout):
+    """等待進度更新或逾時"""
+    with _changed:
+        _changed.wait(timeout)
+
+def public_view(entry):
+    """移除不對外公開的欄位"""
+    return {k: v for k, v in entry.items() if k not in PRIVATE_FIELDS}
+
+def _expires_at(fields, now):
+    """依狀態計算過期時間（未結束的任務不過期）"""
+    if fields.get('status') in FINISHED_STATUSES:
+        return now + PROGRESS_TTL
+    return None
+
+class MemoryProgressStore:
+    """行程內進度儲存（僅適用於單一 worker）"""
+
+    def __init__(self):
+        self._data = {}
+        self._expires = {}
+        self._lock = threading.Lock()
+        self._last_evict = 0
+
+    def create(self, task_id, data):
+        expires = _expires_at(data, time.time())
+        with self._lock:
+            self._data[task_id] = dict(data)
+            # 建立時就已結束的任務（例如快取命中）也要過期
+            if expires is not None:
+                self._expires[task_id] = expires
+            else:
+                self._expires.pop(task_id, None)
+        notify_change()
+        self.evict_expired()
+
+    def update(self, task_id, **fields):
+        now = time.time()
+        with self._lock:
+            entry = self._data.get(task_id)
+            if entry is None:
+                return
+            entry.update(fields)
+            expires = _expires_at(fields, now)
+            if expires is not None:
+                self._expires[task_id] = expires
+        notify_change()
+
+    def count(self):
+        with self._lock:
+            return len(self._data)
+
+    def unfinished(self):
+        """尚未結束的任務 [(task_id, 資料)]"""
+        with self._lock:
+            return [(t, dict(e)) for t, e in self._data.items() if e.get('status') not in FINISHED_STATUSES]
+
+    def get(self, task_id):
+        with self._lock:
+            entry = self._data.get(task_id)
+            return dict(entry) if entry is not None else None
+
+    def evict_expired(self, force=False):
+        now = time.time()
+        if not force and now - self._last_evict < EVICT_INTERVAL:
+            return
+        self._last_evict = now
+        with self._lock:
+            for task_id in [t for t, exp in self._expires.items() if exp <= now]:
+                self._data.pop(task_id, None)
+                self._expires.pop(task_id, None)
+
+class SQLiteProgressStore:
+    """以 SQLite (WAL) 儲存進度，可跨 gunicorn worker 共用"""
+
+    def __init__(self, path=PROGRESS_DB_PATH):
+        self.path = str(path)
+        self._local = threading.local()
+        self._last_evict = 0
+        conn = self._conn()
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS progress (
+                task_id TEXT PRIMARY KEY,
+                data TEXT NOT NULL,
+                updated_at REAL NOT NULL,
+                expires_at REAL
+            )
+        ''')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_progress_expires ON progress (expires_at)')
+
+    def _conn(self):
+        """每個執行緒使用各自的連線"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or getattr(self._local, 'pid', None) != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def create(self, task_id, data):
+        now = time.time()
+        self._conn().execute(
+            'INSERT OR REPLACE INTO progress (task_id, data, updated_at, expires_at) VALUES (?, ?, ?, ?)',
+            (task_id, json.dumps(data), now, _expires_at(data, now))
+        )
+        notify_change()
+        self.evict_expired()
+
+    def update(self, task_id, **fields):
+        # json_set 在單一 UPDATE 內合併欄位，不需先讀後寫
+        now = time.time()
+        assignments = []
+        params = []
+        for key, value in fields.items():
+            assignments.append('?, json(?)')
+            params.extend([f'$.{key}', json.dumps(value)])
+        params.extend([now, _expires_at(fields, now), task_id])
+        self._conn().execute(
+            f'''UPDATE progress SET data = json_set(data, {", ".join(assignments)}),
+                updated_at = ?, expires_at = COALESCE(?, expires_at)
+                WHERE task_id = ?''',
+            params
+        )
+        notify_change()
+
+    def count(self):
+        return self._conn().execute('SELECT COUNT(*) FROM progress').fetchone()[0]
+
+    def unfinished(self):
+        # 已結束的任務都有過期時間
+        rows = self._conn().execute('SELECT task_id, data FROM progress WHERE expires_at IS NULL').fetchall()
+        return [(task_id, json.loads(data)) for task_id, data in rows]
+
+    def get(self, task_id):
+        row = self._conn().execute('SELECT data FROM progress WHERE task_id = ?', (task_id,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def evict_expired(self, force=False):
+        now = time.time()
+        if not force and now - self._last_evict < EVICT_INTERVAL:
+            return
+        self._last_evict = now
+        self._conn().execute('DELETE FROM progress WHERE expires_at IS NOT NULL AND expires_at <= ?', (now,))
+
+class RedisProgressStore:
+    """以 Redis（或相容服務）儲存進度，過期交由 Redis TTL 處理"""
+
+    def __init__(self, url=PROGRESS_REDIS_URL, prefix='anymusic:progress:'):
+        import redis
+        self._redis = redis.Redis.from_url(url)
+        self.prefix = prefix
+
+    def _key(self, task_id):
+        return f'{self.prefix}{task_id}'
+
+    def create(self, task_id, data):
+        key = self._key(task_id)
+        pipe = self._redis.pipeline()
+        pipe.delete(key)
+        pipe.hset(key, mapping={k: json.dumps(v) for k, v in data.items()})
+        pipe.execute()
+        notify_change()
+
+    def update(self, task_id, **fields):
+        key = self._key(task_id)
+        if not self._redis.exists(key):
+            return
+        pipe = self._redis.pipeline()
+        pipe.hset(key, mapping={k: json.dumps(v) for k, v in fields.items()})
+        if fields.get('status') in FINISHED_STATUSES:
+            pipe.expire(key, PROGRESS_TTL)
+        pipe.execute()
+        notify_change()
+
+    def count(self):
+        return sum(1 for _ in self._redis.scan_iter(match=f'{self.prefix}*', count=1000))
+
+    def unfinished(self):
+        entries = []
+        for key in self._redis.scan_iter(match=f'{self.prefix}*', count=1000):
+            task_id = key.decode()[len(self.prefix):]
+            entry = self.get(task_id)
+            if entry is not None and entry.get('status') not in FINISHED_STATUSES:
+                entries.append((task_id, entry))
+        return entries
+
+    def get(self, task_id):
+        data = self._redis.hgetall(self._key(task_id))
+        if not data:
+            return None
+        return {k.decode(): json.loads(v) for k, v in data.items()}
+
+    def evict_expired(self, force=False):
+        pass
+
+_store = None
+_store_lock = threading.Lock()
+
+def get_progress_store():
+    """取得目前設定的進度儲存（依 PROGRESS_STORE 選擇後端）"""
+    global _store
+    with _store_lock:
+        if _store is None:
+            if PROGRESS_STORE == 'memory':
+                _store = MemoryProgressStore()
+            elif PROGRESS_STORE == 'redis':
+                try:
+                    _store = RedisProgressStore()
+                except ImportError:
+                    print("[WARN] 未安裝 redis 套件，改用 SQLite 進度儲存")
+                    _store = SQLiteProgressStore()
+            else:
+                _store = SQLiteProgressStore()
+        return _store
+
+def _status_changed(prev, current):
+    """判斷狀態是否有值得推送的變化（進度需變化達 PROGRESS_STEP）"""
+    if prev is None:
+        return True
+    if abs((current.get('progress') or 0) - (prev.get('progress') or 0)) >= PROGRESS_STEP:
+        return True
+    return any(prev.get(k) != current.get(k) for k in set(prev) | set(current) if k != 'progress')
+
+def stream_status(get_status):
+    """產生 Server-Sent Events 狀態串流，任務結束時關閉
+
+    get_status 為無參數函式，回傳目前狀態字典。連線最長 SSE_MAX_DURATION 秒，
+    之後由瀏覽器（EventSource）自動重新連線並取得最新狀態；同時串流已達
+    SSE_MAX_STREAMS 時只送出目前狀態就結束，瀏覽器稍後再重新連線（等同輪詢）。
+    """
+    if not _stream_slots.acquire(blocking=False):
+        yield f"retry: {SSE_BUSY_RETRY}\n\n"
+        yield f"data: {json.dumps(get_status())}\n\n"
+        return
+    try:
+        started = last_emit = time.time()
+        last_sent = None
+        yield f"retry: {int(SSE_POLL_INTERVAL * 2000)}\n\n"
+
+        while time.time() - started < SSE_MAX_DURATION:
+            status = get_status()
+            if _status_changed(last_sent, status):
+                yield f"data: {json.dumps(status)}\n\n"
+                last_sent = status
+                last_emit = time.time()
+                if status['status'] in FINISHED_STATUSES or status['status'] == 'not_found':
+                    return
+            elif time.time() - last_emit >= SSE_HEARTBEAT:
+                yield ": keepalive\n\n"
+                last_emit = time.time()
+            wait_for_change(SSE_POLL_INTERVAL)
+    finally:
+        _stream_slots.release()
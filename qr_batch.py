@@ -0,0 +1,261 @@
+import os
+import csv
+import io
+import zlib
+import threading
+import multiprocessing
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from werkzeug.utils import secure_filename
+from qr_codes import render_batch
+from zip_stream import ZipStream
+from pdf_merge import PdfStreamWriter
+
+# 批次 QR Code 設定（可用環境變數調整）
+QR_BATCH_WORKERS = int(os.environ.get('QR_BATCH_WORKERS', str(os.cpu_count() or 2)))  # 產生行程數
+QR_BATCH_MAX_ITEMS = int(os.environ.get('QR_BATCH_MAX_ITEMS', '10000'))  # 每次請求最多幾個
+QR_BATCH_CHUNK = 64  # 每個工作處理的數量（減少行程間傳遞的次數）
+MAX_PENDING_PER_WORKER = 4  # 每個行程最多排隊的工作數，限制等待輸出的資料量
+
+BATCH_OUTPUTS = ('zip', 'pdf')
+MAX_LABEL_LENGTH = 200
+
+# PDF 標籤頁版面（單位：點，A4 直式）
+SHEET_WIDTH = 595.28
+SHEET_HEIGHT = 841.89
+SHEET_MARGIN = 28.35  # 10 mm
+SHEET_COLUMNS = 4
+MIN_SHEET_COLUMNS = 1
+MAX_SHEET_COLUMNS = 10
+LABEL_FONT_SIZE = 8
+LABEL_HEIGHT = 12
+HELVETICA_CHAR_WIDTH = 0.556  # Helvetica 數字寬度（字級的倍數），用來估計標籤寬度
+
+_executor = None
+_executor_pid = None
+_executor_lock = threading.Lock()
+
+def parse_batch_items(data=None, csv_text=None):
+    """解析批次內容，回傳 [(內容, 標籤)]
+
+    JSON：{"items": [{"content": "...", "label": "..."}, "只有內容", ...]}；
+    CSV：每列「內容,標籤」，第一列為 content 時視為標題列。
+    """
+    items = []
+    if csv_text is not None:
+        rows = csv.reader(io.StringIO(csv_text))
+        for index, row in enumerate(rows):
+            if not row or not any(cell.strip() for cell in row):
+                continue
+            if index == 0 and row[0].strip().lower() == 'content':
+                continue
+            items.append((row[0], row[1] if len(row) > 1 else ''))
+    else:
+        raw = (data or {}).get('items')
+        if not isinstance(raw, list):
+            raise ValueError('items 必須是陣列')
+        for item in raw:
+            if isinstance(item, dict):
+                items.append((str(item.get('content') or ''), str(item.get('label') or '')))
+            else:
+                items.append((str(item), ''))
+
+    if not items:
+        raise ValueError('請提供至少一筆內容')
+    if len(items) > QR_BATCH_MAX_ITEMS:
+        raise ValueError(f'一次最多 {QR_BATCH_MAX_ITEMS} 筆')
+    return [(content, label.strip()[:MAX_LABEL_LENGTH]) for content, label in items]
+
+def parse_batch_output(value):
+    output = str(value or 'zip').lower()
+    if output not in BATCH_OUTPUTS:
+        raise ValueError(f'不支援的輸出: {output}')
+    return output
+
+def parse_sheet_columns(value):
+    try:
+        columns = int(value or SHEET_COLUMNS)
+    except (TypeError, ValueError):
+        raise ValueError('欄數格式錯誤')
+    if not MIN_SHEET_COLUMNS <= columns <= MAX_SHEET_COLUMNS:
+        raise ValueError(f'欄數必須介於 {MIN_SHEET_COLUMNS} 到 {MAX_SHEET_COLUMNS}')
+    return columns
+
+def _get_executor(reset=False):
+    """取得產生 QR Code 的行程池（以 spawn 建立，避免在多執行緒的 worker 中 fork）"""
+    global _executor, _executor_pid
+    with _executor_lock:
+        if _executor is None or _executor_pid != os.getpid() or reset:
+            _executor = ProcessPoolExecutor(
+                max_workers=max(1, QR_BATCH_WORKERS),
+                mp_context=multiprocessing.get_context('spawn')
+            )
+            _executor_pid = os.getpid()
+        return _executor
+
+def _submit(contents, options, output):
+    try:
+        return _get_executor().submit(render_batch, contents, options, output)
+    except BrokenProcessPool:
+        # 行程異常結束（例如記憶體不足被終止），重建行程池
+        return _get_executor(reset=True).submit(render_batch, contents, options, output)
+
+def _render_ordered(items, options, output):
+    """依輸入順序產生 (序號, 內容, 標籤, 結果, 錯誤訊息)
+
+    數量不到一個工作時直接在本行程產生；否則分段送進行程池，
+    等待中的工作數有上限，先完成的段落依序輸出，記憶體維持固定。
+    """
+    if len(items) <= QR_BATCH_CHUNK:
+        results = render_batch([content for content, _ in items], options, output)
+        for index, ((content, label), (result, error)) in enumerate(zip(items, results)):
+            yield index, content, label, result, error
+        return
+
+    limit = max(1, QR_BATCH_WORKERS) * MAX_PENDING_PER_WORKER
+    pending = deque()
+    try:
+        for start in range(0, len(items), QR_BATCH_CHUNK):
+            chunk = items[start:start + QR_BATCH_CHUNK]
+            pending.append((start, chunk, _submit([content for content, _ in chunk], options, output)))
+            while len(pending) >= limit or (pending and pending[0][2].done()):
+                yield from _collect(*pending.popleft())
+        while pending:
+            yield from _collect(*pending.popleft())
+    finally:
+        # 客戶端中斷時取消尚未開始的工作
+        for _, _, future in pending:
+            future.cancel()
+
+def _collect(start, chunk, future):
+    for offset, ((content, label), (result, error)) in enumerate(zip(chunk, future.result())):
+        yield start + offset, content, label, result, error
+
+def _entry_name(index, label, fmt, used):
+    """壓縮檔內檔名：序號加上標籤（標籤可能是任意文字，需轉成安全檔名）"""
+    stem = f"{index + 1:05d}"
+    safe = secure_filename(label)
+    if safe:
+        stem += f"_{safe[:80]}"
+    name = f"{stem}.{fmt}"
+    counter = 2
+    while name in used:
+        name = f"{stem}_{counter}.{fmt}"
+        counter += 1
+    used.add(name)
+    return name
+
+def stream_qr_zip(items, options):
+    """產生 PNG／SVG 並逐一寫入串流 ZIP，無法產生的內容列在 errors.txt
+
+    圖片本身已壓縮，ZIP 以 STORED 儲存。
+    """
+    zip_stream = ZipStream()
+    used = set()
+    errors = []
+    for index, content, label, image, error in _render_ordered(items, options, 'zip'):
+        if error:
+            errors.append(f"{index + 1}: {error}")
+            continue
+        yield from zip_stream.add_bytes(image, _entry_name(index, label, options['format'], used))
+    if errors:
+        yield from zip_stream.add_bytes('\n'.join(errors).encode('utf-8'), 'errors.txt')
+    yield from zip_stream.close()
+
+def _pdf_text(text):
+    """PDF 字串常值（Helvetica 只有 WinAnsi 字元，其他字元以 ? 代替）"""
+    data = text.encode('cp1252', errors='replace')
+    return b'(' + data.replace(b'\\', b'\\\\').replace(b'(', b'\\(').replace(b')', b'\\)') + b')'
+
+def _label_ops(label, x, y, width):
+    """置中的標籤文字，超出格子寬度時截斷"""
+    max_chars = max(1, int(width / (LABEL_FONT_SIZE * HELVETICA_CHAR_WIDTH)))
+    if len(label) > max_chars:
+        label = label[:max_chars - 1] + '.'
+    text_width = len(label) * LABEL_FONT_SIZE * HELVETICA_CHAR_WIDTH
+    return b'BT /F1 %d Tf %.2f %.2f Td %s Tj ET' % (
+        LABEL_FONT_SIZE, x + (width - text_width) / 2, y, _pdf_text(label)
+    )
+
+def stream_qr_sheet(items, options, columns=SHEET_COLUMNS):
+    """把 QR Code 以向量圖形排成 A4 標籤頁，逐頁串流輸出 PDF
+
+    每個 QR Code 只是一段矩形填色指令，與解析度無關，印表機可以直接輸出。
+    邊框模組數沿用 border 選項作為格子內的留白。
+    """
+    labelled = any(label for _, label in items)
+    cell_width = (SHEET_WIDTH - 2 * SHEET_MARGIN) / columns
+    cell_height = cell_width + (LABEL_HEIGHT if labelled else 0)
+    rows = max(1, int((SHEET_HEIGHT - 2 * SHEET_MARGIN) / cell_height))
+    per_page = rows * columns
+
+    writer = PdfStreamWriter()
+    catalog = writer.reserve()
+    pages_root = writer.reserve()
+    font = writer.reserve()
+    writer.write_object(font, b'<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica /Encoding /WinAnsiEncoding >>')
+    page_numbers = []
+    errors = []
+    content = []
+
+    def flush_page():
+        data = zlib.compress(b'\n'.join(content))
+        content.clear()
+        stream_number = writer.reserve()
+        page_number = writer.reserve()
+        writer.write_object(stream_number, b'<< /Filter /FlateDecode /Length %d >>\nstream\n%s\nendstream' % (len(data), data), is_stream=True)
+        writer.write_object(page_number, (
+            b'<< /Type /Page /Parent %d 0 R /MediaBox [0 0 %.2f %.2f] '
+            b'/Resources << /Font << /F1 %d 0 R >> >> /Contents %d 0 R >>'
+        ) % (pages_root, SHEET_WIDTH, SHEET_HEIGHT, font, stream_number))
+        page_numbers.append(page_number)
+
+    placed = 0
+    for index, _, label, result, error in _render_ordered(items, options, 'pdf'):
+        if error:
+            errors.append(f"{index + 1}: {error}")
+            continue
+        slot = placed % per_page
+        if slot == 0 and placed:
+            flush_page()
+            yield writer.take()
+        placed += 1
+        modules, ops = result
+        x = SHEET_MARGIN + (slot % columns) * cell_width
+        top = SHEET_HEIGHT - SHEET_MARGIN - (slot // columns) * cell_height
+        scale = cell_width / (modules + 2 * options['border'])
+        offset = options['border'] * scale
+        # 模組座標 y 軸向下，以 cm 轉換到格子左上角
+        content.append(b'q %.4f 0 0 %.4f %.4f %.4f cm' % (scale, -scale, x + offset, top - offset))
+        content.append(ops)
+        content.append(b'Q')
+        if label:
+            content.append(_label_ops(label, x, top - cell_width - LABEL_FONT_SIZE, cell_width))
+
+    if errors:
+        # 錯誤清單放在最後一頁的底部邊界
+        message = 'Failed rows: ' + ', '.join(e.split(':')[0] for e in errors[:50])
+        content.append(b'BT /F1 %d Tf %.2f %.2f Td %s Tj ET' % (
+            LABEL_FONT_SIZE, SHEET_MARGIN, SHEET_MARGIN / 2, _pdf_text(message[:150])
+        ))
+    if content or not page_numbers:
+        flush_page()
+
+    writer.write_object(pages_root, b'<< /Type /Pages /Kids [%s] /Count %d >>' % (
+        b' '.join(b'%d 0 R' % number for number in page_numbers), len(page_numbers)
+    ))
+    writer.write_object(catalog, b'<< /Type /Catalog /Pages %d 0 R >>' % pages_root)
+    writer.finish(catalog)
+    yield writer.take()
+
+def batch_request_items(request):
+    """從請求取得批次內容與設定（JSON 本體，或表單的 csv 檔案／欄位）"""
+    if request.is_json:
+        data = request.get_json() or {}
+        return parse_batch_items(data), data
+    if 'csv' in request.files:
+        text = request.files['csv'].read().decode('utf-8-sig')
+    else:
+        text = request.form.get('csv', '')
+    return parse_batch_items(csv_text=text), request.form
@@ -0,0 +1,192 @@
+import os
+import hashlib
+import threading
+from collections import OrderedDict
+from io import BytesIO
+import qrcode
+from qrcode.exceptions import DataOverflowError
+from qrcode.constants import ERROR_CORRECT_L, ERROR_CORRECT_M, ERROR_CORRECT_Q, ERROR_CORRECT_H
+from PIL import Image
+import startup
+
+# QR Code 設定（可用環境變數調整）
+QR_CACHE_SIZE = int(os.environ.get('QR_CACHE_SIZE', '512'))  # 每個行程快取的圖片數
+QR_CACHE_MAX_AGE = int(os.environ.get('QR_CACHE_MAX_AGE', '86400'))  # 秒，瀏覽器與 CDN 快取時間
+
+QR_FORMATS = {'png': 'image/png', 'svg': 'image/svg+xml'}
+ERROR_CORRECTION = {'L': ERROR_CORRECT_L, 'M': ERROR_CORRECT_M, 'Q': ERROR_CORRECT_Q, 'H': ERROR_CORRECT_H}
+DEFAULT_BOX_SIZE = 10
+DEFAULT_BORDER = 4
+DEFAULT_ERROR_CORRECTION = 'H'
+MAX_BOX_SIZE = 40
+MAX_BORDER = 10
+MAX_CONTENT_LENGTH = 2953  # QR Code 最大容量（位元組模式、L 等級）
+
+class _LRUCache:
+    """執行緒安全的簡易 LRU 快取"""
+
+    def __init__(self, size):
+        self.size = max(1, size)
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            value = self._items.get(key)
+            if value is not None:
+                self._items.move_to_end(key)
+            return value
+
+    def put(self, key, value):
+        with self._lock:
+            self._items[key] = value
+            self._items.move_to_end(key)
+            while len(self._items) > self.size:
+                self._items.popitem(last=False)
+
+_matrix_cache = _LRUCache(QR_CACHE_SIZE)  # (內容, 錯誤修正等級) -> 模組矩陣
+_image_cache = _LRUCache(QR_CACHE_SIZE)  # (內容, 選項...) -> (圖片, ETag)
+
+def parse_qr_options(values):
+    """解析並檢查 QR Code 選項（JSON 或查詢參數）
+
+    format：png 或 svg；size：每個模組的像素數；border：邊框模組數；
+    error_correction：L、M、Q、H。
+    """
+    fmt = str(values.get('format') or 'png').lower()
+    if fmt not in QR_FORMATS:
+        raise ValueError(f'不支援的格式: {fmt}')
+    error_correction = str(values.get('error_correction') or DEFAULT_ERROR_CORRECTION).upper()
+    if error_correction not in ERROR_CORRECTION:
+        raise ValueError('錯誤修正等級必須是 L、M、Q 或 H')
+    try:
+        box_size = int(values.get('size') or DEFAULT_BOX_SIZE)
+        border = int(values.get('border') if values.get('border') not in (None, '') else DEFAULT_BORDER)
+    except (TypeError, ValueError):
+        raise ValueError('尺寸格式錯誤')
+    if not 1 <= box_size <= MAX_BOX_SIZE:
+        raise ValueError(f'尺寸必須介於 1 到 {MAX_BOX_SIZE}')
+    if not 0 <= border <= MAX_BORDER:
+        raise ValueError(f'邊框必須介於 0 到 {MAX_BORDER}')
+    return {'format': fmt, 'size': box_size, 'border': border, 'error_correction': error_correction}
+
+def build_matrix(content, error_correction=DEFAULT_ERROR_CORRECTION):
+    """計算 QR Code 模組矩陣（不含邊框）
+
+    version=None 讓 qrcode 直接以容量表找出最小版本，不必從版本 1 逐一嘗試。
+    """
+    key = (content, error_correction)
+    matrix = _matrix_cache.get(key)
+    if matrix is None:
+        qr = qrcode.QRCode(version=None, error_correction=ERROR_CORRECTION[error_correction], border=0)
+        qr.add_data(content)
+        try:
+            qr.make(fit=True)
+        except (DataOverflowError, ValueError):
+            # 超過版本 40 時 qrcode 拋出的是 ValueError('Invalid version ...')，不是 DataOverflowError
+            raise ValueError('內容過長，請降低錯誤修正等級或縮短內容')
+        matrix = tuple(bytes(0 if dark else 255 for dark in row) for row in qr.get_matrix())
+        _matrix_cache.put(key, matrix)
+    return matrix
+
+def render_png(matrix, box_size=DEFAULT_BOX_SIZE, border=DEFAULT_BORDER):
+    """以整張點陣圖放大的方式產生 PNG，不逐一繪製模組"""
+    modules = len(matrix)
+    total = modules + 2 * border
+    blank = b'\xff' * total
+    side = b'\xff' * border
+    rows = [blank] * border + [side + row + side for row in matrix] + [blank] * border
+    image = Image.frombytes('L', (total, total), b''.join(rows))
+    image = image.resize((total * box_size, total * box_size), Image.NEAREST).convert('1', dither=Image.Dither.NONE)
+    buffer = BytesIO()
+    image.save(buffer, format='PNG')
+    return buffer.getvalue()
+
+def render_svg(matrix, box_size=DEFAULT_BOX_SIZE, border=DEFAULT_BORDER):
+    """直接由矩陣產生 SVG 路徑（每列連續的深色模組合併為一段），不經過 PIL"""
+    total = len(matrix) + 2 * border
+    pixels = total * box_size
+    path = []
+    for y, row in enumerate(matrix):
+        x = 0
+        width = len(row)
+        while x < width:
+            if row[x]:
+                x += 1
+                continue
+            start = x
+            while x < width and not row[x]:
+                x += 1
+            path.append(f'M{start + border},{y + border}h{x - start}v1h-{x - start}z')
+    return (
+        f'<svg xmlns="http://www.w3.org/2000/svg" width="{pixels}" height="{pixels}" '
+        f'viewBox="0 0 {total} {total}" shape-rendering="crispEdges">'
+        f'<rect width="100%" height="100%" fill="#fff"/>'
+        f'<path fill="#000" d="{"".join(path)}"/></svg>'
+    ).encode('utf-8')
+
+def render_qr(content, options):
+    """依選項產生 QR Code 圖片位元組"""
+    matrix = build_matrix(content, options['error_correction'])
+    if options['format'] == 'svg':
+        return render_svg(matrix, options['size'], options['border'])
+    return render_png(matrix, options['size'], options['border'])
+
+def matrix_to_pdf_ops(matrix):
+    """把矩陣轉成 PDF 填色路徑（模組座標、y 軸向下，每列連續模組合併為一個矩形）"""
+    ops = []
+    for y, row in enumerate(matrix):
+        x = 0
+        width = len(row)
+        while x < width:
+            if row[x]:
+                x += 1
+                continue
+            start = x
+            while x < width and not row[x]:
+                x += 1
+            ops.append(b'%d %d %d 1 re' % (start, y, x - start))
+    ops.append(b'f')
+    return b'\n'.join(ops)
+
+def check_content(content):
+    if not content:
+        raise ValueError('請輸入內容')
+    if len(content.encode('utf-8')) > MAX_CONTENT_LENGTH:
+        raise ValueError(f'內容過長（最多 {MAX_CONTENT_LENGTH} 位元組）')
+
+def render_batch(contents, options, output):
+    """批次產生（在行程池中執行），回傳與輸入同順序的 [(結果, 錯誤訊息)]
+
+    output 為 'pdf' 時結果是 (模組數, PDF 路徑指令)，否則是圖片位元組。
+    """
+    results = []
+    for content in contents:
+        try:
+            check_content(content)
+            if output == 'pdf':
+                matrix = build_matrix(content, options['error_correction'])
+                results.append(((len(matrix), matrix_to_pdf_ops(matrix)), None))
+            else:
+                results.append((render_qr(content, options), None))
+        except ValueError as e:
+            results.append((None, str(e)))
+        except Exception as e:
+            print(f"[WARN] 產生 QR Code 失敗: {e}")
+            results.append((None, '產生失敗'))
+    return results
+
+def get_qr(content, options):
+    """取得 QR Code（先查 LRU 快取），回傳 (圖片位元組, MIME 類型, ETag)"""
+    check_content(content)
+    key = (content, options['format'], options['size'], options['border'], options['error_correction'])
+    cached = _image_cache.get(key)
+    if cached is None:
+        data = render_qr(content, options)
+        cached = (data, hashlib.sha1(data).hexdigest())
+        _image_cache.put(key, cached)
+    data, etag = cached
+    return data, QR_FORMATS[options['format']], etag
+
+# 第一次編碼時 qrcode 與 PIL 才載入編碼表與 PNG 外掛
+startup.register_warmup('qrcode', lambda: render_qr('warmup', parse_qr_options({})))
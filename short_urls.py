@@ -0,0 +1,199 @@
+import os
+import time
+import atexit
+import sqlite3
+import threading
+import urllib.parse
+import urllib.request
+from collections import Counter
+from functools import lru_cache
+from pathlib import Path
+
+# 短網址設定（可用環境變數調整）
+SHORT_URL_DB_PATH = Path(os.environ.get('SHORT_URL_DB_PATH', Path(__file__).parent / "short_urls.db"))
+SHORT_URL_BASE = os.environ.get('SHORT_URL_BASE', '')  # 對外網址（例如 https://example.com），空白時使用請求的主機
+SHORT_URL_PROVIDER = os.environ.get('SHORT_URL_PROVIDER', 'local')  # local / tinyurl（外部服務失敗時改用本地代碼）
+SHORT_URL_PROVIDER_API = os.environ.get('SHORT_URL_PROVIDER_API', 'https://tinyurl.com/api-create.php')  # TinyURL 相容的 API 位址
+SHORT_URL_PROVIDER_TIMEOUT = float(os.environ.get('SHORT_URL_PROVIDER_TIMEOUT', '3'))  # 秒
+SHORT_URL_CACHE_SIZE = int(os.environ.get('SHORT_URL_CACHE_SIZE', '10000'))  # 每個行程快取的代碼數
+SHORT_URL_FLUSH_INTERVAL = float(os.environ.get('SHORT_URL_FLUSH_INTERVAL', '10'))  # 秒，點擊次數寫入間隔
+
+MAX_URL_LENGTH = 2048
+BASE62 = '0123456789abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ'
+CODE_LENGTH = 7
+CODE_SPACE = 62 ** CODE_LENGTH
+# 以乘法打散流水號，代碼不會依序遞增（與 62 互質，乘法在 CODE_SPACE 內可逆）
+CODE_MULTIPLIER = 1580030173
+CODE_INVERSE = pow(CODE_MULTIPLIER, -1, CODE_SPACE)
+
+_hits = Counter()  # 代碼編號 -> 尚未寫入的點擊次數
+_hits_lock = threading.Lock()
+_flusher_pid = None
+
+class ShortUrlNotFound(Exception):
+    """短網址不存在"""
+
+def _connect():
+    """開啟短網址資料庫連線"""
+    conn = sqlite3.connect(str(SHORT_URL_DB_PATH), timeout=30, isolation_level=None)
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS urls (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            url TEXT NOT NULL UNIQUE,
+            external TEXT,
+            hits INTEGER NOT NULL DEFAULT 0,
+            created_at REAL NOT NULL,
+            last_hit REAL
+        )
+    ''')
+    return conn
+
+def encode_id(number):
+    """流水號轉成固定長度的 base62 代碼"""
+    value = number * CODE_MULTIPLIER % CODE_SPACE
+    chars = []
+    for _ in range(CODE_LENGTH):
+        value, remainder = divmod(value, 62)
+        chars.append(BASE62[remainder])
+    return ''.join(reversed(chars))
+
+def decode_code(code):
+    """代碼轉回流水號，格式錯誤時拋出 ShortUrlNotFound"""
+    if len(code) != CODE_LENGTH:
+        raise ShortUrlNotFound(code)
+    value = 0
+    for char in code:
+        index = BASE62.find(char)
+        if index < 0:
+            raise ShortUrlNotFound(code)
+        value = value * 62 + index
+    return value * CODE_INVERSE % CODE_SPACE
+
+def normalize_url(url):
+    """檢查並整理要縮短的網址（只接受 http／https）"""
+    url = (url or '').strip()
+    if not url:
+        raise ValueError('請輸入網址')
+    if '://' not in url:
+        # 省略通訊協定的網址補上 https（冒號後接數字的是連接埠，例如 example.com:8080）
+        rest = url.partition(':')[2]
+        if rest and not rest[:1].isdigit():
+            raise ValueError('只支援 http 或 https 網址')
+        url = 'https://' + url
+    if len(url) > MAX_URL_LENGTH:
+        raise ValueError(f'網址過長（最多 {MAX_URL_LENGTH} 字元）')
+    parsed = urllib.parse.urlsplit(url)
+    if parsed.scheme.lower() not in ('http', 'https') or not parsed.netloc:
+        raise ValueError('只支援 http 或 https 網址')
+    return url
+
+def _external_short_url(url):
+    """向 TinyURL 取得短網址，失敗時回傳 None"""
+    api_url = f"{SHORT_URL_PROVIDER_API}?url={urllib.parse.quote(url, safe='')}"
+    try:
+        with urllib.request.urlopen(api_url, timeout=SHORT_URL_PROVIDER_TIMEOUT) as response:
+            short_url = response.read().decode('utf-8').strip()
+    except Exception as e:
+        print(f"[WARN] TinyURL 失敗，改用本地短網址: {e}")
+        return None
+    return short_url if short_url.startswith('http') else None
+
+def shorten(url, base_url):
+    """取得網址的短網址（相同網址共用同一個代碼），回傳 (短網址, 代碼)
+
+    SHORT_URL_PROVIDER 為 tinyurl 時優先使用外部服務，結果存在資料庫中，
+    同一網址之後不再呼叫外部服務。
+    """
+    url = normalize_url(url)
+    conn = _connect()
+    try:
+        conn.execute('INSERT OR IGNORE INTO urls (url, created_at) VALUES (?, ?)', (url, time.time()))
+        number, external = conn.execute('SELECT id, external FROM urls WHERE url = ?', (url,)).fetchone()
+        if SHORT_URL_PROVIDER == 'tinyurl' and external is None:
+            external = _external_short_url(url)
+            if external:
+                conn.execute('UPDATE urls SET external = ? WHERE id = ?', (external, number))
+    finally:
+        conn.close()
+
+    code = encode_id(number)
+    if SHORT_URL_PROVIDER == 'tinyurl' and external:
+        return external, code
+    return f"{(SHORT_URL_BASE or base_url).rstrip('/')}/s/{code}", code
+
+@lru_cache(maxsize=SHORT_URL_CACHE_SIZE)
+def _lookup(number):
+    """代碼編號對應的網址（建立後不會改變，可以長期快取；不存在時不會被快取）"""
+    conn = _connect()
+    try:
+        row = conn.execute('SELECT url FROM urls WHERE id = ?', (number,)).fetchone()
+    finally:
+        conn.close()
+    if row is None:
+        raise ShortUrlNotFound(number)
+    return row[0]
+
+def resolve(code):
+    """取得代碼對應的網址並記錄點擊，不存在時拋出 ShortUrlNotFound"""
+    number = decode_code(code)
+    url = _lookup(number)
+    _record_hit(number)
+    return url
+
+def _record_hit(number):
+    """點擊次數先累積在記憶體，由背景執行緒定期批次寫入"""
+    global _flusher_pid
+    with _hits_lock:
+        _hits[number] += 1
+        if _flusher_pid != os.getpid():
+            # 每個 worker 行程各自啟動一次
+            _flusher_pid = os.getpid()
+            threading.Thread(target=_flush_loop, daemon=True, name='short-url-hits').start()
+
+def _flush_loop():
+    while True:
+        time.sleep(SHORT_URL_FLUSH_INTERVAL)
+        flush_hits()
+
+def flush_hits():
+    """把累積的點擊次數寫入資料庫"""
+    with _hits_lock:
+        if not _hits:
+            return
+        pending = list(_hits.items())
+        _hits.clear()
+    now = time.time()
+    try:
+        conn = _connect()
+        try:
+            with conn:
+                conn.execute('BEGIN')
+                conn.executemany(
+                    'UPDATE urls SET hits = hits + ?, last_hit = ? WHERE id = ?',
+                    [(count, now, number) for number, count in pending]
+                )
+        finally:
+            conn.close()
+    except sqlite3.Error as e:
+        # 寫入失敗時放回計數，下次再試
+        with _hits_lock:
+            _hits.update(dict(pending))
+        print(f"[WARN] 無法寫入短網址點擊次數: {e}")
+
+def url_stats(code):
+    """短網址資訊（含尚未寫入的點擊次數）"""
+    number = decode_code(code)
+    conn = _connect()
+    try:
+        row = conn.execute('SELECT url, hits, created_at, last_hit FROM urls WHERE id = ?', (number,)).fetchone()
+    finally:
+        conn.close()
+    if row is None:
+        raise ShortUrlNotFound(code)
+    with _hits_lock:
+        pending = _hits.get(number, 0)
+    url, hits, created_at, last_hit = row
+    return {'code': code, 'url': url, 'hits': hits + pending, 'created_at': created_at, 'last_hit': last_hit}
+
+atexit.register(flush_hits)
@@ -0,0 +1,179 @@
+"""啟動與預熱：量測載入耗時、在 fork 前預先載入共用模組、提供 /readyz
+
+在 gunicorn 下（gunicorn.conf.py）：
+- PRELOAD_APP=1 時 master 載入應用程式並執行共用的預熱步驟，之後凍結 GC 再 fork，
+  worker 以寫入時複製共用這些模組與已編譯的資料，不必各自載入一份。
+- worker 啟動後在背景執行各行程自己的步驟（背景清理、去背模型等），完成後 /readyz 才回傳 200。
+未使用 gunicorn.conf.py 時（python app.py 或其他 WSGI 伺服器），載入應用程式後直接在背景預熱。
+
+量測各模組載入耗時：python -m startup
+"""
+import gc
+import os
+import time
+import threading
+import metrics
+
+IMPORT_STARTED = time.perf_counter()  # app.py 最先匯入本模組，以此計算載入應用程式的耗時（未 preload 時於 fork 後重設）
+
+# 啟動設定（可用環境變數調整）
+WARMUP = os.environ.get('WARMUP', '1') == '1'  # 啟動時預先載入 yt-dlp 擷取器、QR Code 編碼等共用資料
+
+_steps = []  # (名稱, 函式, per_process)
+_shared_timings = None  # 共用步驟的耗時（在 master 預熱時由 worker 繼承）
+_hooked = False  # 由 gunicorn.conf.py 設定，改由 gunicorn 掛鉤啟動 worker
+_master_pid = None
+_worker_pid = None
+_worker_lock = threading.Lock()
+_state = {'ready': False, 'import_seconds': None, 'warmup': {}, 'errors': {}}
+
+def register_warmup(name, warm, per_process=False):
+    """登記預熱步驟
+
+    共用步驟（per_process=False）只載入模組或建立唯讀資料，可在 fork 前執行；
+    per_process=True 的步驟會啟動執行緒或建立無法跨 fork 的資源，每個 worker 各執行一次。
+    """
+    _steps.append((name, warm, per_process))
+
+def _run_steps(per_process):
+    timings = {}
+    for name, warm, step_per_process in _steps:
+        if step_per_process != per_process:
+            continue
+        started = time.perf_counter()
+        try:
+            warm()
+        except Exception as e:
+            # 預熱失敗不影響服務，第一個請求會再試一次
+            _state['errors'][name] = str(e)
+            print(f"[WARN] 預熱 {name} 失敗: {e}")
+        timings[name] = round(time.perf_counter() - started, 3)
+    return timings
+
+def warm_shared():
+    """執行共用的預熱步驟（每個行程一次，fork 後的 worker 直接沿用）"""
+    global _shared_timings
+    if _shared_timings is None:
+        _shared_timings = _run_steps(per_process=False) if WARMUP else {}
+    return _shared_timings
+
+def use_gunicorn_hooks():
+    """由 gunicorn.conf.py 在 master 呼叫：worker 改由 post_worker_init 啟動"""
+    global _hooked, _master_pid
+    _hooked = True
+    _master_pid = os.getpid()
+
+def after_fork():
+    """由 gunicorn 在 worker fork 後呼叫：未 preload 時 worker 才載入應用程式，從此刻起算載入耗時
+
+    gunicorn.conf.py 在 master 就匯入了本模組，不重設的話會把 master 等待 fork 的時間也算進去。
+    """
+    global IMPORT_STARTED
+    if _state['import_seconds'] is None:
+        IMPORT_STARTED = time.perf_counter()
+
+def before_fork():
+    """fork 前把目前的物件移出 GC 追蹤，避免 worker 執行 GC 時寫入共用的記憶體頁"""
+    gc.collect()
+    gc.freeze()
+
+def _start():
+    started = time.perf_counter()
+    warmup = dict(warm_shared())
+    warmup.update(_run_steps(per_process=True))
+    _state['warmup'] = warmup
+    _state['ready'] = True
+    print(f"[INFO] worker {os.getpid()} 已就緒：載入 {_state['import_seconds']:.2f} 秒，"
+          f"預熱 {time.perf_counter() - started:.2f} 秒")
+
+def start_worker():
+    """在背景執行預熱與各行程的啟動步驟（每個行程一次）"""
+    global _worker_pid
+    with _worker_lock:
+        if _worker_pid == os.getpid():
+            return
+        _worker_pid = os.getpid()
+        _state['ready'] = False
+    threading.Thread(target=_start, daemon=True, name='warmup').start()
+
+def is_ready():
+    if _worker_pid != os.getpid():
+        # 以其他方式 fork（未使用 gunicorn.conf.py 的 --preload）時在此補啟動
+        start_worker()
+        return False
+    return _state['ready']
+
+def init_app(app):
+    """記錄載入耗時、加上 /readyz，並依執行方式安排預熱"""
+    from flask import jsonify
+
+    _state['import_seconds'] = round(time.perf_counter() - IMPORT_STARTED, 3)
+
+    @app.route('/readyz')
+    def readyz():
+        """就緒檢查：預熱完成前回傳 503"""
+        ready = is_ready()
+        body = dict(_state, ready=ready, pid=os.getpid())
+        return jsonify(body), 200 if ready else 503
+
+    if _hooked and os.getpid() == _master_pid:
+        # gunicorn preload：在 master 預熱，worker fork 後共用
+        started = time.perf_counter()
+        warm_shared()
+        print(f"[INFO] 已在 master 預熱：載入 {_state['import_seconds']:.2f} 秒，"
+              f"預熱 {time.perf_counter() - started:.2f} 秒")
+    elif not _hooked:
+        start_worker()
+
+metrics.register_collector(
+    'anymusic_workers_ready', '已完成預熱的 worker 數',
+    lambda: 1 if _worker_pid == os.getpid() and _state['ready'] else 0, scope='process'
+)
+
+# ============ 載入耗時量測 ============
+
+# 依賴套件（依載入順序），未安裝的選用套件會標示為略過
+DEPENDENCIES = ('flask', 'yt_dlp', 'PyPDF2', 'pypdfium2', 'PIL.Image', 'qrcode', 'rembg')
+
+def _max_rss_mb():
+    try:
+        import resource
+    except ImportError:  # Windows 沒有 resource
+        return None
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+def measure_imports(names):
+    """依序載入模組，回傳 [(名稱, 秒數, RSS 增加 MB 或錯誤訊息)]（已載入的相依模組不重複計算）"""
+    import importlib
+
+    results = []
+    for name in names:
+        rss = _max_rss_mb()
+        started = time.perf_counter()
+        try:
+            importlib.import_module(name)
+        except ImportError as e:
+            results.append((name, None, str(e)))
+            continue
+        elapsed = time.perf_counter() - started
+        grown = _max_rss_mb()
+        results.append((name, elapsed, None if rss is None else round(grown - rss, 1)))
+    return results
+
+def main():
+    import startup  # 以 python -m 執行時本檔是 __main__，app 匯入的是另一份模組
+    startup._hooked = True  # 只量測，不啟動背景清理等工作
+    print(f"{'模組':<24}{'秒數':>8}{'RSS +MB':>10}")
+    total = 0.0
+    for name, seconds, detail in measure_imports(DEPENDENCIES + ('app',)):
+        if seconds is None:
+            print(f"{name:<24}{'略過':>8}  {detail}")
+            continue
+        total += seconds
+        print(f"{name:<24}{seconds:>8.3f}{detail if detail is not None else '-':>10}")
+    print(f"{'合計':<24}{total:>8.3f}")
+    for name, seconds in startup.warm_shared().items():
+        print(f"{'預熱 ' + name:<24}{seconds:>8.3f}")
+
+if __name__ == '__main__':
+    main()
@@ -13,6 +13,14 @@ const pdfStatus = document.getElementById('pdf-status');
 // Tool cards
 const toolCards = document.querySelectorAll('.tool-card');
 
+// Output optimization
+const pdfOptimize = document.getElementById('pdf-optimize');
+const pdfImageDpi = document.getElementById('pdf-image-dpi');
+
+pdfOptimize.addEventListener('change', () => {
+    pdfImageDpi.disabled = !pdfOptimize.checked;
+});
+
 // State
 let currentTool = null;
 let selectedFiles = [];
@@ -57,6 +65,7 @@ function showToolPanel(tool) {
 // Hide tool panel
 function hideToolPanel() {
     currentTool = null;
+    stopThumbnails();
     toolGrid.classList.remove('hidden');
     toolPanel.classList.add('hidden');
     selectedFiles = [];
@@ -137,6 +146,7 @@ mergeBtn.addEventListener('click', async () => {
     try {
         const formData = new FormData();
         selectedFiles.forEach(file => formData.append('pdfs', file));
+        appendOptimizeOptions(formData);
 
         const response = await fetch('/api/pdf/merge', {
             method: 'POST',
@@ -194,6 +204,7 @@ function handleSplitFile(file) {
     splitUpload.querySelector('p').textContent = file.name;
     splitOptions.classList.remove('hidden');
     splitBtn.disabled = false;
+    showThumbnails(file, document.getElementById('split-thumbnails'), splitPages);
 }
 
 splitBtn.addEventListener('click', async () => {
@@ -202,14 +213,7 @@ splitBtn.addEventListener('click', async () => {
     showProgress('處理中...');
 
     try {
-        const formData = new FormData();
-        formData.append('pdf', selectedFiles[0]);
-        formData.append('pages', splitPages.value);
-
-        const response = await fetch('/api/pdf/split', {
-            method: 'POST',
-            body: formData
-        });
+        const response = await postPdfOperation('/api/pdf/split', selectedFiles[0], { pages: splitPages.value });
 
         if (!response.ok) {
             const data = await response.json();
@@ -263,6 +267,7 @@ function handleRotateFile(file) {
     rotateUpload.querySelector('p').textContent = file.name;
     rotateOptions.classList.remove('hidden');
     rotateBtn.disabled = false;
+    showThumbnails(file, document.getElementById('rotate-thumbnails'), rotatePages);
 }
 
 rotationBtns.forEach(btn => {
@@ -279,14 +284,9 @@ rotateBtn.addEventListener('click', async () => {
     showProgress('旋轉中...');
 
     try {
-        const formData = new FormData();
-        formData.append('pdf', selectedFiles[0]);
-        formData.append('rotation', selectedRotation);
-        formData.append('pages', rotatePages.value || 'all');
-
-        const response = await fetch('/api/pdf/rotate', {
-            method: 'POST',
-            body: formData
+        const response = await postPdfOperation('/api/pdf/rotate', selectedFiles[0], {
+            rotation: selectedRotation,
+            pages: rotatePages.value || 'all'
         });
 
         if (!response.ok) {
@@ -340,6 +340,7 @@ function handleDeleteFile(file) {
     deleteUpload.querySelector('p').textContent = file.name;
     deleteOptions.classList.remove('hidden');
     deleteBtn.disabled = false;
+    showThumbnails(file, document.getElementById('delete-thumbnails'), deletePages);
 }
 
 deleteBtn.addEventListener('click', async () => {
@@ -351,14 +352,7 @@ deleteBtn.addEventListener('click', async () => {
     showProgress('刪除中...');
 
     try {
-        const formData = new FormData();
-        formData.append('pdf', selectedFiles[0]);
-        formData.append('pages', deletePages.value);
-
-        const response = await fetch('/api/pdf/delete', {
-            method: 'POST',
-            body: formData
-        });
+        const response = await postPdfOperation('/api/pdf/delete', selectedFiles[0], { pages: deletePages.value });
 
         if (!response.ok) {
             const data = await response.json();
@@ -374,7 +368,127 @@ deleteBtn.addEventListener('click', async () => {
     }
 });
 
+// ========== Page Thumbnails ==========
+const THUMBNAIL_WIDTH = 120;
+let thumbnailSource = null;
+
+function stopThumbnails() {
+    if (thumbnailSource) {
+        thumbnailSource.close();
+        thumbnailSource = null;
+    }
+}
+
+// 點選縮圖時把頁碼加入／移出輸入框
+function togglePageInInput(input, page) {
+    const parts = input.value.split(',').map(p => p.trim()).filter(p => p);
+    const index = parts.indexOf(String(page));
+    if (index >= 0) {
+        parts.splice(index, 1);
+    } else {
+        parts.push(String(page));
+    }
+    input.value = parts.join(', ');
+}
+
+async function showThumbnails(file, strip, pagesInput) {
+    stopThumbnails();
+    strip.innerHTML = '';
+
+    let sessionId;
+    let info;
+    try {
+        sessionId = await getPdfSession(file);
+        info = await (await fetch(`/api/pdf/sessions/${sessionId}`)).json();
+    } catch (error) {
+        showError(error.message);
+        return;
+    }
+
+    // 先建立所有頁面的位置，縮圖完成後依序填入
+    const items = [];
+    for (let page = 1; page <= info.pages; page++) {
+        const item = document.createElement('div');
+        item.className = 'thumbnail-item';
+        item.innerHTML = `<span>${page}</span>`;
+        item.addEventListener('click', () => {
+            item.classList.toggle('selected');
+            togglePageInInput(pagesInput, page);
+        });
+        strip.appendChild(item);
+        items.push(item);
+    }
+
+    const source = new EventSource(`/api/pdf/sessions/${sessionId}/thumbnails?width=${THUMBNAIL_WIDTH}`);
+    thumbnailSource = source;
+    source.onmessage = (event) => {
+        const data = JSON.parse(event.data);
+        if (data.status) {
+            stopThumbnails();
+            return;
+        }
+        data.pages.forEach(page => {
+            const img = document.createElement('img');
+            img.loading = 'lazy';
+            img.alt = `第 ${page} 頁`;
+            img.src = `/api/pdf/sessions/${sessionId}/thumbnails/${page}?width=${data.width}`;
+            items[page - 1].prepend(img);
+        });
+    };
+    source.onerror = () => stopThumbnails();
+}
+
 // ========== Helpers ==========
+function appendOptimizeOptions(formData) {
+    if (!pdfOptimize.checked) return;
+    formData.append('optimize', '1');
+    if (pdfImageDpi.value) {
+        formData.append('image_dpi', pdfImageDpi.value);
+    }
+}
+
+// 已建立的文件工作階段：同一個檔案只上傳一次，之後的操作以 session 引用
+const pdfSessions = new WeakMap();
+
+async function getPdfSession(file) {
+    if (!pdfSessions.has(file)) {
+        const formData = new FormData();
+        formData.append('pdf', file);
+
+        const response = await fetch('/api/pdf/sessions', {
+            method: 'POST',
+            body: formData
+        });
+        const data = await response.json();
+        if (!response.ok) {
+            throw new Error(data.error || '上傳失敗');
+        }
+        pdfSessions.set(file, data.session_id);
+    }
+    return pdfSessions.get(file);
+}
+
+async function postPdfOperation(url, file, fields) {
+    const send = async () => {
+        const formData = new FormData();
+        formData.append('session', await getPdfSession(file));
+        Object.entries(fields).forEach(([key, value]) => formData.append(key, value));
+        appendOptimizeOptions(formData);
+        return fetch(url, {
+            method: 'POST',
+            body: formData
+        });
+    };
+
+    const response = await send();
+    if (response.status === 404) {
+        // 工作階段已過期，重新上傳一次
+        pdfSessions.delete(file);
+        return send();
+    }
+    return response;
+}
+
 async function downloadResponse(response, filename) {
     const blob = await response.blob();
     const url = URL.createObjectURL(blob);
@@ -14,6 +14,7 @@ const errorMessage = document.getElementById('error-message');
 // State
 let currentTaskId = null;
 let pollInterval = null;
+let progressSource = null;
 
 // Event Listeners
 downloadBtn.addEventListener('click', startDownload);
@@ -55,7 +56,7 @@ async function startDownload() {
         }
 
         currentTaskId = data.task_id;
-        startPolling();
+        startProgressStream();
 
     } catch (error) {
         hideProgress();
@@ -64,6 +65,35 @@ async function startDownload() {
     }
 }
 
+// Subscribe to server-pushed progress (falls back to polling)
+function startProgressStream() {
+    stopProgressStream();
+
+    if (!window.EventSource) {
+        startPolling();
+        return;
+    }
+
+    progressSource = new EventSource(`/api/progress/${currentTaskId}/stream`);
+    progressSource.onmessage = (event) => {
+        const data = JSON.parse(event.data);
+        updateProgress(data);
+
+        if (['completed', 'error', 'cancelled', 'not_found'].includes(data.status)) {
+            stopProgressStream();
+        }
+    };
+    // EventSource reconnects automatically after dropped connections
+}
+
+function stopProgressStream() {
+    if (progressSource) {
+        progressSource.close();
+        progressSource = null;
+    }
+    stopPolling();
+}
+
 // Poll for progress
 function startPolling() {
     if (pollInterval) {
@@ -77,7 +107,7 @@ function startPolling() {
 
             updateProgress(data);
 
-            if (data.status === 'completed' || data.status === 'error') {
+            if (['completed', 'error', 'cancelled', 'not_found'].includes(data.status)) {
                 stopPolling();
             }
 
@@ -97,14 +127,23 @@ function stopPolling() {
 // Update progress UI
 function updateProgress(data) {
     const statusMessages = {
+        'queued': '排隊中...',
         'starting': '準備中...',
         'downloading': '下載中...',
         'converting': '轉換為 MP3...',
         'completed': '下載完成！',
-        'error': '發生錯誤'
+        'error': '發生錯誤',
+        'cancelled': '已取消'
     };
 
     progressStatus.textContent = statusMessages[data.status] || data.status;
+    if (data.status === 'queued' && data.queue_position) {
+        progressStatus.textContent = `排隊中... 前面還有 ${data.queue_position - 1} 個任務`;
+    }
+    if (data.status === 'downloading' && data.entries) {
+        const done = data.entries.filter(e => ['completed', 'error'].includes(e.status)).length;
+        progressStatus.textContent = `下載中... 已完成 ${done}/${data.entries.length}`;
+    }
     progressPercent.textContent = `${Math.round(data.progress || 0)}%`;
     progressFill.style.width = `${data.progress || 0}%`;
 
@@ -112,19 +151,28 @@ function updateProgress(data) {
         progressTitle.textContent = data.title;
     }
 
+    // Playlist entries become available one by one while the rest download
+    if (data.status === 'downloading' && data.files && data.files.length > 0) {
+        showResults(data.files);
+    }
+
     if (data.status === 'completed') {
         hideProgress();
         setButtonLoading(false);
-        showResults(data.files);
+        showResults(data.files, currentTaskId);
     } else if (data.status === 'error') {
         hideProgress();
         setButtonLoading(false);
         showError(data.error || '下載失敗');
+    } else if (data.status === 'cancelled') {
+        hideProgress();
+        setButtonLoading(false);
+        showError('下載已取消');
     }
 }
 
-// Show results
-function showResults(files) {
+// Show results (taskId is set once the whole task has completed)
+function showResults(files, taskId) {
     fileList.innerHTML = '';
 
     if (!files || files.length === 0) {
@@ -158,6 +206,15 @@ function showResults(files) {
         fileList.appendChild(item);
     });
 
+    // Playlists can be fetched as a single resumable ZIP
+    if (taskId && files.length > 1) {
+        const zipLink = document.createElement('a');
+        zipLink.href = `/api/downloads/zip?task_id=${encodeURIComponent(taskId)}`;
+        zipLink.className = 'download-all-link';
+        zipLink.textContent = `全部下載（ZIP，${files.length} 首）`;
+        fileList.appendChild(zipLink);
+    }
+
     resultsSection.classList.remove('hidden');
 }
 
@@ -217,6 +274,7 @@ const startMinInput = document.getElementById('start-min');
 const startSecInput = document.getElementById('start-sec');
 const endMinInput = document.getElementById('end-min');
 const endSecInput = document.getElementById('end-sec');
+const trimExactInput = document.getElementById('trim-exact');
 const trimBtn = document.getElementById('trim-btn');
 const trimProgress = document.getElementById('trim-progress');
 const trimProgressFill = document.getElementById('trim-progress-fill');
@@ -349,8 +407,8 @@ trimBtn.addEventListener('click', async () => {
         return;
     }
 
-    const startTime = parseInt(startMinInput.value || 0) * 60 + parseInt(startSecInput.value || 0);
-    const endTime = parseInt(endMinInput.value || 0) * 60 + parseInt(endSecInput.value || 0);
+    const startTime = parseInt(startMinInput.value || 0) * 60 + parseFloat(startSecInput.value || 0);
+    const endTime = parseInt(endMinInput.value || 0) * 60 + parseFloat(endSecInput.value || 0);
 
     if (startTime >= endTime) {
         showError('開始時間必須小於結束時間');
@@ -369,18 +427,37 @@ trimBtn.addEventListener('click', async () => {
     trimBtn.disabled = true;
 
     try {
-        const formData = new FormData();
-        formData.append('audio', audioFile);
-        formData.append('start_time', startTime);
-        formData.append('end_time', endTime);
+        // Send the raw file so the server can pipe it straight into FFmpeg
+        const params = new URLSearchParams({
+            filename: audioFile.name,
+            start_time: startTime,
+            end_time: endTime
+        });
 
         trimProgressFill.style.width = '30%';
         trimStatus.textContent = '處理中...';
 
-        const response = await fetch('/api/trim', {
-            method: 'POST',
-            body: formData
-        });
+        let response;
+        if (trimExactInput && trimExactInput.checked) {
+            // Exact cuts re-encode the boundaries, which needs the whole file server-side
+            const formData = new FormData();
+            formData.append('audio', audioFile);
+            formData.append('start_time', startTime);
+            formData.append('end_time', endTime);
+            formData.append('mode', 'exact');
+            response = await fetch('/api/trim', {
+                method: 'POST',
+                body: formData
+            });
+        } else {
+            response = await fetch(`/api/trim/stream?${params}`, {
+                method: 'POST',
+                headers: {
+                    'Content-Type': audioFile.type || 'application/octet-stream'
+                },
+                body: audioFile
+            });
+        }
 
         if (!response.ok) {
             const data = await response.json();
@@ -453,6 +530,7 @@ const convertStatus = document.getElementById('convert-status');
 
 // Converter state
 let convertFile = null;
+let convertBatch = [];
 
 // Only initialize if elements exist
 if (convertUploadArea) {
@@ -476,14 +554,14 @@ if (convertUploadArea) {
         convertUploadArea.classList.remove('dragover');
         const files = e.dataTransfer.files;
         if (files.length > 0) {
-            handleConvertFile(files[0]);
+            handleConvertFiles(files);
         }
     });
 
     // File input change
     convertFileInput.addEventListener('change', (e) => {
         if (e.target.files.length > 0) {
-            handleConvertFile(e.target.files[0]);
+            handleConvertFiles(e.target.files);
         }
     });
 
@@ -491,9 +569,28 @@ if (convertUploadArea) {
     convertBtn.addEventListener('click', startConversion);
 }
 
+// Handle one or more selected files
+function handleConvertFiles(files) {
+    if (files.length === 1) {
+        handleConvertFile(files[0]);
+        return;
+    }
+
+    convertFile = null;
+    convertBatch = Array.from(files);
+    convertName.textContent = `${convertBatch.length} 個檔案`;
+
+    const totalBytes = convertBatch.reduce((sum, f) => sum + f.size, 0);
+    convertSize.textContent = `${(totalBytes / (1024 * 1024)).toFixed(2)} MB`;
+
+    convertUploadArea.style.display = 'none';
+    convertControls.classList.remove('hidden');
+}
+
 // Handle convert file
 function handleConvertFile(file) {
     convertFile = file;
+    convertBatch = [];
     convertName.textContent = file.name;
 
     // Format file size
@@ -507,6 +604,11 @@ function handleConvertFile(file) {
 
 // Start conversion
 async function startConversion() {
+    if (convertBatch.length > 1) {
+        startBatchConversion();
+        return;
+    }
+
     if (!convertFile) {
         showError('請先上傳音訊檔案');
         return;
@@ -523,16 +625,21 @@ async function startConversion() {
     convertBtn.disabled = true;
 
     try {
-        const formData = new FormData();
-        formData.append('audio', convertFile);
-        formData.append('bitrate', bitrate);
+        // Send the raw file so the server can pipe it straight into FFmpeg
+        const params = new URLSearchParams({
+            filename: convertFile.name,
+            bitrate: bitrate
+        });
 
         convertProgressFill.style.width = '30%';
         convertStatus.textContent = '轉換中...';
 
-        const response = await fetch('/api/convert-to-mp3', {
+        const response = await fetch(`/api/convert-to-mp3/stream?${params}`, {
             method: 'POST',
-            body: formData
+            headers: {
+                'Content-Type': 'application/octet-stream'
+            },
+            body: convertFile
         });
 
         if (!response.ok) {
@@ -575,9 +682,61 @@ async function startConversion() {
     }
 }
 
+// Convert several files at once; the server streams back a zip
+async function startBatchConversion() {
+    const bitrateInput = document.querySelector('input[name="bitrate"]:checked');
+    const bitrate = bitrateInput ? bitrateInput.value : '192';
+
+    convertProgress.classList.remove('hidden');
+    convertProgressFill.style.width = '30%';
+    convertStatus.textContent = `轉換 ${convertBatch.length} 個檔案中...`;
+    convertBtn.disabled = true;
+
+    try {
+        const formData = new FormData();
+        convertBatch.forEach(file => formData.append('audio', file));
+        formData.append('targets', `mp3:${bitrate}`);
+
+        const response = await fetch('/api/convert/batch', {
+            method: 'POST',
+            body: formData
+        });
+
+        if (!response.ok) {
+            const data = await response.json();
+            throw new Error(data.error || '轉換失敗');
+        }
+
+        const blob = await response.blob();
+        const url = URL.createObjectURL(blob);
+        const a = document.createElement('a');
+        a.href = url;
+        a.download = 'converted.zip';
+        document.body.appendChild(a);
+        a.click();
+        document.body.removeChild(a);
+        URL.revokeObjectURL(url);
+
+        convertProgressFill.style.width = '100%';
+        convertStatus.textContent = '轉換完成！';
+
+        setTimeout(() => {
+            convertProgress.classList.add('hidden');
+            resetConverter();
+        }, 2000);
+
+    } catch (error) {
+        showError(error.message);
+        convertProgress.classList.add('hidden');
+    } finally {
+        convertBtn.disabled = false;
+    }
+}
+
 // Reset converter
 function resetConverter() {
     convertFile = null;
+    convertBatch = [];
     if (convertUploadArea) {
         convertUploadArea.style.display = 'flex';
     }
@@ -0,0 +1,306 @@
+import os
+import time
+import sqlite3
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+from flask import send_file
+import metrics
+import startup
+
+try:
+    import fcntl
+except ImportError:  # Windows 沒有 fcntl，每個行程各自清理
+    fcntl = None
+
+# 暫存與下載空間設定（可用環境變數調整）
+TEMP_DIR = Path(os.environ.get('TEMP_DIR', Path(__file__).parent / "temp"))
+DOWNLOAD_DIR = Path(os.environ.get('DOWNLOAD_DIR', Path(__file__).parent / "downloads"))
+TEMP_TTL = int(os.environ.get('TEMP_TTL', '3600'))  # 秒，未登記的暫存檔最後修改後保留多久
+TEMP_MAX_BYTES = int(os.environ.get('TEMP_MAX_BYTES', str(2 * 1024 * 1024 * 1024)))  # 預設 2GB
+DOWNLOAD_TTL = int(os.environ.get('DOWNLOAD_TTL', str(7 * 24 * 3600)))  # 秒，下載檔最後使用後保留多久（0 表示不限）
+# 下載目錄的容量上限由 download_cache（DOWNLOAD_CACHE_MAX_BYTES）依最久未使用淘汰，這裡只處理過期
+SCRATCH_DIR = os.environ.get('SCRATCH_DIR', '')  # 小型工作的記憶體暫存目錄（例如 /dev/shm），空白表示不使用
+SCRATCH_MAX_BYTES = int(os.environ.get('SCRATCH_MAX_BYTES', str(32 * 1024 * 1024)))  # 超過此大小的工作改用 TEMP_DIR
+REAPER_INTERVAL = int(os.environ.get('REAPER_INTERVAL', '300'))  # 秒
+STORAGE_DB_PATH = Path(os.environ.get('STORAGE_DB_PATH', Path(__file__).parent / "storage.db"))
+MIN_AGE = 60  # 秒，剛寫入的檔案（可能仍在使用中）不會因容量不足被刪除
+PARTIAL_SUFFIXES = ('.part', '.ytdl')  # 下載中的檔案，不會因容量不足被刪除（放棄的下載仍會過期）
+
+# 由其他模組自行管理的子目錄（有各自的過期規則）
+MANAGED_SUBDIRS = ('pdf_sessions', 'metrics')
+
+_reaper_pid = None
+_reaper_lock = threading.Lock()
+
+def _connect():
+    """開啟暫存檔登記資料庫連線"""
+    conn = sqlite3.connect(str(STORAGE_DB_PATH), timeout=30, isolation_level=None)
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS artifacts (
+            path TEXT PRIMARY KEY,
+            expires_at REAL NOT NULL
+        )
+    ''')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_artifacts_expires ON artifacts (expires_at)')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS leases (
+            path TEXT NOT NULL,
+            pid INTEGER NOT NULL,
+            count INTEGER NOT NULL,
+            PRIMARY KEY (path, pid)
+        )
+    ''')
+    return conn
+
+def get_temp_dir():
+    """取得暫存目錄"""
+    TEMP_DIR.mkdir(parents=True, exist_ok=True)
+    return TEMP_DIR
+
+def get_download_dir():
+    """取得下載目錄"""
+    DOWNLOAD_DIR.mkdir(parents=True, exist_ok=True)
+    return DOWNLOAD_DIR
+
+def scratch_dir(size_hint=None):
+    """取得工作用的暫存目錄：預估大小不超過 SCRATCH_MAX_BYTES 時使用記憶體暫存目錄"""
+    if SCRATCH_DIR and size_hint is not None and size_hint <= SCRATCH_MAX_BYTES:
+        path = Path(SCRATCH_DIR) / "anymusic"
+        try:
+            path.mkdir(parents=True, exist_ok=True)
+            return path
+        except OSError:
+            pass
+    return get_temp_dir()
+
+def track(path, ttl):
+    """登記產出的檔案，ttl 秒後由清理程序刪除（不論目錄的預設規則）"""
+    conn = _connect()
+    try:
+        conn.execute(
+            'INSERT OR REPLACE INTO artifacts (path, expires_at) VALUES (?, ?)',
+            (str(Path(path).resolve()), time.time() + ttl)
+        )
+    finally:
+        conn.close()
+
+def acquire(*paths):
+    """標記檔案使用中（等待中的工作輸入、正在送出的檔案），清理程序不會刪除"""
+    conn = _connect()
+    try:
+        conn.executemany(
+            '''INSERT INTO leases (path, pid, count) VALUES (?, ?, 1)
+               ON CONFLICT (path, pid) DO UPDATE SET count = count + 1''',
+            [(str(Path(path).resolve()), os.getpid()) for path in paths]
+        )
+    finally:
+        conn.close()
+
+def release(*paths):
+    """解除 acquire 的標記"""
+    conn = _connect()
+    try:
+        params = [(str(Path(path).resolve()), os.getpid()) for path in paths]
+        conn.executemany('UPDATE leases SET count = count - 1 WHERE path = ? AND pid = ?', params)
+        conn.execute('DELETE FROM leases WHERE count <= 0')
+    finally:
+        conn.close()
+
+@contextmanager
+def in_use(*paths):
+    acquire(*paths)
+    try:
+        yield
+    finally:
+        release(*paths)
+
+def _pid_alive(pid):
+    """檢查行程是否仍存在"""
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+def in_use_paths():
+    """使用中的檔案（絕對路徑），已結束行程留下的標記一併移除"""
+    conn = _connect()
+    try:
+        rows = conn.execute('SELECT DISTINCT pid FROM leases').fetchall()
+        dead = [(pid,) for pid, in rows if not _pid_alive(pid)]
+        conn.executemany('DELETE FROM leases WHERE pid = ?', dead)
+        return {path for path, in conn.execute('SELECT DISTINCT path FROM leases')}
+    finally:
+        conn.close()
+
+def touch(path):
+    """更新最後使用時間（容量不足時最久未使用的先刪除）
+
+    只更新 atime，mtime 保持不變，以 mtime 計算的 ETag／Last-Modified 才不會改變，
+    中斷的下載可以用 If-Range 續傳。
+    """
+    try:
+        stat = os.stat(str(path))
+        os.utime(str(path), ns=(time.time_ns(), stat.st_mtime_ns))
+    except OSError:
+        pass
+
+def send_and_delete(path, **kwargs):
+    """送出檔案後即刪除
+
+    開啟後立即刪除目錄項目（POSIX），回應仍持有檔案描述子，可由 WSGI 伺服器以
+    sendfile 直接送出，送完或連線中斷關閉時磁碟空間即釋放；無法刪除開啟中檔案的
+    系統改在回應結束時刪除。
+    """
+    path = Path(path)
+    f = open(str(path), 'rb')
+    size = os.fstat(f.fileno()).st_size
+    try:
+        path.unlink()
+        unlinked = True
+    except OSError:
+        unlinked = False
+    kwargs.setdefault('download_name', path.name)
+    response = send_file(f, **kwargs)
+    response.content_length = size  # 有長度才不會改用 chunked，伺服器才能使用 sendfile
+    if not unlinked:
+        response.call_on_close(lambda: path.unlink() if path.exists() else None)
+    return response
+
+def _files(directory, skip=()):
+    """列出目錄下的檔案 (路徑, 大小, 最後使用時間)，略過其他模組管理的子目錄"""
+    result = []
+    for root, dirs, names in os.walk(str(directory)):
+        if Path(root) == Path(directory):
+            dirs[:] = [d for d in dirs if d not in skip]
+        for name in names:
+            path = Path(root) / name
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue
+            result.append((path, stat.st_size, max(stat.st_mtime, stat.st_atime)))
+    return result
+
+def _remove(path):
+    try:
+        path.unlink()
+    except FileNotFoundError:
+        return
+    # 播放清單等子資料夾清空後一併移除
+    parent = path.parent
+    if parent not in (TEMP_DIR, DOWNLOAD_DIR):
+        try:
+            parent.rmdir()
+        except OSError:
+            pass
+
+def _sweep_dir(directory, ttl, max_bytes, tracked, now, skip=(), busy=()):
+    """刪除過期檔案，再依最後使用時間刪除到低於容量上限，回傳 (刪除數, 釋放位元組)
+
+    max_bytes 為 None 時不限容量；busy 中的檔案（使用中）一律保留。
+    """
+    removed = freed = 0
+    remaining = []
+    for path, size, used in _files(directory, skip):
+        resolved = str(path.resolve())
+        if resolved in busy:
+            continue
+        expires_at = tracked.get(resolved)
+        expired = now >= expires_at if expires_at is not None else (ttl > 0 and now - used > ttl)
+        if expired:
+            _remove(path)
+            removed += 1
+            freed += size
+        else:
+            remaining.append((path, size, used))
+
+    if max_bytes is None:
+        return removed, freed
+    total = sum(size for _, size, _ in remaining)
+    for path, size, used in sorted(remaining, key=lambda item: item[2]):
+        if total <= max_bytes:
+            break
+        if now - used < MIN_AGE or path.suffix in PARTIAL_SUFFIXES:
+            continue
+        _remove(path)
+        total -= size
+        removed += 1
+        freed += size
+    return removed, freed
+
+def sweep():
+    """清理暫存與下載目錄，回傳統計"""
+    now = time.time()
+    busy = in_use_paths()
+    conn = _connect()
+    try:
+        tracked = dict(conn.execute('SELECT path, expires_at FROM artifacts').fetchall())
+        stats = {
+            'temp': _sweep_dir(get_temp_dir(), TEMP_TTL, TEMP_MAX_BYTES, tracked, now, MANAGED_SUBDIRS, busy),
+            'downloads': _sweep_dir(get_download_dir(), DOWNLOAD_TTL, None, tracked, now, busy=busy),
+        }
+        if SCRATCH_DIR and (Path(SCRATCH_DIR) / "anymusic").exists():
+            stats['scratch'] = _sweep_dir(Path(SCRATCH_DIR) / "anymusic", TEMP_TTL, SCRATCH_MAX_BYTES, tracked, now, busy=busy)
+        # 已不存在的登記一併移除
+        stale = [(path,) for path in tracked if not os.path.exists(path)]
+        conn.executemany('DELETE FROM artifacts WHERE path = ?', stale)
+    finally:
+        conn.close()
+    removed = sum(count for count, _ in stats.values())
+    if removed:
+        freed = sum(size for _, size in stats.values())
+        print(f"[INFO] 已清理 {removed} 個暫存／下載檔案，釋放 {freed / 1024 / 1024:.1f} MB")
+    return stats
+
+def _reaper_loop():
+    lock_path = STORAGE_DB_PATH.with_suffix('.lock')
+    while True:
+        try:
+            if fcntl is None:
+                sweep()
+            else:
+                # 同一台主機的所有 worker 只需要一個在清理；鎖定檔的 mtime 記錄上次清理時間
+                with open(str(lock_path), 'a') as lock_file:
+                    try:
+                        fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    except OSError:
+                        pass
+                    else:
+                        stat = os.fstat(lock_file.fileno())
+                        if stat.st_size == 0 or time.time() - stat.st_mtime >= REAPER_INTERVAL:
+                            sweep()
+                            if stat.st_size == 0:
+                                lock_file.write('1')
+                                lock_file.flush()
+                            os.utime(str(lock_path))
+        except Exception as e:
+            print(f"[WARN] 清理暫存檔失敗: {e}")
+        time.sleep(REAPER_INTERVAL)
+
+def start_reaper():
+    """啟動背景清理執行緒（每個行程一次）"""
+    global _reaper_pid
+    with _reaper_lock:
+        if _reaper_pid == os.getpid():
+            return
+        _reaper_pid = os.getpid()
+    threading.Thread(target=_reaper_loop, daemon=True, name='storage-reaper').start()
+
+def _dir_usage():
+    """各目錄目前使用的位元組數（抓取指標時計算）"""
+    usage = {
+        (('dir', 'temp'),): sum(size for _, size, _ in _files(get_temp_dir())),
+        (('dir', 'downloads'),): sum(size for _, size, _ in _files(get_download_dir())),
+    }
+    if SCRATCH_DIR and (Path(SCRATCH_DIR) / "anymusic").exists():
+        usage[(('dir', 'scratch'),)] = sum(size for _, size, _ in _files(Path(SCRATCH_DIR) / "anymusic"))
+    return usage
+
+metrics.register_collector('anymusic_storage_bytes', '暫存、下載與記憶體暫存目錄的使用量', _dir_usage)
+
+startup.register_warmup('reaper', start_reaper, per_process=True)
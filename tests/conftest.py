@@ -0,0 +1,25 @@
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+# 各模組在匯入時讀取環境變數，必須在匯入前把資料庫與目錄指到暫存位置，避免動到正式資料
+_WORKDIR = Path(tempfile.mkdtemp(prefix='anymusic-tests-'))
+os.environ.update({
+    'TEMP_DIR': str(_WORKDIR / 'temp'),
+    'DOWNLOAD_DIR': str(_WORKDIR / 'downloads'),
+    'JOB_JOURNAL_PATH': str(_WORKDIR / 'jobs.db'),
+    'PROGRESS_DB_PATH': str(_WORKDIR / 'progress.db'),
+    'DOWNLOAD_CACHE_DB_PATH': str(_WORKDIR / 'cache.db'),
+    'STORAGE_DB_PATH': str(_WORKDIR / 'storage.db'),
+    'SHORT_URL_DB_PATH': str(_WORKDIR / 'short_urls.db'),
+    'PDF_SESSION_DIR': str(_WORKDIR / 'temp' / 'pdf_sessions'),
+    'FFMPEG_LOCK_DIR': str(_WORKDIR),
+    'WARMUP': '0',
+})
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import startup  # noqa: E402
+
+# 與 python -m startup 相同：匯入 app 時不在背景啟動下載工作執行緒等各行程步驟，測試直接呼叫需要的函式
+startup._hooked = True
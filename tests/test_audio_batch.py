@@ -0,0 +1,35 @@
+import pytest
+
+import audio_batch
+
+def test_short_form_and_json_targets():
+    assert audio_batch.parse_targets('mp3:128,opus:96') == [
+        {'format': 'mp3', 'bitrate': 128, 'sample_rate': 44100},
+        {'format': 'opus', 'bitrate': 96, 'sample_rate': 48000},
+    ]
+    assert audio_batch.parse_targets('[{"format": "aac", "bitrate": "160", "sample_rate": 48000}]') == [
+        {'format': 'aac', 'bitrate': 160, 'sample_rate': 48000},
+    ]
+
+@pytest.mark.parametrize('raw, message', [
+    ('mp3:fast', '位元率格式錯誤'),
+    ('mp3:192:high', '取樣率格式錯誤'),
+    ('[{"format": "mp3", "bitrate": [1]}]', '位元率格式錯誤'),
+    ('["mp3"]', '輸出目標格式錯誤'),
+    ('[1, 2]', '輸出目標格式錯誤'),
+    ('[{"format": ', '輸出目標格式錯誤'),
+])
+def test_malformed_targets_get_localized_errors(raw, message):
+    with pytest.raises(ValueError, match=f'^{message}') as error:
+        audio_batch.parse_targets(raw)
+    assert 'invalid literal' not in str(error.value)
+
+def test_batch_route_rejects_non_object_target_with_400():
+    from io import BytesIO
+
+    from app import app
+    response = app.test_client().post('/api/convert/batch', data={
+        'audio': (BytesIO(b'x'), 'a.wav'), 'targets': '["mp3"]',
+    })
+    assert response.status_code == 400
+    assert response.get_json()['error'].startswith('輸出目標格式錯誤')
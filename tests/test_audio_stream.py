@@ -0,0 +1,40 @@
+import io
+import os
+import subprocess
+import sys
+
+import audio_stream
+
+_real_popen = subprocess.Popen
+
+def _fake_ffmpeg(monkeypatch, seen):
+    """以 Python 代替 FFmpeg：把 -i 指定的檔案原樣輸出，並記錄啟動時輸入檔的內容"""
+    def popen(cmd, **kwargs):
+        path = cmd[cmd.index('-i') + 1]
+        with open(path, 'rb') as f:
+            seen.append((path, f.read(), kwargs.get('stdin')))
+        script = 'import shutil, sys; shutil.copyfileobj(open(sys.argv[1], "rb"), sys.stdout.buffer)'
+        return _real_popen([sys.executable, '-c', script, path], **kwargs)
+
+    monkeypatch.setattr(audio_stream.subprocess, 'Popen', popen)
+
+def test_trim_stream_reads_whole_upload_before_responding(monkeypatch):
+    from app import app
+
+    seen = []
+    _fake_ffmpeg(monkeypatch, seen)
+    body = bytes(range(256)) * 1024
+    response = app.test_client().post('/api/trim/stream?filename=a.mp3&start_time=0&end_time=5', data=body)
+    assert response.status_code == 200 and response.data == body
+    path, spooled, stdin = seen[0]
+    assert spooled == body and stdin == subprocess.DEVNULL  # FFmpeg 啟動前已讀完請求內容，沒有背景執行緒再讀
+    response.close()
+    assert not os.path.exists(path)
+
+def test_input_file_is_removed_after_response(monkeypatch, tmp_path):
+    seen = []
+    _fake_ffmpeg(monkeypatch, seen)
+    stream = audio_stream.FFmpegStream(io.BytesIO(b'abc'), '.mp3', [], [], tmp_path)
+    assert stream.start() is None
+    assert b''.join(stream.iter_output()) == b'abc'
+    assert list(tmp_path.glob('stream_*')) == []
@@ -0,0 +1,106 @@
+import io
+
+import pytest
+
+import audio_trim
+from audio_trim import parse_cuts, parse_time_range, parse_timestamp
+
+@pytest.mark.parametrize('value, expected', [
+    ('83.5', 83.5),
+    ('1:23.5', 83.5),
+    ('0:01:23.5', 83.5),
+    (' 2:00 ', 120.0),
+    (0, 0.0),
+])
+def test_parse_timestamp(value, expected):
+    assert parse_timestamp(value) == expected
+
+@pytest.mark.parametrize('value', ['', '1:7x', 'abc', '1:2:3:4', 'inf', 'nan', '-inf', '1:inf', ':30'])
+def test_parse_timestamp_rejects_malformed(value):
+    with pytest.raises(ValueError, match='時間格式錯誤'):
+        parse_timestamp(value)
+
+@pytest.mark.parametrize('value', ['-1', '1:-5', '-0:30', '0:-0'])
+def test_parse_timestamp_rejects_negative_components(value):
+    with pytest.raises(ValueError, match='不可為負數'):
+        parse_timestamp(value)
+
+def test_parse_time_range_requires_start_before_end():
+    assert parse_time_range('0:10', '0:20') == (10.0, 20.0)
+    with pytest.raises(ValueError, match='開始時間必須小於結束時間'):
+        parse_time_range('20', '10')
+
+def test_parse_cuts():
+    assert parse_cuts('0-10.5, 1:00-1:30.25,') == [(0.0, 10.5), (60.0, 90.25)]
+    for bad in ('', '10', '5-1', '0-1:7x'):
+        with pytest.raises(ValueError):
+            parse_cuts(bad)
+
+@pytest.fixture
+def client():
+    from app import app
+    return app.test_client()
+
+def test_trim_stream_rejects_malformed_time_instead_of_defaulting_to_zero(client):
+    response = client.post('/api/trim/stream?filename=a.mp3&start_time=5&end_time=1:7x', data=b'')
+    assert response.status_code == 400
+    assert '時間格式錯誤' in response.get_json()['error']
+
+def test_trim_job_rejects_malformed_time(client):
+    response = client.post('/api/jobs/trim', data={
+        'audio': (io.BytesIO(b'data'), 'a.mp3'), 'start_time': 'nan', 'end_time': '10',
+    }, content_type='multipart/form-data')
+    assert response.status_code == 400
+    assert '時間格式錯誤' in response.get_json()['error']
+
+def _record_commands(monkeypatch, codec):
+    commands = []
+    monkeypatch.setattr(audio_trim, '_probe_audio', lambda path: {'codec_name': codec, 'sample_rate': '44100', 'channels': 2})
+    monkeypatch.setattr(audio_trim, '_packet_times', lambda path, start, end: [start + i * 0.026 for i in range(80)])
+    monkeypatch.setattr(audio_trim, '_run', lambda cmd: commands.append(cmd) or '')
+    return commands
+
+def test_exact_mode_reencodes_whole_range_for_lossy_codecs(monkeypatch, tmp_path):
+    commands = _record_commands(monkeypatch, 'mp3')
+    audio_trim.cut_exact('in.mp3', tmp_path / 'out.mp3', 1.01, 9.99, tmp_path)
+    assert len(commands) == 1
+    assert 'copy' not in commands[0] and 'libmp3lame' in commands[0]
+
+def test_exact_mode_only_reencodes_boundaries_for_lossless_codecs(monkeypatch, tmp_path):
+    commands = _record_commands(monkeypatch, 'flac')
+    audio_trim.cut_exact('in.flac', tmp_path / 'out.flac', 1.01, 9.99, tmp_path)
+    segments, concat = commands[:-1], commands[-1]
+    assert any('copy' in cmd for cmd in segments)
+    assert 'concat' in concat
+
+def _fake_cuts(monkeypatch, fail_on=None):
+    def cut(input_path, output_path, start, end, temp_dir):
+        if start == fail_on:
+            raise audio_trim.TrimError('boom')
+        output_path.write_bytes(b'part')
+    monkeypatch.setattr(audio_trim, 'cut_fast', cut)
+
+def test_failed_zip_output_is_removed(monkeypatch, tmp_path):
+    _fake_cuts(monkeypatch)
+
+    def broken_write(self, *args, **kwargs):
+        raise audio_trim.TrimError('disk full')
+
+    monkeypatch.setattr(audio_trim.zipfile.ZipFile, 'write', broken_write)
+    with pytest.raises(audio_trim.TrimError):
+        audio_trim.trim('in.mp3', [(0, 1), (2, 3)], 'fast', 'zip', tmp_path / 'out.mp3', 'out', tmp_path)
+    assert list(tmp_path.iterdir()) == []
+
+def test_failed_cut_leaves_no_output(monkeypatch, tmp_path):
+    _fake_cuts(monkeypatch, fail_on=2)
+    for output_mode in ('zip', 'concat'):
+        with pytest.raises(audio_trim.TrimError):
+            audio_trim.trim('in.mp3', [(0, 1), (2, 3)], 'fast', output_mode, tmp_path / 'out.mp3', 'out', tmp_path)
+    assert list(tmp_path.iterdir()) == []
+
+def test_zip_output_for_multiple_cuts(monkeypatch, tmp_path):
+    _fake_cuts(monkeypatch)
+    result = audio_trim.trim('in.mp3', [(0, 1), (2, 3)], 'fast', 'zip', tmp_path / 'out.mp3', 'song', tmp_path)
+    assert result == tmp_path / 'out.zip'
+    with audio_trim.zipfile.ZipFile(str(result)) as zf:
+        assert zf.namelist() == ['song_01.mp3', 'song_02.mp3']
@@ -0,0 +1,166 @@
+import os
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+import pytest
+import yt_dlp
+
+import download_cache
+import startup
+import downloader
+
+_YoutubeDL = yt_dlp.YoutubeDL
+
+class _FakeYoutubeDL:
+    """以真正的輸出範本決定檔名、直接寫出檔案的 YoutubeDL（不連網、不需 FFmpeg）"""
+
+    videos = {
+        'https://example.com/a': {'id': 'aaa111', 'title': 'Same Song'},
+        'https://example.com/b': {'id': 'bbb222', 'title': 'Same Song'},
+    }
+
+    def __init__(self, opts):
+        self._ydl = _YoutubeDL({'outtmpl': opts['outtmpl'], 'quiet': True})
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self._ydl.close()
+
+    def prepare_filename(self, info):
+        return self._ydl.prepare_filename(info)
+
+    def extract_info(self, url, download=True):
+        info = dict(self.videos[url], ext='mp3', extractor_key='Fake')
+        path = Path(self.prepare_filename(info))
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(url)
+        info['requested_downloads'] = [{'filepath': str(path)}]
+        return info
+
+def test_output_template_includes_video_id(tmp_path):
+    with yt_dlp.YoutubeDL({'outtmpl': str(tmp_path / downloader.OUTPUT_TEMPLATE), 'quiet': True}) as ydl:
+        first = ydl.prepare_filename({'id': 'aaa111', 'title': 'Same Song', 'ext': 'mp3'})
+        second = ydl.prepare_filename({'id': 'bbb222', 'title': 'Same Song', 'ext': 'mp3'})
+    assert first != second
+    assert 'aaa111' in first and 'bbb222' in second
+
+def test_same_title_videos_get_their_own_files_and_cache_entries(monkeypatch):
+    monkeypatch.setattr(downloader.yt_dlp, 'YoutubeDL', _FakeYoutubeDL)
+    download_dir = downloader.get_download_dir()
+    outtmpl = str(download_dir / 'same-title' / downloader.OUTPUT_TEMPLATE)
+
+    first, _ = downloader._fetch_audio('https://example.com/a', outtmpl, lambda d: None)
+    second, _ = downloader._fetch_audio('https://example.com/b', outtmpl, lambda d: None)
+
+    assert first != second
+    assert (download_dir / first).read_text() == 'https://example.com/a'
+    assert (download_dir / second).read_text() == 'https://example.com/b'
+    for video_id, path in (('aaa111', first), ('bbb222', second)):
+        key = download_cache.make_cache_key('Fake', video_id, downloader.AUDIO_CODEC, downloader.AUDIO_QUALITY)
+        assert download_cache.lookup(key, download_dir)[0] == path
+
+def _run_worker(monkeypatch, claims, finished, stop):
+    """以假的佇列執行工作執行緒，claims 依序為例外或 _claim_next_job 的回傳值，用完後設定 stop"""
+    claims = iter(claims)
+
+    def claim(conn):
+        item = next(claims, None)
+        if item is None:
+            stop.set()
+            threading.Event().wait()  # 測試結束前停在這裡
+        if isinstance(item, Exception):
+            raise item
+        return item
+
+    monkeypatch.setattr(downloader, 'JOB_POLL_INTERVAL', 0.01)
+    monkeypatch.setattr(downloader, '_claim_next_job', claim)
+    monkeypatch.setattr(downloader, '_finish_job', lambda conn, task_id, status: finished.append((task_id, status)))
+    threading.Thread(target=downloader._worker_loop, daemon=True).start()
+    assert stop.wait(5)
+
+def test_worker_survives_claim_errors(monkeypatch):
+    def download_single(url, task_id):
+        downloader.progress_store.update(task_id, status='completed')
+
+    monkeypatch.setattr(downloader, 'download_single', download_single)
+    finished = []
+    stop = threading.Event()
+    claims = [sqlite3.OperationalError('database is locked'), ('job-ok', 'https://example.com/a', 0, time.time())]
+    _run_worker(monkeypatch, claims, finished, stop)
+    assert finished == [('job-ok', 'completed')]
+
+def test_worker_marks_crashed_job_as_error_and_continues(monkeypatch):
+    def download_single(url, task_id):
+        if task_id == 'job-crash':
+            raise RuntimeError('boom')
+        downloader.progress_store.update(task_id, status='completed')
+
+    monkeypatch.setattr(downloader, 'download_single', download_single)
+    finished = []
+    stop = threading.Event()
+    claims = [('job-crash', 'https://example.com/a', 0, time.time()), ('job-next', 'https://example.com/b', 0, time.time())]
+    _run_worker(monkeypatch, claims, finished, stop)
+    assert finished == [('job-crash', 'error'), ('job-next', 'completed')]
+    assert downloader.progress_store.get('job-crash')['status'] == 'error'
+
+@pytest.fixture
+def journal(tmp_path, monkeypatch):
+    """獨立的工作日誌，不啟動工作執行緒"""
+    monkeypatch.setattr(downloader, 'JOB_JOURNAL_PATH', tmp_path / 'jobs.db')
+    monkeypatch.setattr(downloader, 'init_download_workers', lambda: None)
+    conn = downloader._journal()
+    yield conn
+    conn.close()
+
+def test_jobs_are_claimed_by_priority_then_fifo(journal):
+    low = downloader.start_download('https://example.com/low', is_playlist=True, priority=5)
+    first = downloader.start_download('https://example.com/first', is_playlist=True)
+    second = downloader.start_download('https://example.com/second', is_playlist=True)
+    claimed = [downloader._claim_next_job(journal)[0] for _ in range(3)]
+    assert claimed == [first, second, low]
+    assert downloader._claim_next_job(journal) is None
+    owners = journal.execute("SELECT DISTINCT status, owner_pid, owner_host FROM jobs").fetchall()
+    assert owners == [('running', os.getpid(), downloader._owner_host(os.getpid()))]
+
+def test_same_video_is_queued_once(journal):
+    url = 'https://www.youtube.com/watch?v=dQw4w9WgXcQ'
+    task_id = downloader.start_download(url)
+    assert downloader.start_download(url) == task_id
+    downloader._finish_job(journal, task_id, 'error')
+    assert downloader.start_download(url) != task_id
+
+def test_jobs_of_dead_processes_are_requeued(journal):
+    me = downloader._owner_host(os.getpid())
+    rows = (
+        ('alive', os.getpid(), me),
+        ('other-container', os.getpid(), 'old-host' + me[me.index('/'):]),  # 重新啟動後同樣的 PID
+        ('reused-pid', os.getpid(), me.rsplit('/', 1)[0] + '/1'),
+        ('legacy', os.getpid(), None),
+    )
+    for task_id, pid, host in rows:
+        journal.execute(
+            "INSERT INTO jobs (task_id, url, is_playlist, status, owner_pid, owner_host, created_at) VALUES (?, 'u', 0, 'running', ?, ?, 0)",
+            (task_id, pid, host)
+        )
+    downloader._recover_jobs(journal)
+    statuses = dict(journal.execute('SELECT task_id, status FROM jobs').fetchall())
+    assert statuses == {'alive': 'running', 'other-container': 'queued', 'reused-pid': 'queued', 'legacy': 'queued'}
+
+def test_old_journal_gains_owner_host_column(tmp_path, monkeypatch):
+    path = tmp_path / 'old.db'
+    conn = sqlite3.connect(str(path))
+    conn.execute('''CREATE TABLE jobs (task_id TEXT PRIMARY KEY, url TEXT NOT NULL, is_playlist INTEGER NOT NULL,
+        priority INTEGER NOT NULL DEFAULT 0, status TEXT NOT NULL, owner_pid INTEGER, cache_key TEXT, created_at REAL NOT NULL)''')
+    conn.close()
+    monkeypatch.setattr(downloader, 'JOB_JOURNAL_PATH', path)
+    conn = downloader._journal()
+    assert 'owner_host' in {row[1] for row in conn.execute('PRAGMA table_info(jobs)')}
+    conn.close()
+
+def test_download_workers_start_with_each_worker_process():
+    steps = {name: per_process for name, _, per_process in startup._steps}
+    assert steps['download_workers'] is True
@@ -0,0 +1,29 @@
+import pytest
+
+import pdf_edit
+
+def test_page_range_ignores_out_of_range_and_empty_parts():
+    assert pdf_edit.parse_page_range('1-3, 5,,9-12', 10) == [1, 2, 3, 5, 9, 10]
+    assert pdf_edit.parse_page_range('', 3) == [1, 2, 3]
+    assert pdf_edit.parse_page_range('1-999999999', 4) == [1, 2, 3, 4]
+
+@pytest.mark.parametrize('pages', ['a', '1-x', '1-2-3', '1.5'])
+def test_malformed_page_range_gets_localized_message(pages):
+    with pytest.raises(ValueError, match='^頁碼格式錯誤') as error:
+        pdf_edit.parse_page_range(pages, 10)
+    assert 'invalid literal' not in str(error.value)
+
+def test_page_order_keeps_order_and_rejects_out_of_range():
+    assert pdf_edit.parse_page_order('3,1-2,5-4', 5) == [3, 1, 2, 5, 4]
+    with pytest.raises(ValueError, match='超出範圍'):
+        pdf_edit.parse_page_order('1-999999999', 5)
+    with pytest.raises(ValueError, match='^頁碼格式錯誤'):
+        pdf_edit.parse_page_order('2,b', 5)
+
+def test_compile_plan_reports_malformed_numbers():
+    with pytest.raises(ValueError, match='^旋轉角度格式錯誤'):
+        pdf_edit.compile_plan([{'op': 'rotate', 'angle': 'left'}], [3])
+    with pytest.raises(ValueError, match='^插入位置格式錯誤'):
+        pdf_edit.compile_plan([{'op': 'merge', 'file': 'extra', 'after': 'end'}], [3, 2])
+    plan = pdf_edit.compile_plan([{'op': 'delete', 'pages': '2'}, {'op': 'rotate', 'pages': 1, 'angle': 90}], [3])
+    assert plan == [(0, 0, 90), (0, 2, 0)]
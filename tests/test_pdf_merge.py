@@ -0,0 +1,171 @@
+from io import BytesIO
+
+import pytest
+from PyPDF2 import PdfReader, PdfWriter
+from PyPDF2.generic import (
+    ArrayObject,
+    BooleanObject,
+    DictionaryObject,
+    NameObject,
+    NullObject,
+    NumberObject,
+    TextStringObject,
+)
+
+import pdf_merge
+
+def _write_pdf(path, pages, outline=(), field=None):
+    """pages 頁的空白 PDF；outline 為 [(標題, 頁面索引, 子項目標題清單)]，field 為放在第一頁的文字欄位名稱"""
+    writer = PdfWriter()
+    for _ in range(pages):
+        writer.add_blank_page(200, 200)
+    for title, index, children in outline:
+        parent = writer.add_outline_item(title, index)
+        for child in children:
+            writer.add_outline_item(child, index, parent=parent)
+    if field:
+        widget = writer._add_object(DictionaryObject({
+            NameObject('/Type'): NameObject('/Annot'),
+            NameObject('/Subtype'): NameObject('/Widget'),
+            NameObject('/FT'): NameObject('/Tx'),
+            NameObject('/T'): TextStringObject(field),
+            NameObject('/Rect'): ArrayObject([NumberObject(10), NumberObject(10), NumberObject(100), NumberObject(30)]),
+            NameObject('/P'): writer.pages[0].indirect_reference,
+        }))
+        writer.pages[0][NameObject('/Annots')] = ArrayObject([widget])
+        writer._root_object[NameObject('/AcroForm')] = DictionaryObject({
+            NameObject('/Fields'): ArrayObject([widget]),
+            NameObject('/DA'): TextStringObject('/Helv 0 Tf 0 g'),
+            NameObject('/NeedAppearances'): BooleanObject(True),
+        })
+    with open(path, 'wb') as f:
+        writer.write(f)
+    return path
+
+def _merge(sources, plan, **kwargs):
+    return PdfReader(BytesIO(b''.join(pdf_merge.write_pages(sources, plan, **kwargs))))
+
+def _outline_titles(reader, items=None):
+    result = []
+    for item in reader.outline if items is None else items:
+        if isinstance(item, list):
+            result.append(_outline_titles(reader, item))
+        else:
+            result.append((item.title, reader.get_destination_page_number(item)))
+    return result
+
+def test_outlines_from_all_sources_point_at_merged_pages(tmp_path):
+    a = _write_pdf(tmp_path / 'a.pdf', 2, [('A1', 0, ['A1.1']), ('A2', 1, [])])
+    b = _write_pdf(tmp_path / 'b.pdf', 3, [('B1', 2, [])])
+    reader = _merge([a, b], pdf_merge.merge_plan([2, 3]))
+    assert len(reader.pages) == 5
+    assert _outline_titles(reader) == [('A1', 0), [('A1.1', 0)], ('A2', 1), ('B1', 4)]
+
+def test_outlines_follow_reordered_and_dropped_pages(tmp_path):
+    a = _write_pdf(tmp_path / 'a.pdf', 3, [('first', 0, []), ('last', 2, [])])
+    reader = _merge([a], [(0, 2, 0), (0, 0, 90)])
+    assert _outline_titles(reader) == [('first', 1), ('last', 0)]
+
+def test_form_fields_are_kept_for_output_pages_only(tmp_path):
+    a = _write_pdf(tmp_path / 'a.pdf', 2, field='name')
+    b = _write_pdf(tmp_path / 'b.pdf', 2, field='email')
+    reader = _merge([a, b], [(0, 0, 0), (1, 1, 0)])
+    fields = reader.get_fields()
+    assert set(fields) == {'name'}
+    form = reader.trailer['/Root']['/AcroForm']
+    assert form['/NeedAppearances'] == True and form['/DA'] == '/Helv 0 Tf 0 g'
+    widget = form['/Fields'][0].get_object()
+    assert widget.get('/P').idnum == reader.pages[0].indirect_reference.idnum
+
+def test_plain_sources_have_no_outline_or_form(tmp_path):
+    a = _write_pdf(tmp_path / 'a.pdf', 2)
+    root = _merge([a], pdf_merge.merge_plan([2])).trailer['/Root']
+    assert '/Outlines' not in root and '/AcroForm' not in root
+
+def _image_ids(reader, pages):
+    return [reader.pages[i]['/Resources'].get('/XObject').get('/Im1').idnum for i in pages]
+
+def test_copier_dedupes_identical_resources_across_sources(tmp_path):
+    from benchmarks.fixtures import write_pdf
+
+    a = tmp_path / 'a.pdf'
+    write_pdf(a, pages=2)
+    b = tmp_path / 'b.pdf'
+    b.write_bytes(a.read_bytes())
+    reader = _merge([a, b], pdf_merge.merge_plan([2, 2]))
+    ids = _image_ids(reader, range(4))
+    assert ids[:2] == ids[2:] and ids[0] != ids[1]
+
+def test_repeated_and_rotated_pages_get_their_own_page_objects(tmp_path):
+    a = _write_pdf(tmp_path / 'a.pdf', 2)
+    reader = _merge([a], [(0, 0, 0), (0, 0, 90), (0, 1, 0)])
+    refs = [page.indirect_reference.idnum for page in reader.pages]
+    assert len(set(refs)) == 3
+    assert [page.get('/Rotate', 0) for page in reader.pages] == [0, 90, 0]
+
+def _with_link(path):
+    """第一頁有連到第二頁的連結"""
+    writer = PdfWriter()
+    for _ in range(2):
+        writer.add_blank_page(200, 200)
+    link = writer._add_object(DictionaryObject({
+        NameObject('/Type'): NameObject('/Annot'),
+        NameObject('/Subtype'): NameObject('/Link'),
+        NameObject('/Rect'): ArrayObject([NumberObject(0), NumberObject(0), NumberObject(50), NumberObject(50)]),
+        NameObject('/Dest'): ArrayObject([writer.pages[1].indirect_reference, NameObject('/Fit')]),
+    }))
+    writer.pages[0][NameObject('/Annots')] = ArrayObject([link])
+    with open(path, 'wb') as f:
+        writer.write(f)
+    return path
+
+def test_links_follow_pages_and_become_null_when_target_is_dropped(tmp_path):
+    a = _with_link(tmp_path / 'a.pdf')
+    reader = _merge([a], [(0, 1, 0), (0, 0, 0)])
+    dest = reader.pages[1]['/Annots'][0].get_object()['/Dest']
+    assert dest[0].idnum == reader.pages[0].indirect_reference.idnum
+
+    reader = _merge([a], [(0, 0, 0)])
+    dest = reader.pages[0]['/Annots'][0].get_object()['/Dest']
+    assert isinstance(dest[0], NullObject)
+
+def test_object_streams_output_is_readable(tmp_path):
+    from pdf_optimize import OptimizeOptions
+
+    a = _write_pdf(tmp_path / 'a.pdf', 3, [('A1', 2, [])], field='name')
+    reader = _merge([a], pdf_merge.merge_plan([3]), optimize=OptimizeOptions())
+    assert len(reader.pages) == 3
+    assert _outline_titles(reader) == [('A1', 2)]
+    assert set(reader.get_fields()) == {'name'}
+
+def test_file_inputs_are_read_through_mmap(tmp_path, monkeypatch):
+    import mmap
+
+    buffers = []
+    real = pdf_merge.PdfReader
+
+    def reader(stream, **kwargs):
+        buffers.append(stream)
+        return real(stream, **kwargs)
+
+    monkeypatch.setattr(pdf_merge, 'PdfReader', reader)
+    a = _write_pdf(tmp_path / 'a.pdf', 2)
+    assert pdf_merge.page_counts([a]) == [2]
+    assert len(_merge([a], pdf_merge.merge_plan([2])).pages) == 2
+    assert buffers and all(isinstance(b, mmap.mmap) and b.closed for b in buffers)
+
+def test_empty_input_is_rejected(tmp_path):
+    empty = tmp_path / 'empty.pdf'
+    empty.write_bytes(b'')
+    with pytest.raises(ValueError, match='是空的'):
+        pdf_merge.page_counts([empty])
+
+def test_rotating_page_with_indirect_rotate(tmp_path):
+    writer = PdfWriter()
+    writer.add_blank_page(200, 200)
+    writer.pages[0][NameObject('/Rotate')] = writer._add_object(NumberObject(90))
+    path = tmp_path / 'indirect.pdf'
+    with open(path, 'wb') as f:
+        writer.write(f)
+    reader = _merge([path], [(0, 0, 90), (0, 0, 0)])
+    assert [page['/Rotate'] for page in reader.pages] == [180, 90]
@@ -0,0 +1,24 @@
+import threading
+
+import pdf_optimize
+
+def test_concurrent_callers_share_one_executor(monkeypatch):
+    monkeypatch.setattr(pdf_optimize, '_executor', None)
+    monkeypatch.setattr(pdf_optimize, '_executor_pid', None)
+    created = []
+    real = pdf_optimize.ThreadPoolExecutor
+
+    def executor(**kwargs):
+        created.append(kwargs)
+        threading.Event().wait(0.05)  # 拉長建立時間，沒有鎖時其他執行緒會各建一個
+        return real(**kwargs)
+
+    monkeypatch.setattr(pdf_optimize, 'ThreadPoolExecutor', executor)
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(pdf_optimize._get_executor())) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(created) == 1 and len({id(r) for r in results}) == 1
+    results[0].shutdown()
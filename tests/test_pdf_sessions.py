@@ -0,0 +1,62 @@
+import io
+import threading
+from io import BytesIO
+
+from PyPDF2 import PdfWriter
+from werkzeug.datastructures import FileStorage
+
+import pdf_sessions
+
+def _upload():
+    writer = PdfWriter()
+    writer.add_blank_page(100, 100)
+    buffer = BytesIO()
+    writer.write(buffer)
+    buffer.seek(0)
+    return FileStorage(buffer, 'a.pdf')
+
+def test_same_content_shares_one_session():
+    first = pdf_sessions.create_session(_upload())
+    second = pdf_sessions.create_session(_upload())
+    assert first['session_id'] == second['session_id'] and first['pages'] == 1
+
+def test_delete_keeps_shared_file_for_other_users():
+    session_id = pdf_sessions.create_session(_upload())['session_id']
+    pdf_sessions.create_session(_upload())  # 另一位使用者上傳相同檔案
+    assert pdf_sessions.delete_session(session_id)
+    assert session_id not in pdf_sessions._cache
+    assert pdf_sessions.session_info(session_id)['pages'] == 1
+    assert pdf_sessions.session_path(session_id).exists()
+
+def test_delete_unknown_session():
+    assert not pdf_sessions.delete_session('0' * 64)
+    assert not pdf_sessions.delete_session('../etc/passwd')
+
+def test_idle_sessions_expire(monkeypatch):
+    session_id = pdf_sessions.create_session(_upload())['session_id']
+    monkeypatch.setattr(pdf_sessions, 'PDF_SESSION_TTL', -1)
+    monkeypatch.setattr(pdf_sessions, '_last_evict', 0)
+    pdf_sessions.evict_expired()
+    assert not pdf_sessions.delete_session(session_id)
+
+def test_streaming_readers_do_not_block_each_other():
+    session_id = pdf_sessions.create_session(_upload())['session_id']
+    opened = threading.Event()
+    with pdf_sessions.open_session(session_id) as slow:  # 例如讀取很慢的客戶端
+        def other():
+            with pdf_sessions.open_session(session_id) as reader:
+                assert len(reader.pages) == 1
+            opened.set()
+
+        threading.Thread(target=other, daemon=True).start()
+        assert opened.wait(5)
+        assert len(slow.pages) == 1
+
+def test_mapped_views_keep_their_own_position():
+    session_id = pdf_sessions.create_session(_upload())['session_id']
+    buffer = pdf_sessions._get(session_id).buffer
+    first, second = pdf_sessions._MappedView(buffer), pdf_sessions._MappedView(buffer)
+    assert first.read(5) == b'%PDF-'
+    second.seek(-5, io.SEEK_END)
+    assert first.read(1) == buffer[5:6] and second.read() == buffer[-5:]
+    assert first.tell() == 6 and second.read(10) == b''
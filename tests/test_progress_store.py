@@ -0,0 +1,98 @@
+import socket
+import subprocess
+import sys
+
+import pytest
+
+import downloader
+import ffmpeg_jobs
+from progress_store import MemoryProgressStore, SQLiteProgressStore, public_view
+
+@pytest.fixture(params=['memory', 'sqlite'])
+def store(request, tmp_path):
+    if request.param == 'memory':
+        return MemoryProgressStore()
+    return SQLiteProgressStore(tmp_path / 'progress.db')
+
+def _dead_pid():
+    proc = subprocess.Popen([sys.executable, '-c', 'pass'])
+    proc.wait()
+    return proc.pid
+
+def _job(status, pid):
+    return {
+        'kind': 'convert', 'status': status, 'progress': 0, 'error': None,
+        'output': '/srv/temp/secret.mp3', 'download_name': 'a.mp3', 'mimetype': 'audio/mpeg',
+        'owner': [socket.gethostname(), pid],
+    }
+
+def test_update_merges_fields_and_finished_entries_are_not_unfinished(store):
+    store.create('t1', {'status': 'queued', 'progress': 0, 'files': []})
+    store.update('t1', status='downloading', progress=42.5)
+    assert store.get('t1') == {'status': 'downloading', 'progress': 42.5, 'files': []}
+    assert [task_id for task_id, _ in store.unfinished()] == ['t1']
+    store.update('t1', status='completed', files=['a.mp3'])
+    assert store.get('t1')['files'] == ['a.mp3']
+    assert store.unfinished() == []
+
+def test_update_of_unknown_task_is_ignored(store):
+    store.update('missing', status='completed')
+    assert store.get('missing') is None
+
+def test_public_view_hides_server_paths():
+    view = public_view(_job('running', 1))
+    assert 'output' not in view and 'owner' not in view and 'mimetype' not in view
+    assert view['status'] == 'running'
+
+def test_download_progress_route_does_not_leak_ffmpeg_job_fields(monkeypatch, store):
+    monkeypatch.setattr(downloader, 'progress_store', store)
+    store.create('job', _job('completed', 1))
+    status = downloader.get_progress('job')
+    assert status['status'] == 'completed'
+    assert 'output' not in status and 'download_name' not in status
+
+def test_orphaned_jobs_are_marked_failed(monkeypatch, store):
+    monkeypatch.setattr(ffmpeg_jobs, 'job_store', store)
+    store.create('orphan', _job('queued', _dead_pid()))
+    store.create('alive', _job('running', ffmpeg_jobs.os.getpid()))
+    store.create('download', {'status': 'queued', 'progress': 0})
+
+    assert ffmpeg_jobs.fail_orphaned_jobs() == 1
+    assert store.get('orphan')['status'] == 'error'
+    assert store.get('alive')['status'] == 'running'
+    assert store.get('download')['status'] == 'queued'
+
+def test_stream_closes_after_max_duration(monkeypatch):
+    import progress_store
+    monkeypatch.setattr(progress_store, 'SSE_MAX_DURATION', 0.2)
+    monkeypatch.setattr(progress_store, 'SSE_POLL_INTERVAL', 0.05)
+    events = list(progress_store.stream_status(lambda: {'status': 'downloading', 'progress': 10}))
+    assert events[0].startswith('retry:')
+    assert sum(event.startswith('data:') for event in events) == 1
+
+def test_stream_ends_when_task_finishes():
+    import progress_store
+    events = list(progress_store.stream_status(lambda: {'status': 'completed', 'progress': 100}))
+    assert events[-1] == 'data: {"status": "completed", "progress": 100}\n\n'
+
+def test_streams_over_the_limit_send_a_snapshot_and_close(monkeypatch):
+    import threading
+    import progress_store
+    monkeypatch.setattr(progress_store, '_stream_slots', threading.BoundedSemaphore(1))
+    held = progress_store.stream_status(lambda: {'status': 'downloading', 'progress': 0})
+    next(held)  # 佔用唯一的名額
+
+    events = list(progress_store.stream_status(lambda: {'status': 'downloading', 'progress': 5}))
+    assert events == [f'retry: {progress_store.SSE_BUSY_RETRY}\n\n', 'data: {"status": "downloading", "progress": 5}\n\n']
+
+    held.close()  # 連線關閉後釋放名額
+    assert progress_store._stream_slots.acquire(blocking=False)
+
+def test_entries_created_finished_expire(store, monkeypatch):
+    import progress_store
+    monkeypatch.setattr(progress_store, 'PROGRESS_TTL', -1)
+    store.create('cache-hit', {'status': 'completed', 'progress': 100})
+    store.create('running', {'status': 'downloading', 'progress': 10})
+    store.evict_expired(force=True)
+    assert store.get('cache-hit') is None
+    assert store.get('running')['status'] == 'downloading'
@@ -0,0 +1,33 @@
+import pytest
+
+import qr_codes
+
+TOO_LONG_FOR_H = 'x' * 2000  # 小於 MAX_CONTENT_LENGTH，但 H 等級下超過版本 40
+
+def test_overflow_at_chosen_level_gets_localized_message():
+    options = qr_codes.parse_qr_options({'error_correction': 'H'})
+    with pytest.raises(ValueError, match='內容過長') as error:
+        qr_codes.get_qr(TOO_LONG_FOR_H, options)
+    assert 'Invalid version' not in str(error.value)
+
+def test_same_content_fits_at_lower_level():
+    data, mimetype, etag = qr_codes.get_qr(TOO_LONG_FOR_H, qr_codes.parse_qr_options({'error_correction': 'L'}))
+    assert mimetype == 'image/png' and data.startswith(b'\x89PNG') and etag
+
+def test_batch_reports_localized_errors_per_item():
+    options = qr_codes.parse_qr_options({'error_correction': 'H', 'format': 'svg'})
+    results = qr_codes.render_batch(['ok', TOO_LONG_FOR_H, ''], options, 'zip')
+    assert results[0][0].startswith(b'<svg') and results[0][1] is None
+    assert results[1] == (None, '內容過長，請降低錯誤修正等級或縮短內容')
+    assert results[2] == (None, '請輸入內容')
+
+def test_qrcode_route_returns_localized_overflow_error():
+    from app import app
+    response = app.test_client().post('/api/qrcode', json={'content': TOO_LONG_FOR_H, 'error_correction': 'H'})
+    assert response.status_code == 400
+    assert response.get_json()['error'] == '內容過長，請降低錯誤修正等級或縮短內容'
+
+@pytest.mark.parametrize('values', [{'format': 'gif'}, {'size': 41}, {'size': 'abc'}, {'error_correction': 'X'}, {'border': 99}])
+def test_invalid_options_are_rejected(values):
+    with pytest.raises(ValueError):
+        qr_codes.parse_qr_options(values)
@@ -0,0 +1,48 @@
+import pytest
+
+import short_urls
+
+@pytest.mark.parametrize('number', [1, 2, 61, 62, 123456789, short_urls.CODE_SPACE - 1])
+def test_codes_round_trip(number):
+    code = short_urls.encode_id(number)
+    assert len(code) == short_urls.CODE_LENGTH
+    assert short_urls.decode_code(code) == number
+
+def test_consecutive_ids_give_unrelated_codes():
+    codes = [short_urls.encode_id(n) for n in range(1, 20)]
+    for a, b in zip(codes, codes[1:]):
+        assert sum(x != y for x, y in zip(a, b)) >= 3, (a, b)
+
+@pytest.mark.parametrize('code', ['', 'abc', 'abcdefgh', 'abc-efg', '測試代碼測試代'])
+def test_malformed_codes_are_not_found(code):
+    with pytest.raises(short_urls.ShortUrlNotFound):
+        short_urls.decode_code(code)
+
+@pytest.mark.parametrize('url, expected', [
+    ('example.com/a', 'https://example.com/a'),
+    ('example.com:8080/a', 'https://example.com:8080/a'),
+    ('  http://example.com  ', 'http://example.com'),
+])
+def test_normalize_url(url, expected):
+    assert short_urls.normalize_url(url) == expected
+
+@pytest.mark.parametrize('url', ['', 'javascript:alert(1)', 'ftp://example.com', 'https://', 'https://x/' + 'a' * 3000])
+def test_normalize_url_rejects(url):
+    with pytest.raises(ValueError):
+        short_urls.normalize_url(url)
+
+def test_same_url_shares_code_and_hits_are_counted():
+    short_url, code = short_urls.shorten('example.com/shared', 'http://localhost:5000/')
+    assert short_url == f'http://localhost:5000/s/{code}'
+    assert short_urls.shorten('https://example.com/shared', 'http://other')[1] == code
+
+    assert short_urls.resolve(code) == 'https://example.com/shared'
+    assert short_urls.resolve(code) == 'https://example.com/shared'
+    assert short_urls.url_stats(code)['hits'] == 2  # 尚未寫入的點擊也會計入
+    short_urls.flush_hits()
+    stats = short_urls.url_stats(code)
+    assert stats['hits'] == 2 and stats['last_hit'] is not None
+
+def test_unknown_code_is_not_found():
+    with pytest.raises(short_urls.ShortUrlNotFound):
+        short_urls.resolve(short_urls.encode_id(10 ** 9))
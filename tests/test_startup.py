@@ -0,0 +1,15 @@
+import time
+
+import startup
+
+def test_import_time_is_measured_from_worker_fork_when_not_preloaded(monkeypatch):
+    monkeypatch.setitem(startup._state, 'import_seconds', None)
+    monkeypatch.setattr(startup, 'IMPORT_STARTED', time.perf_counter() - 100)  # master 匯入設定檔的時間
+    startup.after_fork()
+    assert time.perf_counter() - startup.IMPORT_STARTED < 5
+
+def test_preloaded_import_time_is_kept_after_fork(monkeypatch):
+    monkeypatch.setitem(startup._state, 'import_seconds', 1.5)
+    started = startup.IMPORT_STARTED
+    startup.after_fork()
+    assert startup.IMPORT_STARTED == started
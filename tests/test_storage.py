@@ -0,0 +1,73 @@
+import os
+import subprocess
+import sys
+import time
+
+import download_cache
+import storage
+
+def _write(path, size, age):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_bytes(b'x' * size)
+    old = time.time() - age
+    os.utime(str(path), (old, old))
+    return path
+
+def test_quota_pass_keeps_in_use_and_partial_files(tmp_path):
+    leased = _write(tmp_path / 'queued_input.wav', 100, 600)
+    partial = _write(tmp_path / 'song [id].mp3.part', 100, 600)
+    stale = _write(tmp_path / 'old.mp3', 100, 600)
+    recent = _write(tmp_path / 'new.mp3', 100, 0)
+
+    with storage.in_use(leased):
+        removed, freed = storage._sweep_dir(
+            tmp_path, 3600, 150, {}, time.time(), busy=storage.in_use_paths())
+
+    assert (removed, freed) == (1, 100)
+    assert leased.exists() and partial.exists() and recent.exists()
+    assert not stale.exists()
+
+def test_in_use_files_are_not_expired(tmp_path):
+    leased = _write(tmp_path / 'serving.mp3', 10, 7200)
+    with storage.in_use(leased):
+        storage._sweep_dir(tmp_path, 3600, None, {}, time.time(), busy=storage.in_use_paths())
+        assert leased.exists()
+    storage._sweep_dir(tmp_path, 3600, None, {}, time.time(), busy=storage.in_use_paths())
+    assert not leased.exists()
+
+def test_leases_are_counted_and_dropped_for_dead_processes(tmp_path):
+    path = tmp_path / 'a.wav'
+    resolved = str(path.resolve())
+    storage.acquire(path)
+    storage.acquire(path)
+    storage.release(path)
+    assert resolved in storage.in_use_paths()
+    storage.release(path)
+    assert resolved not in storage.in_use_paths()
+
+    proc = subprocess.Popen([sys.executable, '-c', 'pass'])
+    proc.wait()
+    conn = storage._connect()
+    conn.execute('INSERT INTO leases (path, pid, count) VALUES (?, ?, 1)', (resolved, proc.pid))
+    conn.close()
+    assert resolved not in storage.in_use_paths()
+
+def test_downloads_have_no_second_size_quota(tmp_path):
+    big = _write(tmp_path / 'big.mp3', 1000, 600)
+    assert storage._sweep_dir(tmp_path, 0, None, {}, time.time()) == (0, 0)
+    assert big.exists()
+
+def test_cache_eviction_skips_files_in_use(tmp_path, monkeypatch):
+    monkeypatch.setattr(download_cache, 'DOWNLOAD_CACHE_MAX_BYTES', 250)
+    monkeypatch.setattr(download_cache, 'DOWNLOAD_CACHE_DB_PATH', tmp_path / 'cache.db')
+    serving = _write(tmp_path / 'serving.mp3', 100, 0)
+    idle = _write(tmp_path / 'idle.mp3', 100, 0)
+    download_cache.store('k:serving', 'serving.mp3', 'Serving', tmp_path)
+    download_cache.store('k:idle', 'idle.mp3', 'Idle', tmp_path)
+    new = _write(tmp_path / 'new.mp3', 100, 0)
+
+    with storage.in_use(serving):
+        download_cache.store('k:new', 'new.mp3', 'New', tmp_path)
+
+    assert serving.exists() and new.exists()
+    assert not idle.exists()
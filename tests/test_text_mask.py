@@ -0,0 +1,76 @@
+import io
+
+import pytest
+
+import text_mask
+
+def test_overlapping_patterns_are_masked_once():
+    pattern = text_mask.get_mask_pattern(['email', 'phone'])
+    masked, items, count = text_mask.mask_text('寄到 a@b.com 或撥 02-2345-6789', pattern)
+    assert masked == '寄到 ******* 或撥 ************'
+    assert count == 2 and [item['type'] for item in items] == ['email', 'phone']
+
+def test_custom_pattern_groups_do_not_shift_defaults():
+    custom = [{'name': 'order', 'pattern': r'(ORD)-(\d+)'}]
+    pattern = text_mask.get_mask_pattern(['email'], custom)
+    masked, items, _ = text_mask.mask_text('ORD-42 a@b.com', pattern)
+    assert masked == '****** *******'
+    assert [item['type'] for item in items] == ['order', 'email']
+
+@pytest.mark.parametrize('regex', [r'(\w+)\s\1', r'(?P<x>a)(?P=x)'])
+def test_backreferences_are_rejected(regex):
+    with pytest.raises(ValueError, match='反向參照'):
+        text_mask.get_mask_pattern(None, [{'name': 'c', 'pattern': regex}])
+
+@pytest.mark.parametrize('regex', [r'(a+)+b', r'(?:\w*\s)*x', r'(a|b+)*?c'])
+def test_nested_unbounded_repeats_are_rejected(regex):
+    with pytest.raises(ValueError, match='巢狀重複'):
+        text_mask.get_mask_pattern(None, [{'name': 'c', 'pattern': regex}])
+
+@pytest.mark.parametrize('regex', [r'(a{1,3})+', r'\d{4}-\d+', r'(?:ab)*c'])
+def test_bounded_patterns_are_allowed(regex):
+    assert text_mask.get_mask_pattern(None, [{'name': 'c', 'pattern': regex}])
+
+def test_invalid_and_oversized_patterns_are_rejected():
+    with pytest.raises(ValueError, match='格式錯誤'):
+        text_mask.get_mask_pattern(None, [{'name': 'c', 'pattern': '(abc'}])
+    with pytest.raises(ValueError, match='過長'):
+        text_mask.get_mask_pattern(None, [{'name': 'c', 'pattern': 'a' * (text_mask.MAX_PATTERN_LENGTH + 1)}])
+
+def test_input_cap_applies_only_to_custom_patterns(monkeypatch):
+    monkeypatch.setattr(text_mask, 'MASK_CUSTOM_MAX_INPUT', 10)
+    text_mask._compile.cache_clear()
+    try:
+        text_mask.get_mask_pattern().check_input(10 ** 9)
+        custom = text_mask.get_mask_pattern(None, [{'name': 'c', 'pattern': 'x'}])
+        custom.check_input(10)
+        with pytest.raises(ValueError, match='自訂模式'):
+            custom.check_input(11)
+    finally:
+        text_mask._compile.cache_clear()
+
+def test_stream_masks_matches_across_chunks():
+    pattern = text_mask.get_mask_pattern(['email'])
+    data = ('x' * (text_mask.STREAM_CHUNK_SIZE - 3) + ' user@example.com ').encode('utf-8')
+    chunks = [data[i:i + text_mask.STREAM_CHUNK_SIZE] for i in range(0, len(data), text_mask.STREAM_CHUNK_SIZE)]
+    output = b''.join(text_mask.mask_stream(chunks, pattern))
+    assert output.endswith(b' ' + b'*' * len('user@example.com') + b' ')
+    assert len(output) == len(data)
+
+def test_route_rejects_oversized_text_for_custom_patterns(monkeypatch):
+    from app import app
+    monkeypatch.setattr(text_mask, 'MASK_CUSTOM_MAX_INPUT', 10)
+    text_mask._compile.cache_clear()
+    try:
+        client = app.test_client()
+        custom = [{'name': 'c', 'pattern': 'x'}]
+        response = client.post('/api/mask-text', json={'text': 'x' * 11, 'custom_patterns': custom})
+        assert response.status_code == 400
+        response = client.post('/api/mask-text', data={
+            'file': (io.BytesIO(b'x' * 11), 'a.txt'), 'custom_patterns': '[{"name": "c", "pattern": "x"}]',
+        })
+        assert response.status_code == 400
+        response = client.post('/api/mask-text', json={'text': 'x' * 10, 'custom_patterns': custom})
+        assert response.status_code == 200
+    finally:
+        text_mask._compile.cache_clear()
@@ -0,0 +1,81 @@
+import io
+import zipfile
+
+import pytest
+from flask import Flask
+
+import storage
+import zip_stream
+from delivery import zip_response
+
+@pytest.fixture
+def entries(tmp_path):
+    files = []
+    for index, size in enumerate((0, 1000, 200000)):
+        path = tmp_path / f'{index}.mp3'
+        path.write_bytes(bytes((index + i) % 251 for i in range(size)))
+        files.append((f'歌曲 {index}.mp3', path))
+    zip_stream._crc_cache.clear()
+    return files
+
+def test_stored_zip_is_valid_and_sized_in_advance(entries):
+    archive = zip_stream.StoredZip(entries)
+    data = b''.join(archive.iter_range())
+    assert len(data) == archive.size
+    with zipfile.ZipFile(io.BytesIO(data)) as zf:
+        assert zf.testzip() is None
+        assert [info.filename for info in zf.infolist()] == [name for name, _ in entries]
+        assert zf.read('歌曲 2.mp3') == entries[2][1].read_bytes()
+
+def test_any_range_matches_full_output_even_without_cached_crc(entries):
+    archive = zip_stream.StoredZip(entries)
+    full = b''.join(archive.iter_range())
+    # 切點落在標頭、檔案內容、data descriptor 與中央目錄中
+    for start in (0, 10, 1100, 50000, archive.central_offset - 5, archive.central_offset + 3, archive.size - 1):
+        zip_stream._crc_cache.clear()
+        assert b''.join(archive.iter_range(start)) == full[start:], start
+    assert b''.join(archive.iter_range(100, 70000)) == full[100:70000]
+
+def test_changed_file_is_detected(entries):
+    archive = zip_stream.StoredZip(entries)
+    entries[1][1].write_bytes(b'short')
+    with pytest.raises(RuntimeError, match='檔案已變更'):
+        b''.join(archive.iter_range())
+
+def _request(entries, headers=None):
+    app = Flask(__name__)
+    with app.test_request_context(headers=headers or {}):
+        response = zip_response(entries)
+        body = b''.join(response.response) if response.status_code in (200, 206) else b''
+        response.close()
+    return response, body
+
+def test_range_request_resumes_download(entries):
+    full_response, full = _request(entries)
+    assert full_response.status_code == 200 and full_response.accept_ranges == 'bytes'
+    etag = full_response.get_etag()[0]
+
+    response, body = _request(entries, {'Range': 'bytes=1500-', 'If-Range': f'"{etag}"'})
+    assert response.status_code == 206
+    assert body == full[1500:]
+    assert response.content_range.start == 1500 and response.content_range.length == len(full)
+
+def test_stale_if_range_gets_full_archive(entries):
+    response, body = _request(entries, {'Range': 'bytes=1500-', 'If-Range': '"other"'})
+    assert response.status_code == 200 and len(body) == zip_stream.StoredZip(entries).size
+
+def test_unsatisfiable_range_and_not_modified(entries):
+    size = zip_stream.StoredZip(entries).size
+    response, _ = _request(entries, {'Range': f'bytes={size + 10}-'})
+    assert response.status_code == 416
+    etag = zip_stream.StoredZip(entries).etag
+    response, _ = _request(entries, {'If-None-Match': f'"{etag}"'})
+    assert response.status_code == 304
+
+def test_entries_are_in_use_until_response_closes(entries):
+    app = Flask(__name__)
+    with app.test_request_context():
+        response = zip_response(entries)
+        assert str(entries[2][1]) in storage.in_use_paths()
+        response.close()
+    assert str(entries[2][1]) not in storage.in_use_paths()
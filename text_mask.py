@@ -0,0 +1,196 @@
+import os
+import re
+import codecs
+from functools import lru_cache
+
+try:
+    from re import _parser as sre_parse, _constants as sre_constants  # Python 3.11+
+except ImportError:
+    import sre_parse
+    import sre_constants
+
+# 預設敏感資訊模式（順序即優先順序：同一位置符合多個模式時取前面的）
+DEFAULT_PATTERNS = {
+    'email': r'\b[A-Za-z0-9._%+-]+@[A-Za-z0-9.-]+\.[A-Z|a-z]{2,}\b',
+    'credit_card': r'\b\d{4}[-\s]?\d{4}[-\s]?\d{4}[-\s]?\d{4}\b',
+    'id': r'\b[A-Z][12]\d{8}\b',  # 台灣身分證
+    'phone': r'\b0\d{1,2}[-\s]?\d{3,4}[-\s]?\d{3,4}\b',
+}
+MAX_CUSTOM_PATTERNS = 20
+MAX_PATTERN_LENGTH = 500
+MAX_REPORTED_ITEMS = 1000  # 回應中最多列出的項目（遮蓋本身不受限制）
+COMPILED_CACHE_SIZE = 128
+# 自訂模式無法保證比對時間，限制每次請求掃描的內容大小（在請求執行緒上執行）
+MASK_CUSTOM_MAX_INPUT = int(os.environ.get('MASK_CUSTOM_MAX_INPUT', str(1024 * 1024)))  # 位元組
+
+_REPEAT_OPS = tuple(getattr(sre_constants, name) for name in ('MAX_REPEAT', 'MIN_REPEAT', 'POSSESSIVE_REPEAT') if hasattr(sre_constants, name))
+_GROUPREF_OPS = (sre_constants.GROUPREF, sre_constants.GROUPREF_EXISTS)
+
+# 串流處理：每次讀取的字元數、保留給跨區塊比對的長度、\b 等判斷需要的前文長度
+STREAM_CHUNK_SIZE = 64 * 1024
+STREAM_OVERLAP = 4096
+STREAM_CONTEXT = 16
+
+class MaskPattern:
+    """已編譯的合併模式：所有模式組成一個交替式，單次掃描即可找出互不重疊的片段"""
+
+    def __init__(self, regex, names, max_input=None):
+        self.regex = regex
+        self.names = names  # 群組名稱 -> 模式名稱
+        self.max_input = max_input  # 含自訂模式時可掃描的位元組上限
+
+    def check_input(self, size):
+        """內容超過自訂模式的掃描上限時拋出 ValueError"""
+        if self.max_input is not None and size > self.max_input:
+            raise ValueError(f'使用自訂模式時內容最多 {self.max_input // 1024} KB')
+
+    def spans(self, text, pos=0):
+        """依序產生 (開始, 結束, 模式名稱)，略過長度為 0 的比對
+
+        pos 之前的文字仍會作為 \\b 等判斷的前文。
+        """
+        for match in self.regex.finditer(text, pos):
+            start, end = match.span()
+            if start != end:
+                yield start, end, self.names[match.lastgroup]
+
+def _check_tree(name, items, in_repeat=False):
+    """拒絕反向參照（合併後群組編號會改變）與巢狀的無上限重複（可能造成災難性回溯）"""
+    for op, av in items:
+        if op in _GROUPREF_OPS:
+            raise ValueError(f'自訂模式 {name} 不支援反向參照')
+        if op in _REPEAT_OPS:
+            unbounded = av[1] == sre_constants.MAXREPEAT
+            if unbounded and in_repeat:
+                raise ValueError(f'自訂模式 {name} 含有巢狀重複（例如 (a+)+），可能導致比對過久')
+            _check_tree(name, av[2], in_repeat or unbounded)
+        elif op is sre_constants.SUBPATTERN:
+            _check_tree(name, av[-1], in_repeat)
+        elif op is sre_constants.BRANCH:
+            for branch in av[1]:
+                _check_tree(name, branch, in_repeat)
+        elif op in (sre_constants.ASSERT, sre_constants.ASSERT_NOT):
+            _check_tree(name, av[1], in_repeat)
+        elif op is getattr(sre_constants, 'ATOMIC_GROUP', None):
+            _check_tree(name, av, in_repeat)
+
+def _validate_custom(custom_patterns):
+    """檢查自訂模式，回傳可雜湊的 ((名稱, 模式), ...)"""
+    if not custom_patterns:
+        return ()
+    if not isinstance(custom_patterns, list) or len(custom_patterns) > MAX_CUSTOM_PATTERNS:
+        raise ValueError(f'自訂模式必須是陣列，最多 {MAX_CUSTOM_PATTERNS} 個')
+    result = []
+    for index, item in enumerate(custom_patterns):
+        if isinstance(item, dict):
+            name, pattern = str(item.get('name') or f'custom_{index + 1}'), item.get('pattern')
+        else:
+            name, pattern = f'custom_{index + 1}', item
+        if not isinstance(pattern, str) or not pattern:
+            raise ValueError(f'自訂模式 {name} 不可為空')
+        if len(pattern) > MAX_PATTERN_LENGTH:
+            raise ValueError(f'自訂模式 {name} 過長（最多 {MAX_PATTERN_LENGTH} 字元）')
+        try:
+            tree = sre_parse.parse(pattern)
+        except re.error as e:
+            raise ValueError(f'自訂模式格式錯誤: {e}')
+        _check_tree(name, tree)
+        result.append((name[:50], pattern))
+    return tuple(result)
+
+@lru_cache(maxsize=COMPILED_CACHE_SIZE)
+def _compile(selected, custom):
+    """把選取的預設模式與自訂模式合併編譯（以內容為快取鍵，相同設定只編譯一次）"""
+    parts = []
+    names = {}
+    for index, (name, pattern) in enumerate([(n, DEFAULT_PATTERNS[n]) for n in selected] + list(custom)):
+        group = f'_p{index}'
+        names[group] = name
+        parts.append(f'(?P<{group}>{pattern})')
+    try:
+        regex = re.compile('|'.join(parts))
+    except re.error as e:
+        raise ValueError(f'自訂模式格式錯誤: {e}')
+    return MaskPattern(regex, names, MASK_CUSTOM_MAX_INPUT if custom else None)
+
+def get_mask_pattern(patterns=None, custom_patterns=None):
+    """取得已編譯的合併模式
+
+    patterns 為預設模式名稱清單（未指定且沒有自訂模式時使用全部預設模式），
+    custom_patterns 為 [{"name": "...", "pattern": "正規表示式"}]。
+    """
+    custom = _validate_custom(custom_patterns)
+    if patterns:
+        unknown = [name for name in patterns if name not in DEFAULT_PATTERNS]
+        if unknown:
+            raise ValueError(f'不支援的模式: {", ".join(map(str, unknown))}')
+        selected = tuple(name for name in DEFAULT_PATTERNS if name in patterns)
+    elif custom:
+        selected = ()
+    else:
+        selected = tuple(DEFAULT_PATTERNS)
+    if not selected and not custom:
+        raise ValueError('請至少選擇一個模式')
+    return _compile(selected, custom)
+
+def mask_text(text, mask_pattern, mask_char='*'):
+    """單次掃描遮蓋文字，回傳 (遮蓋後文字, 項目清單, 總數)
+
+    只替換比對到的位置，不會誤遮其他地方出現的相同字串。
+    """
+    output = []
+    items = []
+    count = 0
+    last = 0
+    for start, end, name in mask_pattern.spans(text):
+        masked = mask_char * (end - start)
+        output.append(text[last:start])
+        output.append(masked)
+        last = end
+        count += 1
+        if len(items) < MAX_REPORTED_ITEMS:
+            items.append({'type': name, 'original': text[start:end], 'masked': masked, 'start': start})
+    output.append(text[last:])
+    return ''.join(output), items, count
+
+def mask_stream(chunks, mask_pattern, mask_char='*', encoding='utf-8'):
+    """逐塊遮蓋位元組串流（例如上傳的大型文字檔），產生遮蓋後的位元組
+
+    每次保留結尾 STREAM_OVERLAP 個字元與下一塊一起比對，跨區塊的片段也能遮蓋；
+    長度超過 STREAM_OVERLAP 的單一片段可能被截斷。
+    """
+    decoder = codecs.getincrementaldecoder(encoding)(errors='replace')
+    buffer = ''
+    position = 0  # buffer 中尚未輸出的起點（之前的字元只作為前文）
+    done = False
+    chunks = iter(chunks)
+    while not done:
+        chunk = next(chunks, None)
+        if chunk is None:
+            buffer += decoder.decode(b'', final=True)
+            done = True
+            cut = len(buffer)
+        else:
+            buffer += decoder.decode(chunk)
+            cut = len(buffer) - STREAM_OVERLAP
+            if cut <= position:
+                continue
+
+        output = []
+        last = position
+        for start, end, _ in mask_pattern.spans(buffer, position):
+            if start >= cut:
+                break
+            output.append(buffer[last:start])
+            output.append(mask_char * (end - start))
+            last = end
+        # 片段可能超過 cut，下一輪從片段結尾繼續
+        end_position = max(cut, last)
+        output.append(buffer[last:end_position])
+        data = ''.join(output)
+        if data:
+            yield data.encode(encoding)
+
+        keep = max(0, end_position - STREAM_CONTEXT)
+        buffer = buffer[keep:]
+        position = end_position - keep
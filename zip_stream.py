@@ -0,0 +1,229 @@
+import os
+import time
+import struct
+import zlib
+import zipfile
+
+ZIP_CHUNK_SIZE = 64 * 1024
+
+class _StreamBuffer:
+    """只能寫入、不可回溯的輸出，讓 zipfile 改用 data descriptor 格式"""
+
+    def __init__(self):
+        self._data = bytearray()
+        self._position = 0
+
+    def write(self, data):
+        self._data += data
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def flush(self):
+        pass
+
+    def take(self):
+        """取出目前累積的資料"""
+        data = bytes(self._data)
+        self._data.clear()
+        return data
+
+class ZipStream:
+    """邊產生邊輸出的 ZIP，記憶體只保留一個區塊
+
+    每個方法都是產生器，回傳可直接寫入回應的位元組區塊。
+    """
+
+    def __init__(self, compression=zipfile.ZIP_STORED):
+        self.compression = compression
+        self._buffer = _StreamBuffer()
+        self._zip = zipfile.ZipFile(self._buffer, 'w', compression)
+
+    def _drain(self):
+        data = self._buffer.take()
+        if data:
+            yield data
+
+    def add_file(self, path, arcname):
+        """加入磁碟上的檔案，分段讀取"""
+        info = zipfile.ZipInfo.from_file(str(path), arcname)
+        info.compress_type = self.compression
+        size = os.path.getsize(str(path))
+        with open(str(path), 'rb') as src, self._zip.open(info, 'w', force_zip64=size >= zipfile.ZIP64_LIMIT) as dst:
+            for chunk in iter(lambda: src.read(ZIP_CHUNK_SIZE), b''):
+                dst.write(chunk)
+                yield from self._drain()
+        yield from self._drain()
+
+    def add_bytes(self, data, arcname):
+        """加入記憶體中的資料"""
+        info = zipfile.ZipInfo(arcname, time.localtime()[:6])
+        info.compress_type = self.compression
+        self._zip.writestr(info, data)
+        yield from self._drain()
+
+    def close(self):
+        """寫入中央目錄並結束"""
+        self._zip.close()
+        yield from self._drain()
+
+ZIP64_LIMIT = 0xFFFFFFFF
+CRC_CACHE_SIZE = 4096
+
+_crc_cache = {}  # (路徑, 大小, mtime_ns) -> CRC32
+
+def _dos_time(timestamp):
+    t = time.localtime(max(timestamp, 315532800))  # ZIP 最早只能表示 1980 年
+    return (t.tm_hour << 11) | (t.tm_min << 5) | (t.tm_sec // 2), ((t.tm_year - 1980) << 9) | (t.tm_mon << 5) | t.tm_mday
+
+class StoredZip:
+    """內容固定的 STORED ZIP，輸出長度事先可知，可從任意位置開始產生（支援 Range 續傳）
+
+    每個檔案使用 data descriptor，本地標頭不需要 CRC，可以直接開始輸出；CRC 在輸出
+    檔案內容時順便計算。從中途續傳時，跳過的檔案只在寫入 data descriptor 與中央目錄
+    時才讀取計算（結果會快取）。單一檔案需小於 4GB，總大小超過 4GB 時使用 ZIP64 結尾。
+    """
+
+    def __init__(self, entries):
+        """entries 為 [(壓縮檔內名稱, 檔案路徑)]"""
+        self.entries = []
+        self.segments = []  # (開始位置, 長度, 類型, 項目索引)
+        offset = 0
+        for arcname, path in entries:
+            stat = os.stat(str(path))
+            if stat.st_size >= ZIP64_LIMIT:
+                raise ValueError(f'檔案過大: {arcname}')
+            name = arcname.encode('utf-8')
+            entry = {
+                'name': name, 'path': str(path), 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns,
+                'dos': _dos_time(stat.st_mtime), 'offset': offset,
+            }
+            index = len(self.entries)
+            self.entries.append(entry)
+            for kind, length in (('header', 30 + len(name)), ('data', stat.st_size), ('descriptor', 16)):
+                self.segments.append((offset, length, kind, index))
+                offset += length
+        self.central_offset = offset
+        self.central = self._central_layout()
+        self.segments.append((offset, self.central, 'central', None))
+        self.size = offset + self.central
+
+    def _needs_zip64(self):
+        return len(self.entries) >= 0xFFFF or self.central_offset >= ZIP64_LIMIT
+
+    def _central_layout(self):
+        """中央目錄與結尾記錄的長度（與 CRC 無關，可先計算）"""
+        length = 0
+        for entry in self.entries:
+            length += 46 + len(entry['name']) + (12 if entry['offset'] >= ZIP64_LIMIT else 0)
+        if self._needs_zip64() or self.central_offset + length >= ZIP64_LIMIT:
+            length += 56 + 20
+        return length + 22
+
+    @property
+    def etag(self):
+        """依檔名、大小與修改時間計算，內容不變時相同"""
+        import hashlib
+        digest = hashlib.sha1()
+        for entry in self.entries:
+            digest.update(b'%s\0%d\0%d\0' % (entry['name'], entry['size'], entry['mtime_ns']))
+        return digest.hexdigest()
+
+    def _key(self, entry):
+        return (entry['path'], entry['size'], entry['mtime_ns'])
+
+    def _crc(self, entry):
+        crc = _crc_cache.get(self._key(entry))
+        if crc is None:
+            crc = 0
+            with open(entry['path'], 'rb') as f:
+                for chunk in iter(lambda: f.read(ZIP_CHUNK_SIZE * 16), b''):
+                    crc = zlib.crc32(chunk, crc)
+            self._remember_crc(entry, crc)
+        return crc
+
+    def _remember_crc(self, entry, crc):
+        if len(_crc_cache) >= CRC_CACHE_SIZE:
+            _crc_cache.pop(next(iter(_crc_cache)))
+        _crc_cache[self._key(entry)] = crc
+
+    def _header(self, entry):
+        time_, date = entry['dos']
+        return struct.pack(
+            '<IHHHHHIIIHH', 0x04034b50, 20, 0x0808, 0, time_, date, 0, 0, 0, len(entry['name']), 0
+        ) + entry['name']
+
+    def _descriptor(self, entry):
+        return struct.pack('<IIII', 0x08074b50, self._crc(entry), entry['size'], entry['size'])
+
+    def _central_bytes(self):
+        records = []
+        for entry in self.entries:
+            time_, date = entry['dos']
+            zip64 = entry['offset'] >= ZIP64_LIMIT
+            extra = struct.pack('<HHQ', 0x0001, 8, entry['offset']) if zip64 else b''
+            records.append(struct.pack(
+                '<IHHHHHHIIIHHHHHII', 0x02014b50, 45 if zip64 else 20, 45 if zip64 else 20, 0x0808, 0,
+                time_, date, self._crc(entry), entry['size'], entry['size'], len(entry['name']), len(extra),
+                0, 0, 0, 0, ZIP64_LIMIT if zip64 else entry['offset']
+            ) + entry['name'] + extra)
+        directory = b''.join(records)
+        count = len(self.entries)
+        end = b''
+        if self._needs_zip64() or self.central_offset + len(directory) >= ZIP64_LIMIT:
+            zip64_end_offset = self.central_offset + len(directory)
+            end += struct.pack(
+                '<IQHHIIQQQQ', 0x06064b50, 44, 45, 45, 0, 0, count, count, len(directory), self.central_offset
+            )
+            end += struct.pack('<IIQI', 0x07064b50, 0, zip64_end_offset, 1)
+            end += struct.pack(
+                '<IHHHHIIH', 0x06054b50, 0, 0, 0xFFFF, 0xFFFF, ZIP64_LIMIT, ZIP64_LIMIT, 0
+            )
+        else:
+            end += struct.pack(
+                '<IHHHHIIH', 0x06054b50, 0, 0, count, count, len(directory), self.central_offset, 0
+            )
+        return directory + end
+
+    def _file_data(self, entry, start, stop):
+        """輸出檔案內容 [start, stop)；從頭完整輸出時順便計算 CRC"""
+        whole = start == 0 and stop == entry['size'] and self._key(entry) not in _crc_cache
+        crc = 0
+        with open(entry['path'], 'rb') as f:
+            if os.fstat(f.fileno()).st_size != entry['size']:
+                raise RuntimeError(f"檔案已變更: {entry['name'].decode('utf-8')}")
+            f.seek(start)
+            remaining = stop - start
+            while remaining > 0:
+                chunk = f.read(min(ZIP_CHUNK_SIZE, remaining))
+                if not chunk:
+                    raise RuntimeError(f"檔案已變更: {entry['name'].decode('utf-8')}")
+                if whole:
+                    crc = zlib.crc32(chunk, crc)
+                remaining -= len(chunk)
+                yield chunk
+        if whole:
+            self._remember_crc(entry, crc)
+
+    def iter_range(self, start=0, stop=None):
+        """產生 [start, stop) 範圍的位元組"""
+        stop = self.size if stop is None else stop
+        for offset, length, kind, index in self.segments:
+            if offset + length <= start or length == 0:
+                continue
+            if offset >= stop:
+                break
+            begin = max(start, offset) - offset
+            end = min(stop, offset + length) - offset
+            if kind == 'data':
+                yield from self._file_data(self.entries[index], begin, end)
+                continue
+            if kind == 'header':
+                data = self._header(self.entries[index])
+            elif kind == 'descriptor':
+                data = self._descriptor(self.entries[index])
+            else:
+                data = self._central_bytes()
+            yield data[begin:end]